@@ -0,0 +1 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
@@ -0,0 +1,152 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+"""
+Measure the bot's hot queries with and without the indexes from migration 0012_hot_query_indexes.
+
+Everything happens in one transaction that is rolled back at the end: a large dataset is seeded, each query
+is explained and timed with the indexes in place ("after"), the indexes are dropped, and the queries are
+explained and timed again ("before"). Nothing is left behind, but run it against a development database all
+the same. Run from the mobot/ directory, with the same environment as the bot (DATABASE etc.):
+
+    python -m benchmarks.indexes [--customers 50000] [--drops 100] [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import timedelta
+
+
+def seed(customers, drops):
+    "Fill the tables with `drops` drops and `customers` customers who each have a session and preferences."
+    from django.utils import timezone
+    from mobot_client.models import BonusCoin, Customer, CustomerStorePreferences, Drop, DropSession, Item, Store
+
+    store = Store.objects.create(name="Benchmark", phone_number="+10000000000", description="", privacy_policy_url="")
+    item = Item.objects.create(store=store, name="Benchmark item")
+    now = timezone.now()
+    Drop.objects.bulk_create([
+        Drop(store=store, item=item, pre_drop_description="", number_restriction="+", timezone="UTC",
+             advertisment_start_time=now + timedelta(days=i - drops - 1),
+             start_time=now + timedelta(days=i - drops), end_time=now + timedelta(days=i - drops, hours=12),
+             initial_coin_limit=customers)
+        for i in range(drops)
+    ], batch_size=1000)
+    drop_list = list(Drop.objects.filter(store=store))
+    BonusCoin.objects.bulk_create([
+        BonusCoin(drop=drop, amount_pmob=amount, number_available=customers)
+        for drop in drop_list for amount in (1, 2, 5)
+    ], batch_size=1000)
+    bonus_coins = list(BonusCoin.objects.filter(drop__store=store))
+
+    Customer.objects.bulk_create([Customer(phone_number=f"+1555{i:08d}") for i in range(customers)], batch_size=5000)
+    customer_list = list(Customer.objects.filter(phone_number__startswith="+1555"))
+    CustomerStorePreferences.objects.bulk_create([
+        CustomerStorePreferences(customer=customer, store=store, allows_contact=bool(i % 2))
+        for i, customer in enumerate(customer_list)
+    ], batch_size=5000)
+
+    sessions = []
+    for i, customer in enumerate(customer_list):
+        drop = drop_list[i % len(drop_list)]
+        # Most sessions are finished; a few are still open.
+        state = 3 if i % 10 else i % 3
+        bonus_coin = random.choice(bonus_coins) if state == 3 else None
+        sessions.append(DropSession(customer=customer, drop=drop, state=state, bonus_coin_claimed=bonus_coin))
+    DropSession.objects.bulk_create(sessions, batch_size=5000)
+    return store, customer_list, drop_list, bonus_coins
+
+
+def hot_queries(store, customers, drops, bonus_coins):
+    "name -> function returning a fresh queryset, as the bot builds them."
+    from django.utils import timezone
+    from mobot_client.models import CustomerStorePreferences, Drop, DropSession
+
+    return {
+        "open session for customer": lambda: DropSession.objects.filter(
+            customer=random.choice(customers), state__gte=0, state__lt=3),
+        "completed session for customer and drop": lambda: DropSession.objects.filter(
+            customer=random.choice(customers), drop=random.choice(drops), state=3),
+        "initial coins claimed for drop": lambda: DropSession.objects.filter(
+            drop=random.choice(drops), state__gt=0),
+        "bonus coins claimed for drop": lambda: DropSession.objects.filter(
+            drop=random.choice(drops), bonus_coin_claimed=random.choice(bonus_coins)),
+        "store preferences for customer": lambda: CustomerStorePreferences.objects.filter(
+            customer=random.choice(customers), store=store),
+        "active drop": lambda: Drop.objects.filter(start_time__lte=timezone.now(), end_time__gte=timezone.now()),
+        "advertising drop": lambda: Drop.objects.filter(
+            advertisment_start_time__lte=timezone.now(), start_time__gt=timezone.now()),
+    }
+
+
+def measure(queries, repeat):
+    "name -> (query plan lines, ms per query)"
+    results = {}
+    for name, make in queries.items():
+        plan = make().explain().strip().splitlines()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            make().count() if "claimed" in name else list(make()[:1])
+        results[name] = (plan, (time.perf_counter() - start) * 1000 / repeat)
+    return results
+
+
+def drop_new_indexes():
+    "Drop the indexes and constraints added by 0012_hot_query_indexes, inside the current transaction."
+    from django.db import DatabaseError, connection, transaction
+    from mobot_client.models import CustomerStorePreferences, Drop, DropSession
+
+    editor = connection.SchemaEditorClass(connection, collect_sql=True)
+    with connection.cursor() as cursor:
+        for model in (Drop, CustomerStorePreferences, DropSession):
+            for index in model._meta.indexes + model._meta.constraints:
+                try:
+                    with transaction.atomic():
+                        cursor.execute(str(index.remove_sql(model, editor)))
+                except DatabaseError as e:
+                    # e.g. SQLite builds a plain unique constraint into the table itself.
+                    print(f"Keeping {index.name}: {e}")
+
+
+def analyze():
+    from django.db import connection
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=50000)
+    parser.add_argument("--drops", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mobot.settings")
+    import django
+    django.setup()
+    from django.db import transaction
+
+    with transaction.atomic():
+        start = time.perf_counter()
+        fixtures = seed(args.customers, args.drops)
+        analyze()
+        print(f"Seeded {args.customers} customers and sessions across {args.drops} drops "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        queries = hot_queries(*fixtures)
+        after = measure(queries, args.repeat)
+        drop_new_indexes()
+        analyze()
+        before = measure(queries, args.repeat)
+        transaction.set_rollback(True)
+
+    for name in queries:
+        (before_plan, before_ms), (after_plan, after_ms) = before[name], after[name]
+        print(f"\n{name}: {before_ms:.3f} ms -> {after_ms:.3f} ms ({before_ms / after_ms:.1f}x)")
+        print("  before: " + "\n          ".join(before_plan))
+        print("  after:  " + "\n          ".join(after_plan))
+
+
+if __name__ == "__main__":
+    main()
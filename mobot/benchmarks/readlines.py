@@ -0,0 +1,90 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+"""
+Compare the buffered signald line reader against the old byte-at-a-time reader.
+
+Run from the mobot/ directory:
+
+    python -m benchmarks.readlines [--messages 5000] [--size 900]
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+from typing import Iterator, List  # noqa
+
+from signald_client.main import readlines
+
+
+def readlines_bytewise(s: socket.socket) -> Iterator[bytes]:
+    "The original reader: one recv call per byte."
+    buf = []  # type: List[bytes]
+    while True:
+        char = s.recv(1)
+        if not char:
+            raise ConnectionResetError("connection was reset")
+
+        if char == b"\n":
+            yield b"".join(buf)
+            buf = []
+        else:
+            buf.append(char)
+
+
+def make_envelope(i, size):
+    "Build a signald message envelope whose encoded length is roughly `size` bytes."
+    envelope = {
+        "type": "message",
+        "data": {
+            "username": "+15555555555",
+            "source": {"number": "+447700900%03d" % (i % 1000), "uuid": "55555555-5555-5555-5555-555555555555"},
+            "sourceDevice": 1,
+            "timestamp": 1623456789000 + i,
+            "timestampISO": "2021-06-12T00:13:09.000Z",
+            "serverTimestamp": 1623456789100 + i,
+            "hasLegacyMessage": False,
+            "hasContent": True,
+            "isUnidentifiedSender": True,
+            "dataMessage": {"timestamp": 1623456789000 + i, "body": "", "expiresInSeconds": 0},
+        },
+    }
+    padding = max(size - len(json.dumps(envelope)), 0)
+    envelope["data"]["dataMessage"]["body"] = "x" * padding
+    return json.dumps(envelope).encode("utf8") + b"\n"
+
+
+def run(reader, payload, count):
+    "Time how long `reader` takes to yield `count` lines of `payload` from a socket pair."
+    ours, theirs = socket.socketpair()
+    writer = threading.Thread(target=theirs.sendall, args=(payload,), daemon=True)
+    start = time.perf_counter()
+    writer.start()
+    lines = reader(ours)
+    for _ in range(count):
+        next(lines)
+    elapsed = time.perf_counter() - start
+    writer.join()
+    ours.close()
+    theirs.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--size", type=int, nargs="+", default=[300, 900, 4000])
+    args = parser.parse_args()
+
+    for size in args.size:
+        payload = b"".join(make_envelope(i, size) for i in range(args.messages))
+        bytewise = run(readlines_bytewise, payload, args.messages)
+        buffered = run(readlines, payload, args.messages)
+        print(f"{args.messages} messages of ~{size} bytes: "
+              f"bytewise {bytewise * 1000:.1f} ms, buffered {buffered * 1000:.1f} ms, "
+              f"{bytewise / buffered:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
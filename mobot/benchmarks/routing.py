@@ -0,0 +1,71 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+"""
+Measure chat-handler dispatch cost as the number of handlers grows, comparing the compiled Router with the old
+linear scan that ran re.search against every handler in turn.
+
+Run from the mobot/ directory:
+
+    python -m benchmarks.routing [--handlers 10 50 200 1000] [--messages 20000]
+"""
+
+import argparse
+import re
+import time
+
+from signald_client.routing import Route, Router, keyword_regex
+
+
+def build_routes(count):
+    "Half command words, half patterns, with a catch-all at the lowest priority like the bot's chat_router."
+    routes = []
+    for i in range(count):
+        if i % 2:
+            routes.append(Route((100, i), keyword_regex(f"command{i}"), i, f"command{i}"))
+        else:
+            routes.append(Route((100, i), re.compile(rf"pattern{i}\b", re.I), i))
+    routes.append(Route((1000, count), re.compile("", re.I), "catch-all"))
+    return routes
+
+
+def linear_first(routes, text):
+    "The old dispatch: try every handler in priority order until one matches."
+    for route in routes:
+        if re.search(route.regex, text):
+            return route.func
+    return None
+
+
+def time_dispatch(dispatch, texts):
+    start = time.perf_counter()
+    for text in texts:
+        dispatch(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    for count in args.handlers:
+        routes = sorted(build_routes(count), key=lambda route: route.rank)
+        router = Router(routes)
+        # Mostly free text that falls through to the catch-all, plus commands and patterns from across the table.
+        samples = ["hi", "yes", "what is this?", f"command{count - 1}", f"please pattern{count // 2 * 2 - 2}",
+                   "Could you tell me how to pay", "command1", "n"]
+        texts = [samples[i % len(samples)] for i in range(args.messages)]
+
+        for text in samples:
+            assert linear_first(routes, text) == next(router.matches(text))[0], text
+
+        linear = time_dispatch(lambda text: linear_first(routes, text), texts)
+        routed = time_dispatch(lambda text: next(router.matches(text)), texts)
+        per_message = 1e6 / args.messages
+        print(f"{count:5d} handlers: linear {linear * per_message:8.2f} us/msg, "
+              f"router {routed * per_message:8.2f} us/msg, {linear / routed:6.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 # Copyright (c) 2021 MobileCoin. All rights reserved.
 
 from django.contrib import admin
-from .models import Store, Customer, Drop, Item, CustomerStorePreferences, DropSession, Message, BonusCoin, ChatbotSettings
+from django.utils.html import format_html_join, mark_safe
+from .models import Store, Customer, Drop, Item, CustomerStorePreferences, DropSession, Message, BonusCoin, ChatbotSettings, \
+    PayoutBatch, PayoutJob
+from .drop_stats import drop_stats, format_bonus_coins
 
 class StoreAdmin(admin.ModelAdmin):
     pass
@@ -10,7 +13,13 @@ class CustomerAdmin(admin.ModelAdmin):
     pass
 
 class DropAdmin(admin.ModelAdmin):
-    pass
+    readonly_fields = ('initial_coins_claimed', 'bonus_coins_claimed')
+
+    def bonus_coins_claimed(self, obj):
+        if obj.pk is None:
+            return "-"
+        lines = format_bonus_coins(drop_stats.bonus_coins(obj)).splitlines()
+        return format_html_join(mark_safe('<br>'), '{}', ((line,) for line in lines)) or "-"
 
 class ItemAdmin(admin.ModelAdmin):
     pass
@@ -27,6 +36,12 @@ class MessageAdmin(admin.ModelAdmin):
 class BonusCoinAdmin(admin.ModelAdmin):
     pass
 
+class PayoutBatchAdmin(admin.ModelAdmin):
+    pass
+
+class PayoutJobAdmin(admin.ModelAdmin):
+    pass
+
 class ChatbotSettingsAdmin(admin.ModelAdmin):
     # only show "Add" button if we don't yet have a settings object
     def has_add_permission(self, request, obj=None):
@@ -40,4 +55,6 @@ admin.site.register(CustomerStorePreferences, CustomerStorePreferencesAdmin)
 admin.site.register(DropSession, DropSessionAdmin)
 admin.site.register(Message, MessageAdmin)
 admin.site.register(BonusCoin, BonusCoinAdmin)
+admin.site.register(PayoutBatch, PayoutBatchAdmin)
+admin.site.register(PayoutJob, PayoutJobAdmin)
 admin.site.register(ChatbotSettings, ChatbotSettingsAdmin)
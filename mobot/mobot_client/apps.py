@@ -6,3 +6,8 @@ from django.apps import AppConfig
 class MobotClientConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mobot_client'
+
+    def ready(self):
+        # Connect the signals that tell running bots their settings, customers or sessions have changed, in
+        # every process that can save them, the admin site included.
+        from mobot_client import session_cache, settings_cache  # noqa: F401
@@ -0,0 +1,55 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from typing import Optional
+
+from django.core.cache import caches
+
+
+class CacheGeneration:
+    """
+    A counter kept in the configured Django cache, which lets processes tell each other that something they
+    may hold in memory has changed.
+
+    A process that changes the data calls bump(). Processes that cache the data call changed(), which reads the
+    counter at most once every `check_interval` seconds and says whether it moved since the last read, so
+    checking it on a hot path costs nothing most of the time. With the dummy cache the counter never moves, and
+    each process only sees its own changes.
+    """
+
+    def __init__(self, key: str, check_interval: float = 5.0, alias: str = 'default'):
+        self.key = key
+        self.check_interval = check_interval
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._seen = None
+        self._checked_at = None  # type: Optional[float]
+
+    def bump(self):
+        cache = caches[self.alias]
+        try:
+            try:
+                cache.incr(self.key)
+            except ValueError:
+                # Not there yet, or evicted. Any value different from the last one read will do.
+                cache.set(self.key, time.time_ns(), timeout=None)
+        except Exception as e:
+            print(f"Could not bump {self.key}: {e}")
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+
+        try:
+            generation = caches[self.alias].get(self.key)
+        except Exception as e:
+            print(f"Could not read {self.key}: {e}")
+            return False
+
+        with self._lock:
+            changed, self._seen = self._seen != generation, generation
+        return changed
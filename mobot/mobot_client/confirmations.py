@@ -0,0 +1,143 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+TRANSACTION_SUCCESS = "TransactionSuccess"
+TRANSACTION_PENDING = "TransactionPending"
+TRANSACTION_FAILURE = "TransactionFailure"
+TRANSACTION_TIMED_OUT = "TransactionTimedOut"
+# full-service couldn't tell us how the transaction went.
+TRANSACTION_CHECK_FAILED = "TransactionCheckFailed"
+
+
+class _Watched:
+    __slots__ = ("subject", "on_done", "started", "attempts")
+
+    def __init__(self, subject: tuple, on_done: Callable[[str, Optional[dict]], None]):
+        self.subject = subject
+        self.on_done = on_done
+        self.started = time.monotonic()
+        self.attempts = 0
+
+
+class ReceiptConfirmations:
+    """
+    Waits for transactions to land, without tying up a thread per transaction.
+
+    watch() registers a subject, such as a receiver receipt and the address of ours it pays, and
+    check(*subject) returns (status, details) for it. A single poller thread wakes up every `tick` seconds,
+    takes every subject that is due for a check, and checks them together on `workers` threads. A subject that
+    is still pending is checked again after a backoff that starts at `interval` seconds and doubles up to
+    `max_interval`. Once its status is anything but pending, or after `timeout` seconds, on_done(status,
+    details) is called. A check() that raises is retried like a pending one. On timeout the status is
+    TRANSACTION_TIMED_OUT, or TRANSACTION_CHECK_FAILED if the last check raised, both with no details.
+    """
+
+    def __init__(self, check: Callable[..., Tuple[str, Optional[dict]]], tick: float = 0.25, interval: float = 0.5,
+                 max_interval: float = 5.0, timeout: float = 120.0, workers: int = 4,
+                 report_interval: Optional[float] = None):
+        self._check = check
+        self.tick = tick
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="confirm")
+        self._lock = threading.Lock()
+        # (due_at, seq, watched)
+        self._due = []
+        self._seq = itertools.count()
+        self._closed = False
+
+        self.confirmed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.total_confirm_time = 0.0
+        self.max_confirm_time = 0.0
+
+        self._poller = threading.Thread(target=self._run, name="confirm-poller", daemon=True)
+        self._poller.start()
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="confirm-report", daemon=True).start()
+
+    def watch(self, subject: tuple, on_done: Callable[[str, Optional[dict]], None]):
+        "Call on_done once the transaction check(*subject) looks up has landed, failed or timed out."
+        with self._lock:
+            heapq.heappush(self._due, (time.monotonic(), next(self._seq), _Watched(subject, on_done)))
+
+    def stats(self) -> dict:
+        "How many receipts are pending and how they resolved, with time to confirmation in seconds."
+        with self._lock:
+            return {
+                "pending": len(self._due),
+                "confirmed": self.confirmed,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "avg_confirm_time": self.total_confirm_time / self.confirmed if self.confirmed else 0.0,
+                "max_confirm_time": self.max_confirm_time,
+            }
+
+    def close(self):
+        "Stop polling. Receipts still pending are abandoned without calling on_done."
+        self._closed = True
+        # The poller hands its batches to the pool, so it has to stop before the pool can.
+        self._poller.join()
+        self._pool.shutdown(wait=True)
+
+    def _run(self):
+        while not self._closed:
+            now = time.monotonic()
+            batch = []
+            with self._lock:
+                while self._due and self._due[0][0] <= now:
+                    batch.append(heapq.heappop(self._due)[2])
+
+            if batch:
+                # Checks run in parallel, and the poller waits for the whole batch so nothing is checked twice.
+                list(self._pool.map(self._poll, batch))
+            time.sleep(self.tick)
+
+    def _poll(self, watched: _Watched):
+        watched.attempts += 1
+        check_failed = False
+        try:
+            status, receipt_status = self._check(*watched.subject)
+        except Exception as e:  # noqa - full-service may only be down for a moment, so check again later.
+            print(f"Could not check transaction: {e}")
+            status, receipt_status, check_failed = TRANSACTION_PENDING, None, True
+
+        now = time.monotonic()
+        elapsed = now - watched.started
+        if status == TRANSACTION_PENDING:
+            if elapsed < self.timeout:
+                delay = min(self.max_interval, self.interval * 2 ** (watched.attempts - 1))
+                with self._lock:
+                    heapq.heappush(self._due, (now + delay, next(self._seq), watched))
+                return
+            status, receipt_status = TRANSACTION_CHECK_FAILED if check_failed else TRANSACTION_TIMED_OUT, None
+
+        with self._lock:
+            if status == TRANSACTION_TIMED_OUT:
+                self.timed_out += 1
+            elif status == TRANSACTION_SUCCESS:
+                self.confirmed += 1
+                self.total_confirm_time += elapsed
+                self.max_confirm_time = max(self.max_confirm_time, elapsed)
+            else:
+                self.failed += 1
+
+        try:
+            watched.on_done(status, receipt_status)
+        except Exception as e:  # noqa - One customer's failure shouldn't stop the poller.
+            print(e)
+
+    def _report(self, interval: float):
+        while not self._closed:
+            time.sleep(interval)
+            print("receipt confirmations: pending={pending} confirmed={confirmed} failed={failed} "
+                  "timed_out={timed_out} avg_confirm_time={avg_confirm_time:.2f}s "
+                  "max_confirm_time={max_confirm_time:.2f}s".format(**self.stats()))
@@ -0,0 +1,85 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from mobot_client.models import Drop
+
+# Drops are active up to and including their end_time, so they stop being active just after it.
+_AFTER = timedelta(microseconds=1)
+
+
+class DropSchedule:
+    """
+    Which drop is being advertised and which is active, without asking the database on every message.
+
+    Drops only change when someone edits them, and they move between advertising, active and over at times
+    known in advance. So the schedule loads every drop that isn't over yet, works out both answers and the next
+    time either could change (the nearest advertisment_start_time, start_time or end_time still to come), and
+    serves them from memory until then. Saving or deleting a Drop in this process reloads it straight away;
+    `max_age` bounds how long an edit made by another process, such as the admin site, takes to show up.
+    """
+
+    def __init__(self, max_age: Optional[float] = 60.0):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None  # type: Optional[float]
+        self._next_boundary = None  # type: Optional[datetime]
+        self._advertising = None  # type: Optional[Drop]
+        self._active = None  # type: Optional[Drop]
+
+    def advertising_drop(self) -> Optional[Drop]:
+        "The drop that is advertised but hasn't started, if any."
+        with self._lock:
+            self._refresh_if_stale()
+            return self._advertising
+
+    def active_drop(self) -> Optional[Drop]:
+        "The drop that has started and hasn't ended, if any."
+        with self._lock:
+            self._refresh_if_stale()
+            return self._active
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _refresh_if_stale(self):
+        if self._loaded_at is not None \
+                and (self.max_age is None or time.monotonic() - self._loaded_at < self.max_age) \
+                and (self._next_boundary is None or timezone.now() < self._next_boundary):
+            return
+
+        loaded_at = time.monotonic()
+        now = timezone.now()
+        drops = list(Drop.objects.filter(end_time__gte=now).select_related('item', 'store').order_by('pk'))
+        self._advertising = next((drop for drop in drops
+                                  if drop.advertisment_start_time <= now < drop.start_time), None)
+        self._active = next((drop for drop in drops if drop.start_time <= now <= drop.end_time), None)
+        self._next_boundary = self._find_next_boundary(drops, now)
+        self._loaded_at = loaded_at
+
+    @staticmethod
+    def _find_next_boundary(drops: List[Drop], now: datetime) -> Optional[datetime]:
+        boundaries = [
+            boundary
+            for drop in drops
+            for boundary in (drop.advertisment_start_time, drop.start_time, drop.end_time + _AFTER)
+            if boundary > now
+        ]
+        return min(boundaries, default=None)
+
+
+drop_schedule = DropSchedule()
+
+
+@receiver(post_save, sender=Drop)
+@receiver(post_delete, sender=Drop)
+def _drop_changed(sender, **kwargs):
+    drop_schedule.invalidate()
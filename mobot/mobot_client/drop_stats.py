@@ -0,0 +1,61 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from mobot_client.models import BonusCoin, Drop
+
+# What mobilecoin.pmob2mob divides by. The admin site imports this module, and shouldn't need mobilecoin for it.
+_PMOB_PER_MOB = Decimal(10 ** 12)
+
+
+class DropStats:
+    """
+    Claimed and remaining coins per drop, read from the claim counters in a single query and kept for `ttl`
+    seconds, so that a burst of customers asking doesn't turn into a burst of queries.
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # drop pk (None for every drop) -> (fetched_at, tiers)
+        self._cache = {}
+
+    def bonus_coins(self, drop: Optional[Drop] = None) -> List[Dict[str, int]]:
+        "Amount, available, claimed and remaining for each bonus coin of `drop`, or of every drop."
+        key = drop.pk if drop is not None else None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+
+        bonus_coins = BonusCoin.objects.all()
+        if drop is not None:
+            bonus_coins = bonus_coins.filter(drop=drop)
+        tiers = [
+            dict(tier, remaining=max(0, tier['number_available'] - tier['number_claimed']))
+            for tier in bonus_coins.order_by('drop_id', 'amount_pmob', 'pk')
+            .values('pk', 'drop_id', 'amount_pmob', 'number_available', 'number_claimed')
+        ]
+        with self._lock:
+            self._cache[key] = (now, tiers)
+        return tiers
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def format_bonus_coins(tiers: List[Dict[str, int]]) -> str:
+    "One line per bonus coin tier, saying how many have been claimed."
+    return "\n".join(
+        f"{tier['number_claimed']} out of {tier['number_available']} "
+        f"{(Decimal(tier['amount_pmob']) / _PMOB_PER_MOB).normalize()}MOB Bonus Coins claimed"
+        for tier in tiers
+    )
+
+
+drop_stats = DropStats()
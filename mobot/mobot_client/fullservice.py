@@ -0,0 +1,170 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import mobilecoin as mc
+from mobilecoin.client import WalletAPIError
+
+# What a keep-alive connection the server has since closed looks like when we next use it.
+_STALE_CONNECTION = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError,
+                     BrokenPipeError)
+
+# Methods that must not be sent twice: once full-service has read one, a lost reply doesn't mean it wasn't done.
+_NOT_IDEMPOTENT = frozenset(("submit_transaction", "build_and_submit_transaction"))
+
+
+class _MethodStats:
+    __slots__ = ("calls", "errors", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class PooledClient(mc.Client):
+    """
+    A full-service client that keeps its HTTP connections open and shares them between threads.
+
+    mobilecoin.Client opens a new connection for every request. This one keeps up to `pool_size` keep-alive
+    connections, and a request waits for a free one when they're all busy. `connect_timeout` and `timeout`
+    bound connecting and waiting for a reply, in seconds. A request that fails because the server had closed an
+    idle connection is sent again once on a fresh one, unless it may have been read already and is one of the
+    methods that spend: those aren't safe to send twice. Latency and errors are counted per RPC method, see stats().
+    """
+
+    def __init__(self, url=None, verbose=False, pool_size: int = 8, timeout: float = 30.0,
+                 connect_timeout: float = 5.0, report_interval: Optional[float] = None):
+        super().__init__(url=url, verbose=verbose)
+        parsed_url = urlparse(self.url)
+        self._netloc = parsed_url.netloc
+        self._path = parsed_url.path
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(_MethodStats)  # type: Dict[str, _MethodStats]
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="fullservice-report",
+                             daemon=True).start()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        connection = http.client.HTTPConnection(self._netloc, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.timeout)
+        # Requests are small and answered one at a time, so don't let Nagle hold them back.
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def _post(self, body: str, idempotent: bool = True) -> bytes:
+        """
+        POST to full-service on a pooled connection and return the response body. If it isn't `idempotent`, it is
+        only sent again when sending it failed, not when the reply did.
+        """
+        with self._slots:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self._connect(), False
+
+            try:
+                sent = False
+                try:
+                    connection.request('POST', self._path, body, {'Content-Type': 'application/json'})
+                    sent = True
+                    r = connection.getresponse()
+                except _STALE_CONNECTION:
+                    if not reused or (sent and not idempotent):
+                        raise
+                    connection.close()
+                    connection = self._connect()
+                    connection.request('POST', self._path, body, {'Content-Type': 'application/json'})
+                    r = connection.getresponse()
+                raw_response = r.read()
+            except Exception:
+                connection.close()
+                raise
+
+            if r.will_close:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return raw_response
+
+    def _req(self, request_data):
+        default_params = {
+            "jsonrpc": "2.0",
+            "api_version": "2",
+            "id": 1,
+        }
+        request_data = {**request_data, **default_params}
+        method = request_data.get("method")
+
+        if self.verbose:
+            print('POST', self.url)
+            print(json.dumps(request_data, indent=4))
+            print()
+
+        started = time.monotonic()
+        ok = False
+        try:
+            try:
+                raw_response = self._post(json.dumps(request_data), idempotent=method not in _NOT_IDEMPOTENT)
+            except (ConnectionError, OSError, http.client.HTTPException):
+                raise ConnectionError(f'Could not connect to wallet server at {self.url}.')
+
+            try:
+                response_data = json.loads(raw_response)
+            except ValueError:
+                raise ValueError('API returned invalid JSON:', raw_response)
+
+            if self.verbose:
+                print(json.dumps(response_data, indent=4))
+                print()
+
+            # Check for errors and unwrap result.
+            try:
+                result = response_data['result']
+            except KeyError:
+                raise WalletAPIError(response_data)
+
+            ok = True
+            return result
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                stats = self._stats[method]
+                stats.calls += 1
+                stats.errors += not ok
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        "Calls, errors and latency in seconds for each RPC method."
+        with self._lock:
+            return {
+                method: {
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "avg_time": stats.total_time / stats.calls if stats.calls else 0.0,
+                    "max_time": stats.max_time,
+                }
+                for method, stats in self._stats.items()
+            }
+
+    def _report(self, interval: float):
+        while True:
+            time.sleep(interval)
+            for method, stats in sorted(self.stats().items()):
+                print("full-service {}: calls={calls} errors={errors} avg_time={avg_time:.3f}s "
+                      "max_time={max_time:.3f}s".format(method, **stats))
@@ -0,0 +1,104 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class WalletLedger:
+    """
+    Keeps track of how much MOB the wallet can still promise, without asking full-service every time.
+
+    The balance comes from fetch_balance(), in pmob, and is fetched again every `reconcile_interval` seconds.
+    Every payout reserves its amount plus the fee when it is queued, and either commits it once it has landed,
+    taking it off the balance, or releases it if it never will. available() is the balance less everything
+    reserved, and reserve() refuses anything that doesn't fit, so payouts queued at the same time can't
+    promise the same MOB twice. A fetched balance already has the payouts that landed before it was asked for
+    taken off, so only those that landed since are taken off again.
+    """
+
+    def __init__(self, fetch_balance: Callable[[], int], fee_pmob: int, reconcile_interval: float = 30.0,
+                 report_interval: Optional[float] = None):
+        self._fetch_balance = fetch_balance
+        self.fee_pmob = int(fee_pmob)
+        self._lock = threading.Lock()
+        self._balance = 0
+        # idempotency key -> pmob held for that payout
+        self._reserved = {}  # type: Dict[str, int]
+        self._reserved_total = 0
+        # (when, pmob) for each payout committed since the balance was last asked for
+        self._landed = []  # type: List[Tuple[float, int]]
+        self.reconcile()
+
+        if reconcile_interval:
+            threading.Thread(target=self._reconcile_every, args=(reconcile_interval,), name="ledger-reconcile",
+                             daemon=True).start()
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="ledger-report", daemon=True).start()
+
+    def available(self) -> int:
+        "pmob not yet promised to any payout."
+        with self._lock:
+            return self._balance - self._reserved_total
+
+    def reserve(self, key: str, amount_pmob: int, force: bool = False) -> bool:
+        """
+        Hold amount_pmob plus the fee for the payout `key`, unless that's more than is available. Reserving a key
+        that already holds funds succeeds without holding more. With `force`, hold it even if it doesn't fit.
+        """
+        amount_pmob += self.fee_pmob
+        with self._lock:
+            if key in self._reserved:
+                return True
+            if not force and self._balance - self._reserved_total < amount_pmob:
+                return False
+            self._reserved[key] = amount_pmob
+            self._reserved_total += amount_pmob
+            return True
+
+    def commit(self, key: str):
+        "The payout `key` has landed: its funds have left the wallet."
+        with self._lock:
+            amount_pmob = self._reserved.pop(key, 0)
+            self._reserved_total -= amount_pmob
+            self._balance -= amount_pmob
+            if amount_pmob:
+                self._landed.append((time.monotonic(), amount_pmob))
+
+    def release(self, key: str):
+        "The payout `key` won't be sent: its funds are available again."
+        with self._lock:
+            self._reserved_total -= self._reserved.pop(key, 0)
+
+    def reconcile(self):
+        "Replace the balance with what full-service reports, less the payouts that landed since we asked."
+        started = time.monotonic()
+        balance = int(self._fetch_balance())
+        with self._lock:
+            # One that landed while we were asking may be in the balance already. Taking it off again only
+            # promises too little, until the next reconcile.
+            self._landed = [(landed_at, pmob) for landed_at, pmob in self._landed if landed_at >= started]
+            self._balance = balance - sum(pmob for _landed_at, pmob in self._landed)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "balance": self._balance,
+                "reserved": self._reserved_total,
+                "available": self._balance - self._reserved_total,
+                "payouts": len(self._reserved),
+            }
+
+    def _reconcile_every(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reconcile()
+            except Exception as e:  # noqa - Keep the last balance until full-service answers again.
+                print(e)
+
+    def _report(self, interval: float):
+        while True:
+            time.sleep(interval)
+            print("wallet ledger: balance={balance} reserved={reserved} available={available} "
+                  "payouts={payouts}".format(**self.stats()))
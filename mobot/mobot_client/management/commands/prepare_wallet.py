@@ -0,0 +1,86 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import os
+import time
+
+import mobilecoin as mc
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mobot_client.fullservice import PooledClient
+from mobot_client.models import Drop
+from mobot_client.payouts import unfinished_payout_inputs
+from mobot_client.pool_refill import PoolRefiller
+from mobot_client.txo_pool import TxoPool
+
+FULLSERVICE_ADDRESS = os.getenv("FULLSERVICE_ADDRESS", "127.0.0.1")
+FULLSERVICE_PORT = os.getenv("FULLSERVICE_PORT", "9090")
+FULLSERVICE_URL = f"http://{FULLSERVICE_ADDRESS}:{FULLSERVICE_PORT}/wallet"
+
+
+class Command(BaseCommand):
+    help = ('Split the wallet into txos sized for the payouts of a drop, so that they can be sent in parallel. '
+            'Run it before the bot starts: while it runs, the bot refills its own pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop-id', type=int, default=None,
+                            help='Drop to prepare for (defaults to the active drop, or else the next one)')
+        parser.add_argument('--count', type=int, default=None,
+                            help='Most txos to keep of each size (defaults to the payouts the drop has left)')
+        parser.add_argument('--low-water', type=float, default=0.5,
+                            help='Refill a size once fewer than this fraction of its txos are left')
+        parser.add_argument('--expected-payment', type=float, default=0.01,
+                            help='MOB customers are asked to send, which is returned with their bonus')
+        parser.add_argument('--watch', type=float, default=0,
+                            help='After splitting, keep reporting every this many seconds')
+        parser.add_argument('--report-only', action='store_true', help='Report the pool without splitting')
+
+    def handle(self, *args, **kwargs):
+        mcc = PooledClient(url=FULLSERVICE_URL, pool_size=1,
+                           timeout=float(os.getenv("FULLSERVICE_TIMEOUT", "30")),
+                           connect_timeout=float(os.getenv("FULLSERVICE_CONNECT_TIMEOUT", "5")))
+        all_accounts_response = mcc.get_all_accounts()
+        account_id = next(iter(all_accounts_response))
+        fee_pmob = int(mcc.get_network_status()['fee_pmob'])
+        self.refiller = PoolRefiller(mcc, account_id, all_accounts_response[account_id]['main_address'],
+                                     TxoPool(mcc, account_id, fee_pmob), fee_pmob,
+                                     low_water=kwargs['low_water'],
+                                     expected_payment_pmob=mc.mob2pmob(kwargs['expected_payment']),
+                                     count=kwargs['count'], log=self.stdout.write)
+        # Payouts that were built before the bot stopped spend these once it resumes them.
+        self.refiller.pool.reserve_ids(unfinished_payout_inputs())
+
+        refill = not kwargs['report_only']
+        while True:
+            drop = self.get_drop(kwargs['drop_id'])
+            targets = self.refiller.targets(drop)
+            self.refiller.pool.refresh()
+            if refill:
+                self.refiller.refill(targets)
+                refill = False
+            self.report(drop, targets)
+
+            if not kwargs['watch']:
+                return
+            time.sleep(kwargs['watch'])
+
+    def get_drop(self, drop_id):
+        if drop_id is not None:
+            try:
+                return Drop.objects.get(pk=drop_id)
+            except Drop.DoesNotExist:
+                raise CommandError(f"There is no drop {drop_id}")
+
+        now = timezone.now()
+        drop = Drop.objects.filter(start_time__lte=now, end_time__gte=now).first()
+        if drop is None:
+            drop = Drop.objects.filter(start_time__gt=now).order_by('start_time').first()
+        if drop is None:
+            raise CommandError("There is no active or upcoming drop to prepare for")
+        return drop
+
+    def report(self, drop, targets):
+        levels = self.refiller.pool.levels(targets)
+        self.stdout.write(f"Txo pool for {drop}:")
+        for value, (label, target) in sorted(targets.items()):
+            self.stdout.write(f"  {mc.pmob2mob(value).normalize()} MOB ({label}): {levels[value]} of {target}")
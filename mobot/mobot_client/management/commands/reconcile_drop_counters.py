@@ -0,0 +1,31 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from django.core.management.base import BaseCommand
+
+from mobot_client.models import Drop
+from mobot_client.quotas import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount claimed initial and bonus coins from drop sessions and fix the counters that are off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop-id', type=int, action='append', dest='drop_ids',
+                            help='Only reconcile this drop (can be given more than once)')
+        parser.add_argument('--dry-run', action='store_true', help='Report mismatches without fixing them')
+
+    def handle(self, *args, **kwargs):
+        drops = Drop.objects.all()
+        if kwargs['drop_ids']:
+            drops = drops.filter(pk__in=kwargs['drop_ids'])
+
+        mismatches = reconcile_counters(drops, fix=not kwargs['dry_run'])
+        for obj, counter, stored, counted in mismatches:
+            self.stdout.write(f"{obj._meta.model_name} {obj.pk} ({obj}): {counter} was {stored}, counted {counted}")
+
+        if not mismatches:
+            self.stdout.write("All counters match")
+        elif kwargs['dry_run']:
+            self.stdout.write(f"{len(mismatches)} counters are off, run without --dry-run to fix them")
+        else:
+            self.stdout.write(f"Fixed {len(mismatches)} counters")
@@ -1,28 +1,57 @@
 # Copyright (c) 2021 MobileCoin. All rights reserved.
 
 from datetime import tzinfo
+import functools
 import os
-import time
 import pytz
-import random
 
-from django.utils import timezone
+from django.db import transaction
 from django.core.management.base import BaseCommand
 from signald_client import Signal
+from mobot_client.confirmations import (TRANSACTION_CHECK_FAILED, TRANSACTION_SUCCESS, TRANSACTION_TIMED_OUT,
+                                        ReceiptConfirmations)
+from mobot_client.drop_schedule import drop_schedule
+from mobot_client.drop_stats import drop_stats, format_bonus_coins
+from mobot_client.fullservice import PooledClient
+from mobot_client.ledger import WalletLedger
+from mobot_client.message_log import MessageLog
+from mobot_client.payouts import PayoutQueue, check_transaction_log
+from mobot_client.pool_refill import PoolRefiller
+from mobot_client.quotas import (claim_initial_coin, claim_random_bonus_coin, has_initial_coins_left, release_bonus_coin,
+                                 release_initial_coin)
+from mobot_client.session_cache import session_cache
+from mobot_client.settings_cache import chatbot_settings
+from mobot_client.txo_pool import TxoPool
 from mobot_client.models import Store, Customer, DropSession, Drop, CustomerStorePreferences, Message, BonusCoin, ChatbotSettings
 import mobilecoin as mc
 from decimal import Decimal
 
 SIGNALD_ADDRESS = os.getenv("SIGNALD_ADDRESS", "127.0.0.1")
 SIGNALD_PORT = os.getenv("SIGNALD_PORT", "15432")
+SIGNALD_PROFILE_TTL = float(os.getenv("SIGNALD_PROFILE_TTL", "300"))
+SIGNALD_SEND_RATE = float(os.getenv("SIGNALD_SEND_RATE", "20"))
+SIGNALD_SEND_BURST = float(os.getenv("SIGNALD_SEND_BURST", "40"))
+SIGNALD_RECIPIENT_RATE = float(os.getenv("SIGNALD_RECIPIENT_RATE", "1"))
+SIGNALD_RECIPIENT_BURST = float(os.getenv("SIGNALD_RECIPIENT_BURST", "5"))
+MOBOT_REPORT_INTERVAL = float(os.getenv("MOBOT_REPORT_INTERVAL", "60"))
 
-store = ChatbotSettings.load().store
-signal = Signal(store.phone_number, socket_path=(SIGNALD_ADDRESS, int(SIGNALD_PORT)))
+
+def current_store():
+    "The store the bot is running, as last saved in the admin."
+    return chatbot_settings.get().store
+
+
+signal = Signal(current_store().phone_number, socket_path=(SIGNALD_ADDRESS, int(SIGNALD_PORT)), profile_ttl=SIGNALD_PROFILE_TTL,
+                send_rate=SIGNALD_SEND_RATE, send_burst=SIGNALD_SEND_BURST, recipient_rate=SIGNALD_RECIPIENT_RATE,
+                recipient_burst=SIGNALD_RECIPIENT_BURST, send_report_interval=MOBOT_REPORT_INTERVAL)
 
 FULLSERVICE_ADDRESS = os.getenv("FULLSERVICE_ADDRESS", "127.0.0.1")
 FULLSERVICE_PORT = os.getenv("FULLSERVICE_PORT", "9090")
 FULLSERVICE_URL = f"http://{FULLSERVICE_ADDRESS}:{FULLSERVICE_PORT}/wallet"
-mcc = mc.Client(url=FULLSERVICE_URL)
+mcc = PooledClient(url=FULLSERVICE_URL, pool_size=int(os.getenv("FULLSERVICE_POOL_SIZE", "8")),
+                   timeout=float(os.getenv("FULLSERVICE_TIMEOUT", "30")),
+                   connect_timeout=float(os.getenv("FULLSERVICE_CONNECT_TIMEOUT", "5")),
+                   report_interval=MOBOT_REPORT_INTERVAL)
 
 all_accounts_response = mcc.get_all_accounts()
 ACCOUNT_ID = next(iter(all_accounts_response))
@@ -32,6 +61,35 @@ PUBLIC_ADDRESS = account_obj['main_address']
 get_network_status_response = mcc.get_network_status()
 MINIMUM_FEE_PMOB = get_network_status_response['fee_pmob']
 
+
+def check_payment(receipt):
+    "How a customer's payment to us is doing. Receipts can only be checked against one of our own addresses."
+    receipt_status = mcc.check_receiver_receipt_status(PUBLIC_ADDRESS, receipt)
+    return receipt_status["receipt_transaction_status"], receipt_status
+
+
+confirmations = ReceiptConfirmations(
+    check_payment,
+    timeout=float(os.getenv("MOBOT_CONFIRMATION_TIMEOUT", "120")),
+    report_interval=MOBOT_REPORT_INTERVAL,
+)
+payout_confirmations = ReceiptConfirmations(
+    functools.partial(check_transaction_log, mcc),
+    timeout=float(os.getenv("MOBOT_CONFIRMATION_TIMEOUT", "120")),
+    report_interval=MOBOT_REPORT_INTERVAL,
+)
+
+
+def get_wallet_balance():
+    account_amount_response = mcc.get_balance_for_account(ACCOUNT_ID)
+    # Funds held by transactions still in flight are taken out by the ledger's own reservations.
+    return int(account_amount_response['unspent_pmob']) + int(account_amount_response['pending_pmob'])
+
+
+ledger = WalletLedger(get_wallet_balance, MINIMUM_FEE_PMOB,
+                      reconcile_interval=float(os.getenv("MOBOT_LEDGER_RECONCILE_INTERVAL", "30")),
+                      report_interval=MOBOT_REPORT_INTERVAL)
+
 SESSION_STATE_CANCELLED = -1
 SESSION_STATE_READY_TO_RECEIVE_INITIAL = 0
 SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION = 1
@@ -41,9 +99,31 @@ SESSION_STATE_COMPLETED = 3
 MESSAGE_DIRECTION_RECEIVED = 0
 MESSAGE_DIRECTION_SENT = 1
 
-bot_name = ChatbotSettings.load().name
-bot_avatar_filename = ChatbotSettings.load().avatar_filename
-signal.set_profile(bot_name, PUBLIC_ADDRESS, bot_avatar_filename, False)
+message_log = MessageLog(flush_size=int(os.getenv("MOBOT_MESSAGE_LOG_FLUSH_SIZE", "100")),
+                         flush_interval=float(os.getenv("MOBOT_MESSAGE_LOG_FLUSH_INTERVAL", "1")),
+                         max_backlog=int(os.getenv("MOBOT_MESSAGE_LOG_MAX_BACKLOG", "10000")),
+                         report_interval=MOBOT_REPORT_INTERVAL)
+
+# This process handles every message for the bot's number, so it keeps the customer and session cache.
+session_cache.owner = True
+session_cache.max_size = int(os.getenv("MOBOT_SESSION_CACHE_SIZE", "10000"))
+session_cache.max_age = float(os.getenv("MOBOT_SESSION_CACHE_MAX_AGE", "300"))
+if MOBOT_REPORT_INTERVAL:
+    session_cache.report(MOBOT_REPORT_INTERVAL)
+
+_profile = None
+
+
+def update_profile(settings):
+    "Give the bot the name and avatar from its settings, if they've changed."
+    global _profile
+    if (settings.name, settings.avatar_filename) != _profile:
+        _profile = (settings.name, settings.avatar_filename)
+        signal.set_profile(settings.name, PUBLIC_ADDRESS, settings.avatar_filename, False)
+
+
+update_profile(chatbot_settings.get())
+chatbot_settings.add_listener(update_profile)
 
 
 def _signald_to_fullservice(r):
@@ -60,91 +140,72 @@ def _signald_to_fullservice(r):
     }
 
 
-def send_mob_to_customer(source, amount_mob, cover_transaction_fee):
+def send_mob_to_customer(customer, source, amount_mob, cover_transaction_fee, idempotency_key):
     customer_payments_address = get_payments_address(source)
     if customer_payments_address is None:
         signal.send_message(source,
                        ("We have a refund for you, but your payments have been deactivated\n\n"
-                       "Please contact customer service at {}").format(store.phone_number))
-        return
+                       "Please contact customer service at {}").format(current_store().phone_number))
+        return False
 
     if not cover_transaction_fee:
         amount_mob = amount_mob - Decimal(mc.pmob2mob(MINIMUM_FEE_PMOB))
 
     if amount_mob <= 0:
         signal.send_message(source, "MOBot here! You sent us an unsolicited payment that we can't return. We suggest only sending us payments when we request them and for the amount requested.")
-        return
-
-    send_mob_to_address(source, ACCOUNT_ID, amount_mob, customer_payments_address)
-
+        return False
 
-def send_mob_to_address(source, account_id, amount_in_mob, customer_payments_address):
-    tx_proposal = mcc.build_transaction(account_id, amount_in_mob, customer_payments_address)
-    txo_id = submit_transaction(tx_proposal, account_id)
-    for _ in range(10):
-        try:
-            mcc.get_txo(txo_id)
-            break
-        except Exception:
-            print("TxOut did not land yet, id: " + txo_id)
-            pass
-        time.sleep(1.0)
-    else:
-        signal.send_message(source, "couldn't generate a receipt, please contact us if you didn't a payment!")
-        return
+    if payouts.enqueue(idempotency_key, customer, customer_payments_address, mc.mob2pmob(amount_mob)) is None:
+        signal.send_message(source, ("Sorry, we can't send you MOB right now\n\n"
+                                     "Please contact customer service at {}").format(current_store().phone_number))
+        return False
 
-    send_payment_receipt(source, tx_proposal)
+    return True
 
 
-def submit_transaction(tx_proposal, account_id):
-    # retry up to 10 times in case there's some failure with a 1 sec timeout in between each
-    transaction_log = mcc.submit_transaction(tx_proposal, account_id)
-    list_of_txos = transaction_log["output_txos"]
+def send_payout_receipt(payout_job, receiver_receipt):
+    signal.send_payment_receipt(customer_address(payout_job.customer), receiver_receipt, "Refund")
 
-    if len(list_of_txos) > 1:
-        raise ValueError("Found more than one txout for this chat bot-initiated transaction.")
 
-    return list_of_txos[0]["txo_id_hex"]
+def notify_payout_failed(payout_job):
+    signal.send_message(customer_address(payout_job.customer), "couldn't generate a receipt, please contact us if you didn't a payment!")
 
 
-def send_payment_receipt(source, tx_proposal):
-    receiver_receipt = create_receiver_receipt(tx_proposal)
-    signal.send_payment_receipt(source, receiver_receipt, "Refund")
+def customer_address(customer):
+    return {"number": customer.phone_number}
 
 
-def create_receiver_receipt(tx_proposal):
-    receiver_receipts = mcc.create_receiver_receipts(tx_proposal)
-    # I'm assuming there will only be one receiver receipt (not including change tx out).
-    if len(receiver_receipts) > 1:
-        raise ValueError("Found more than one txout for this chat bot-initiated transaction.")
-    return receiver_receipts[0]
+# Shared by the payouts and the refiller, so that the refiller never splits a txo a payout has reserved.
+txo_pool = TxoPool(mcc, ACCOUNT_ID, MINIMUM_FEE_PMOB)
+pool_refiller = PoolRefiller(mcc, ACCOUNT_ID, PUBLIC_ADDRESS, txo_pool, MINIMUM_FEE_PMOB,
+                             low_water=float(os.getenv("MOBOT_POOL_LOW_WATER", "0.5")),
+                             expected_payment_pmob=mc.mob2pmob(Decimal(os.getenv("MOBOT_EXPECTED_PAYMENT", "0.01"))))
+payouts = PayoutQueue(mcc, ACCOUNT_ID, payout_confirmations, send_payout_receipt, notify_payout_failed,
+                      workers=int(os.getenv("MOBOT_PAYOUT_WORKERS", "2")),
+                      batch_window=float(os.getenv("MOBOT_PAYOUT_BATCH_WINDOW", "0")),
+                      batch_size=int(os.getenv("MOBOT_PAYOUT_BATCH_SIZE", "15")),
+                      pool=txo_pool, ledger=ledger)
 
 
 def under_drop_quota(drop):
-    number_initial_drops_finished = DropSession.objects.filter(drop=drop, state__gt=SESSION_STATE_READY_TO_RECEIVE_INITIAL).count()
-    return number_initial_drops_finished < drop.initial_coin_limit
+    return has_initial_coins_left(drop)
 
 
 def minimum_coin_available(drop):
-    account_amount_response = mcc.get_balance_for_account(ACCOUNT_ID)
-    unspent_pmob = int(account_amount_response['unspent_pmob'])
-    return unspent_pmob >= (drop.initial_coin_amount_pmob + int(MINIMUM_FEE_PMOB))
+    return ledger.available() >= (drop.initial_coin_amount_pmob + int(MINIMUM_FEE_PMOB))
 
 
 def get_advertising_drop():
-    drops_to_advertise = Drop.objects.filter(advertisment_start_time__lte=timezone.now()).filter(
-        start_time__gt=timezone.now())
-
-    if len(drops_to_advertise) > 0:
-        return drops_to_advertise[0]
-    return None
+    return drop_schedule.advertising_drop()
 
 
 def get_active_drop():
-    active_drops = Drop.objects.filter(start_time__lte=timezone.now()).filter(end_time__gte=timezone.now())
-    if len(active_drops) == 0:
-        return None
-    return active_drops[0]
+    return drop_schedule.active_drop()
+
+def drop_to_refill_for():
+    "The active drop, loaded afresh: the scheduled copy doesn't follow how many coins have been claimed."
+    drop = get_active_drop()
+    return Drop.objects.filter(pk=drop.pk).first() if drop is not None else None
 
 def get_customer_store_preferences(customer, store_to_check):
     try:
@@ -155,7 +216,7 @@ def get_customer_store_preferences(customer, store_to_check):
 
 def customer_has_store_preferences(customer):
     try:
-        _ = CustomerStorePreferences.objects.get(customer=customer, store=store)
+        _ = CustomerStorePreferences.objects.get(customer=customer, store=current_store())
         return True
     except:
         return False
@@ -163,55 +224,69 @@ def customer_has_store_preferences(customer):
 
 @signal.payment_handler
 def handle_payment(source, receipt):
-    receipt_status = None
-    transaction_status = "TransactionPending"
+    def on_done(transaction_status, receipt_status):
+        signal.run_in_order(source, handle_confirmed_payment, source, receipt, transaction_status, receipt_status)
+
+    confirmations.watch((_signald_to_fullservice(receipt),), on_done)
 
-    while transaction_status == "TransactionPending":
-        receipt_status = mcc.check_receiver_receipt_status(PUBLIC_ADDRESS, _signald_to_fullservice(receipt))
-        transaction_status = receipt_status["receipt_transaction_status"]
 
-    if transaction_status != "TransactionSuccess":
-        return "The transaction failed!"
+def handle_confirmed_payment(source, receipt, transaction_status, receipt_status):
+    if transaction_status != TRANSACTION_SUCCESS:
+        print(f"Payment from {source} did not land: {transaction_status}")
+        # Their session is left as it was, so they can send it again if they were waiting to.
+        customer = session_cache.get_customer(source['number'])
+        if transaction_status in (TRANSACTION_TIMED_OUT, TRANSACTION_CHECK_FAILED):
+            log_and_send_message(customer, source, ("MOBot here! We couldn't confirm the payment you just sent. If your wallet doesn't show it as sent, please try again. If it does, please contact customer service at {}").format(current_store().phone_number))
+        else:
+            log_and_send_message(customer, source, "MOBot here! The payment you just sent didn't go through. Please try sending it again")
+        return
 
     amount_paid_mob = mc.pmob2mob(receipt_status["txo"]["value_pmob"])
+    # One refund per payment we received, however many times it is handled.
+    refund_key = f"refund-{receipt['txo_public_key']}"
 
     customer = None
     drop_session = None
 
     try:
-        customer, _ = Customer.objects.get_or_create(phone_number=source['number'])
-        drop_session = DropSession.objects.get(customer=customer, state=SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        customer = session_cache.get_customer(source['number'])
+        drop_session = session_cache.get_open_session(customer)
+        if drop_session is None or drop_session.state != SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION:
+            raise DropSession.DoesNotExist(f"{source['number']} isn't waiting for a bonus")
     except Exception as e:
         print(e)
         log_and_send_message(customer, source, "MOBot here! You sent us an unsolicited payment. We're returning it minus a network fee to cover our costs. We can't promise to always be paying attention and return unsolicited payments, so we suggest only sending us payments when we request them")
-        send_mob_to_customer(source, amount_paid_mob, False)
+        send_mob_to_customer(customer, source, amount_paid_mob, False, refund_key)
         return
 
     if not minimum_coin_available(drop_session.drop):
         log_and_send_message(customer, source, f"Thank you for sending {amount_paid_mob.normalize()} MOB! Unfortunately, we ran out of MOB to distribute 😭. We're returning your MOB and the network fee.")
-        send_mob_to_customer(source, amount_paid_mob, True)
+        send_mob_to_customer(customer, source, amount_paid_mob, True, refund_key)
         return
 
-    bonus_coin_objects_for_drop = BonusCoin.objects.filter(drop=drop_session.drop)
-    bonus_coins = []
-
-    for bonus_coin in bonus_coin_objects_for_drop:
-        number_claimed = DropSession.objects.filter(drop=drop_session.drop, bonus_coin_claimed=bonus_coin).count()
-        number_remaining = bonus_coin.number_available - number_claimed
-        bonus_coins.extend([bonus_coin] * number_remaining)
+    with transaction.atomic():
+        bonus_coin = claim_random_bonus_coin(drop_session.drop)
+        if bonus_coin is not None:
+            drop_session.bonus_coin_claimed = bonus_coin
+            drop_session.save()
 
-    if len(bonus_coins) <= 0:
+    if bonus_coin is None:
         log_and_send_message(customer, source, f"Thank you for sending {amount_paid_mob.normalize()} MOB! Unfortunately, we ran out of bonuses 😭. We're returning your MOB and the network fee.")
-        send_mob_to_customer(source, amount_paid_mob, True)
+        send_mob_to_customer(customer, source, amount_paid_mob, True, refund_key)
         return
 
     initial_coin_amount_mob = mc.pmob2mob(drop_session.drop.initial_coin_amount_pmob)
-    random_index = random.randint(0, len(bonus_coins) - 1)
-    amount_in_mob = mc.pmob2mob(bonus_coins[random_index].amount_pmob)
+    amount_in_mob = mc.pmob2mob(bonus_coin.amount_pmob)
     amount_to_send_mob = amount_in_mob + amount_paid_mob + mc.pmob2mob(MINIMUM_FEE_PMOB)
-    send_mob_to_customer(source, amount_to_send_mob, True)
-    drop_session.bonus_coin_claimed = bonus_coins[random_index]
-    drop_session.save()
+    if not send_mob_to_customer(customer, source, amount_to_send_mob, True, f"bonus-{drop_session.pk}"):
+        # The customer has been told why. Give the bonus back for someone else, and their payment back if we can.
+        with transaction.atomic():
+            release_bonus_coin(bonus_coin)
+            drop_session.bonus_coin_claimed = None
+            drop_session.save()
+        if get_payments_address(source) is not None:
+            send_mob_to_customer(customer, source, amount_paid_mob, True, refund_key)
+        return
     total_prize = Decimal(initial_coin_amount_mob + amount_in_mob)
     log_and_send_message(customer, source, f"We've sent you back {amount_to_send_mob.normalize()} MOB! That brings your total prize to {total_prize.normalize()} MOB")
     log_and_send_message(customer, source, f"Enjoy your {total_prize.normalize()} MOB!")
@@ -229,23 +304,23 @@ def handle_payment(source, receipt):
 
 def handle_drop_session_allow_contact_requested(message, drop_session):
     if message.text.lower() == "y" or message.text.lower() == "yes":
-        customer_prefs = CustomerStorePreferences(customer=drop_session.customer, store=store, allows_contact=True)
-        customer_prefs.save()
+        CustomerStorePreferences.objects.update_or_create(customer=drop_session.customer, store=current_store(),
+                                                          defaults={'allows_contact': True})
         drop_session.state = SESSION_STATE_COMPLETED
         drop_session.save()
         log_and_send_message(drop_session.customer, message.source, "Thanks! MOBot OUT. Buh-bye")
         return
 
     if message.text.lower() == "n" or message.text.lower() == "no":
-        customer_prefs = CustomerStorePreferences(customer=drop_session.customer, store=store, allows_contact=False)
-        customer_prefs.save()
+        CustomerStorePreferences.objects.update_or_create(customer=drop_session.customer, store=current_store(),
+                                                          defaults={'allows_contact': False})
         drop_session.state = SESSION_STATE_COMPLETED
         drop_session.save()
         log_and_send_message(drop_session.customer, message.source, "Thanks! MOBot OUT. Buh-bye")
         return
 
     if message.text.lower() == "p" or message.text.lower() == "privacy":
-        log_and_send_message(drop_session.customer, message.source, f"Our privacy policy is available here: {store.privacy_policy_url}\n\nWould you like to receive alerts for future drops?")
+        log_and_send_message(drop_session.customer, message.source, f"Our privacy policy is available here: {current_store().privacy_policy_url}\n\nWould you like to receive alerts for future drops?")
         return
 
     if message.text.lower() == "help":
@@ -263,25 +338,34 @@ def handle_drop_session_ready_to_receive(message, drop_session):
         return
 
     if message.text.lower() == "y" or message.text.lower() == "yes":
-        if not under_drop_quota(drop_session.drop):
+        if not minimum_coin_available(drop_session.drop):
             log_and_send_message(drop_session.customer, message.source, "Too late! We've distributed all of the MOB allocated to this airdrop.\n\nSorry 😭")
-            drop_session.state = SESSION_STATE_COMPLETED
+            drop_session.state = SESSION_STATE_CANCELLED
             drop_session.save()
             return
 
-        if not minimum_coin_available(drop_session.drop):
+        # The claim and the session moving on are saved together, so the counter always matches the sessions.
+        with transaction.atomic():
+            claimed = claim_initial_coin(drop_session.drop)
+            if claimed:
+                drop_session.state = SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION
+                drop_session.save()
+
+        if not claimed:
             log_and_send_message(drop_session.customer, message.source, "Too late! We've distributed all of the MOB allocated to this airdrop.\n\nSorry 😭")
-            drop_session.state = SESSION_STATE_COMPLETED
+            drop_session.state = SESSION_STATE_CANCELLED
             drop_session.save()
             return
 
         amount_in_mob = mc.pmob2mob(drop_session.drop.initial_coin_amount_pmob)
-        send_mob_to_customer(message.source, amount_in_mob, True)
+        if not send_mob_to_customer(drop_session.customer, message.source, amount_in_mob, True, f"initial-{drop_session.pk}"):
+            with transaction.atomic():
+                release_initial_coin(drop_session.drop)
+                drop_session.state = SESSION_STATE_CANCELLED
+                drop_session.save()
+            return
         log_and_send_message(drop_session.customer, message.source, f"Great! We've just sent you {amount_in_mob.normalize()} MOB (~£3). Send us 0.01 MOB, and we'll send it back, plus more! You could end up with as much as £50 of MOB")
         log_and_send_message(drop_session.customer, message.source, "To see your balance and send a payment:\n\n1. Select the attachment icon and select Pay\n2. Enter the amount you want to send (e.g. 0.01 MOB)\n3. Tap Pay\n4. Tap Confirm Payment")
-
-        drop_session.state = SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION
-        drop_session.save()
         return
 
     if message.text.lower() == "help":
@@ -344,6 +428,8 @@ def handle_no_active_drop_session(customer, message, drop):
 
     customer_payments_address = get_payments_address(message.source)
     if customer_payments_address is None:
+        # Look again next time, they may be about to turn payments on.
+        signal.profiles.invalidate(message.source)
         log_and_send_message(customer, message.source,
                              ("Hi! MOBot here.\n\nI'm a bot from MobileCoin that assists "
                               "in making purchases using Signal Messenger and MobileCoin\n\n"
@@ -376,18 +462,19 @@ def handle_no_active_drop_session(customer, message, drop):
     log_and_send_message(customer, message.source, "Ready?")
 
 
-@signal.chat_handler("coins")
+@signal.chat_command("coins")
 def chat_router_coins(message, match):
-    bonus_coins = BonusCoin.objects.all()
-    for bonus_coin in bonus_coins:
-        number_claimed = DropSession.objects.filter(bonus_coin_claimed=bonus_coin).count()
-        signal.send_message(message.source, f"{number_claimed} out of {bonus_coin.number_available} {mc.pmob2mob(bonus_coin.amount_pmob).normalize()}MOB Bonus Coins claimed ")
+    tiers = drop_stats.bonus_coins()
+    if tiers:
+        signal.send_message(message.source, format_bonus_coins(tiers))
 
 
-@signal.chat_handler("unsubscribe")
+@signal.chat_command("unsubscribe")
 def unsubscribe_handler(message, _match):
-    customer, _is_new = Customer.objects.get_or_create(phone_number=message.source['number'])
-    store_preferences, _is_new = CustomerStorePreferences.objects.get_or_create(customer=customer, store=store)
+    customer = session_cache.get_customer(message.source['number'])
+    log_received_message(customer, message)
+    store_preferences, _is_new = CustomerStorePreferences.objects.get_or_create(
+        customer=customer, store=current_store(), defaults={"allows_contact": False})
 
     if not store_preferences.allows_contact:
         log_and_send_message(customer, message.source, "You are not currently receiving any notifications")
@@ -399,10 +486,12 @@ def unsubscribe_handler(message, _match):
     log_and_send_message(customer, message.source, "You will no longer receive notifications about future drops.")
 
 
-@signal.chat_handler("subscribe")
+@signal.chat_command("subscribe")
 def subscribe_handler(message, _match):
-    customer, _is_new = Customer.objects.get_or_create(phone_number=message.source['number'])
-    store_preferences, _is_new = CustomerStorePreferences.objects.get_or_create(customer=customer, store=store)
+    customer = session_cache.get_customer(message.source['number'])
+    log_received_message(customer, message)
+    store_preferences, _is_new = CustomerStorePreferences.objects.get_or_create(
+        customer=customer, store=current_store(), defaults={"allows_contact": False})
 
     if store_preferences.allows_contact:
         log_and_send_message(customer, message.source, "You are already subscribed.")
@@ -416,13 +505,12 @@ def subscribe_handler(message, _match):
 
 @signal.chat_handler("")
 def chat_router(message, match):
-    customer, _ = Customer.objects.get_or_create(phone_number=message.source['number'])
-    try:
-        active_drop_session = DropSession.objects.get(customer=customer, state__gte=SESSION_STATE_READY_TO_RECEIVE_INITIAL, state__lt=SESSION_STATE_COMPLETED)
+    customer = session_cache.get_customer(message.source['number'])
+    log_received_message(customer, message)
+    active_drop_session = session_cache.get_open_session(customer)
+    if active_drop_session is not None:
         handle_active_drop_session(message, active_drop_session)
         return
-    except:
-        pass
 
     drop_to_advertise = get_advertising_drop()
     if drop_to_advertise is not None:
@@ -445,13 +533,16 @@ def chat_router(message, match):
 
 
 def log_and_send_message(customer, source, text):
-    sent_message = Message(customer=customer, store=store, text=text, direction=MESSAGE_DIRECTION_SENT)
-    sent_message.save()
+    message_log.log(customer, current_store(), text, MESSAGE_DIRECTION_SENT)
     signal.send_message(source, text)
 
 
+def log_received_message(customer, message):
+    message_log.log(customer, current_store(), message.text, MESSAGE_DIRECTION_RECEIVED)
+
+
 def get_signal_profile_name(source):
-    customer_signal_profile = signal.get_profile(source, True)
+    customer_signal_profile = signal.profiles.get(source)
     try:
         customer_name = customer_signal_profile['data']['name']
         return customer_name
@@ -460,7 +551,7 @@ def get_signal_profile_name(source):
 
 
 def get_payments_address(source):
-    customer_signal_profile = signal.get_profile(source, True)
+    customer_signal_profile = signal.profiles.get(source)
     print(customer_signal_profile)
     try:
         customer_payments_address = customer_signal_profile['data']['paymentsAddress']
@@ -472,9 +563,38 @@ def get_payments_address(source):
 class Command(BaseCommand):
     help = 'Run MOBot Client'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chat-workers', type=int, default=int(os.getenv("MOBOT_CHAT_WORKERS", "8")),
+                            help='Threads handling chat messages in parallel (0 handles every message inline)')
+        parser.add_argument('--payment-workers', type=int, default=int(os.getenv("MOBOT_PAYMENT_WORKERS", "2")),
+                            help='Threads reserved for payment messages')
+        parser.add_argument('--queue-size', type=int, default=int(os.getenv("MOBOT_QUEUE_SIZE", "100")),
+                            help='Messages each lane may have queued before the receive loop waits')
+        parser.add_argument('--max-chat-wait', type=float, default=float(os.getenv("MOBOT_MAX_CHAT_WAIT", "5")),
+                            help='Seconds chat may wait before it is served ahead of payments')
+        parser.add_argument('--report-interval', type=float, default=MOBOT_REPORT_INTERVAL,
+                            help='Seconds between queue metrics reports (0 disables them)')
+        parser.add_argument('--pool-refill-interval', type=float,
+                            default=float(os.getenv("MOBOT_POOL_REFILL_INTERVAL", "60")),
+                            help='Seconds between splitting txos for the active drop\'s payouts (0 disables it)')
+
     def handle(self, *args, **kwargs):
+        payouts.resume()
+        if kwargs['pool_refill_interval']:
+            pool_refiller.start(drop_to_refill_for, kwargs['pool_refill_interval'])
         try:
-            signal.run_chat(True)
+            signal.run_chat(True, chat_workers=kwargs['chat_workers'], payment_workers=kwargs['payment_workers'],
+                            queue_size=kwargs['queue_size'], max_chat_wait=kwargs['max_chat_wait'],
+                            report_interval=kwargs['report_interval'], prefetch_profiles=True)
         except KeyboardInterrupt as e:
             print()
             pass
+        finally:
+            pool_refiller.close()
+            payouts.close()
+            payout_confirmations.close()
+            confirmations.close()
+            if signal.scheduler is not None:
+                signal.scheduler.close()
+            # Last, so that it saves what the handlers above logged while they wound down.
+            message_log.close()
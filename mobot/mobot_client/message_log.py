@@ -0,0 +1,167 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+from mobot_client.models import Customer, Message, Store
+
+
+class MessageLog:
+    """
+    Saves conversation messages in the background, so that logging one never waits on the database.
+
+    log() only adds the message to a buffer. A writer thread saves the buffer with one bulk insert once it holds
+    `flush_size` messages, or `flush_interval` seconds after the oldest one was logged, whichever comes first.
+    If the bulk insert fails, the messages are saved one by one and any the database rejects are dropped, so one
+    bad message can't hold up the rest. If the database can't be reached, the messages are kept and tried again
+    with the next write, up to `max_backlog` messages, past which the oldest are dropped. close() writes whatever
+    is left. A message's date is when it was written, which is at most `flush_interval` seconds late.
+    """
+
+    def __init__(self, flush_size: int = 100, flush_interval: float = 1.0, max_backlog: int = 10000,
+                 report_interval: Optional[float] = None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self._cond = threading.Condition()
+        self._buffer = []  # type: List[Message]
+        # When the oldest message in the buffer was logged.
+        self._oldest = None  # type: Optional[float]
+        self._closed = False
+
+        self._logged = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed_flushes = 0
+        self._flushes = 0
+        self._flush_time = 0.0
+        self._max_flush_time = 0.0
+
+        # close() flushes too, and batches must go in one at a time to keep messages in order.
+        self._flush_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write, name="message-log", daemon=True)
+        self._writer.start()
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="message-log-report",
+                             daemon=True).start()
+
+    def log(self, customer: Customer, store: Store, text: str, direction: int):
+        with self._cond:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(Message(customer=customer, store=store, text=text, direction=direction))
+            self._logged += 1
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def flush(self) -> bool:
+        "Write everything logged so far, and return whether that worked."
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer, self._oldest = self._buffer, [], None
+            if not batch:
+                return True
+
+            started = time.monotonic()
+            try:
+                try:
+                    # All or nothing, so that saving them one by one after a failure can't save any twice.
+                    with transaction.atomic():
+                        Message.objects.bulk_create(batch, batch_size=self.flush_size)
+                    unsaved, rejected = [], 0
+                except Exception as e:
+                    print(f"Could not save {len(batch)} messages at once, saving them one by one: {e}")
+                    unsaved, rejected = self._save_each(batch)
+            finally:
+                # This thread outlives requests, so let Django drop a connection that has gone bad.
+                close_old_connections()
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._written += len(batch) - len(unsaved) - rejected
+                self._dropped += rejected
+                if unsaved:
+                    self._failed_flushes += 1
+                    self._buffer[:0] = unsaved
+                    overflow = len(self._buffer) - self.max_backlog
+                    if overflow > 0:
+                        del self._buffer[:overflow]
+                        self._dropped += overflow
+                    self._oldest = started
+                    return False
+                self._flushes += 1
+                self._flush_time += elapsed
+                self._max_flush_time = max(self._max_flush_time, elapsed)
+            return True
+
+    @staticmethod
+    def _save_each(batch: List[Message]) -> Tuple[List[Message], int]:
+        """
+        Save messages one at a time, dropping any the database rejects. Stops at the first other error, and
+        returns the messages from there on, to try again, along with how many were dropped.
+        """
+        rejected = 0
+        for i, message in enumerate(batch):
+            # The failed bulk insert may have given it a primary key that was rolled back.
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    message.save()
+            except (DataError, IntegrityError, ValueError, TypeError) as e:
+                print(f"Dropping a message that can't be saved: {e}")
+                rejected += 1
+            except Exception as e:
+                print(f"Could not save {len(batch) - i} messages, will try again: {e}")
+                return batch[i:], rejected
+        return [], rejected
+
+    def _write(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(self._wait_time())
+                closed = self._closed
+            if closed:
+                return
+            if not self.flush():
+                # Don't hammer a database that is down.
+                time.sleep(self.flush_interval)
+
+    def _due(self) -> bool:
+        return bool(self._buffer) and (len(self._buffer) >= self.flush_size
+                                       or time.monotonic() - self._oldest >= self.flush_interval)
+
+    def _wait_time(self) -> Optional[float]:
+        if not self._buffer:
+            return None
+        return max(0.0, self._oldest + self.flush_interval - time.monotonic())
+
+    def close(self):
+        "Stop the writer thread once it has written every message logged before now."
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "backlog": len(self._buffer),
+                "logged": self._logged,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed_flushes": self._failed_flushes,
+                "avg_flush_time": self._flush_time / self._flushes if self._flushes else 0.0,
+                "max_flush_time": self._max_flush_time,
+            }
+
+    def _report(self, interval: float):
+        while True:
+            time.sleep(interval)
+            print("message log: backlog={backlog} logged={logged} written={written} dropped={dropped} "
+                  "failed_flushes={failed_flushes} avg_flush_time={avg_flush_time:.3f}s "
+                  "max_flush_time={max_flush_time:.3f}s".format(**self.stats()))
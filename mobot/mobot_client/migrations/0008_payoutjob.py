@@ -0,0 +1,33 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-14 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0007_auto_20210611_1955'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.TextField(unique=True)),
+                ('payments_address', models.TextField()),
+                ('amount_pmob', models.BigIntegerField()),
+                ('state', models.IntegerField(default=0)),
+                ('tx_proposal', models.TextField(blank=True, default=None, null=True)),
+                ('receiver_receipt', models.TextField(blank=True, default=None, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default=None, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mobot_client.customer')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-14 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0008_payoutjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tx_proposal', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payoutjob',
+            name='batch',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mobot_client.payoutbatch'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0009_payoutbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payoutbatch',
+            name='input_txo_ids',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='payoutjob',
+            name='input_txo_ids',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-15 14:30
+
+from django.db import migrations, models
+
+
+def backfill_claimed_counters(apps, schema_editor):
+    Drop = apps.get_model('mobot_client', 'Drop')
+    BonusCoin = apps.get_model('mobot_client', 'BonusCoin')
+    DropSession = apps.get_model('mobot_client', 'DropSession')
+
+    for drop in Drop.objects.all():
+        # Sessions past SESSION_STATE_READY_TO_RECEIVE_INITIAL have had their initial coin.
+        drop.initial_coins_claimed = DropSession.objects.filter(drop=drop, state__gt=0).count()
+        drop.save(update_fields=['initial_coins_claimed'])
+
+    for bonus_coin in BonusCoin.objects.all():
+        bonus_coin.number_claimed = DropSession.objects.filter(bonus_coin_claimed=bonus_coin).count()
+        bonus_coin.save(update_fields=['number_claimed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0010_payout_input_txo_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bonuscoin',
+            name='number_claimed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='drop',
+            name='initial_coins_claimed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_claimed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-16 09:05
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    "Make existing rows fit the new unique constraints, keeping the newest of each."
+    CustomerStorePreferences = apps.get_model('mobot_client', 'CustomerStorePreferences')
+    DropSession = apps.get_model('mobot_client', 'DropSession')
+
+    duplicates = CustomerStorePreferences.objects.values('customer', 'store') \
+        .annotate(count=Count('pk'), newest=Max('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        CustomerStorePreferences.objects.filter(customer=duplicate['customer'], store=duplicate['store']) \
+            .exclude(pk=duplicate['newest']).delete()
+
+    # Open sessions are 0 <= state < 3; extra ones are cancelled (-1).
+    open_sessions = DropSession.objects.filter(state__gte=0, state__lt=3)
+    duplicates = open_sessions.values('customer').annotate(count=Count('pk'), newest=Max('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        open_sessions.filter(customer=duplicate['customer']).exclude(pk=duplicate['newest']).update(state=-1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0011_claimed_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drop',
+            index=models.Index(fields=['start_time', 'end_time'], name='drop_active_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drop',
+            index=models.Index(fields=['advertisment_start_time', 'start_time'], name='drop_advertising_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dropsession',
+            index=models.Index(fields=['customer', 'state'], name='dropsession_customer_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dropsession',
+            index=models.Index(fields=['drop', 'state'], name='dropsession_drop_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dropsession',
+            index=models.Index(fields=['drop', 'bonus_coin_claimed'], name='dropsession_drop_bonus_idx'),
+        ),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customerstorepreferences',
+            constraint=models.UniqueConstraint(fields=('customer', 'store'), name='unique_customer_store_preferences'),
+        ),
+        migrations.AddConstraint(
+            model_name='dropsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('state__gte', 0), ('state__lt', 3)), fields=('customer',), name='one_open_session_per_customer'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+# Generated by Django 3.0.4 on 2021-06-22 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mobot_client', '0012_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payoutjob',
+            name='transaction_log_id',
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -34,9 +34,16 @@ class Drop(models.Model):
     timezone = models.TextField()
     initial_coin_amount_pmob = models.PositiveIntegerField(default=0)
     initial_coin_limit = models.PositiveIntegerField(default=0)
+    initial_coins_claimed = models.PositiveIntegerField(default=0)
     conversion_rate_mob_to_currency = models.FloatField(default=1.0)
     currency_symbol = models.TextField(default="$")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_time', 'end_time'], name='drop_active_window_idx'),
+            models.Index(fields=['advertisment_start_time', 'start_time'], name='drop_advertising_window_idx'),
+        ]
+
     def value_in_currency(self, amount):
         return amount * self.conversion_rate_mob_to_currency
 
@@ -47,6 +54,7 @@ class BonusCoin(models.Model):
     drop = models.ForeignKey(Drop, on_delete=models.CASCADE)
     amount_pmob = models.PositiveIntegerField(default=0)
     number_available = models.PositiveIntegerField(default=0)
+    number_claimed = models.PositiveIntegerField(default=0)
 
 class Customer(models.Model):
     phone_number = models.TextField(primary_key=True)
@@ -60,12 +68,29 @@ class CustomerStorePreferences(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
     allows_contact = models.BooleanField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'store'], name='unique_customer_store_preferences'),
+        ]
+
 class DropSession(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     drop = models.ForeignKey(Drop, on_delete=models.CASCADE)
     state = models.IntegerField(default=0)
     bonus_coin_claimed = models.ForeignKey(BonusCoin, on_delete=models.CASCADE, default=None, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'state'], name='dropsession_customer_state_idx'),
+            models.Index(fields=['drop', 'state'], name='dropsession_drop_state_idx'),
+            models.Index(fields=['drop', 'bonus_coin_claimed'], name='dropsession_drop_bonus_idx'),
+        ]
+        constraints = [
+            # Sessions from SESSION_STATE_READY_TO_RECEIVE_INITIAL up to SESSION_STATE_COMPLETED are open.
+            models.UniqueConstraint(fields=['customer'], condition=models.Q(state__gte=0, state__lt=3),
+                                    name='one_open_session_per_customer'),
+        ]
+
 class Message(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
@@ -73,6 +98,30 @@ class Message(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     direction = models.PositiveIntegerField()
 
+class PayoutBatch(models.Model):
+    tx_proposal = models.TextField()
+    input_txo_ids = models.TextField(default=None, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+class PayoutJob(models.Model):
+    idempotency_key = models.TextField(unique=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    batch = models.ForeignKey(PayoutBatch, on_delete=models.SET_NULL, default=None, blank=True, null=True)
+    payments_address = models.TextField()
+    amount_pmob = models.BigIntegerField()
+    state = models.IntegerField(default=0)
+    tx_proposal = models.TextField(default=None, blank=True, null=True)
+    input_txo_ids = models.TextField(default=None, blank=True, null=True)
+    receiver_receipt = models.TextField(default=None, blank=True, null=True)
+    transaction_log_id = models.TextField(default=None, blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(default=None, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.idempotency_key} ({self.customer})'
+
 #------------------------------------------------------------------------------------------
 
 class SingletonModel(models.Model):
@@ -0,0 +1,414 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import functools
+import json
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from mobot_client.confirmations import (TRANSACTION_FAILURE, TRANSACTION_PENDING, TRANSACTION_SUCCESS,
+                                        ReceiptConfirmations)
+from mobot_client.ledger import WalletLedger
+from mobot_client.models import Customer, PayoutBatch, PayoutJob
+from mobot_client.txo_pool import TXO_STATUS_SPENT, TXO_STATUS_UNSPENT, TxoPool
+
+PAYOUT_STATE_FAILED = -1
+PAYOUT_STATE_QUEUED = 0
+PAYOUT_STATE_BUILT = 1
+PAYOUT_STATE_SUBMITTED = 2
+PAYOUT_STATE_COMPLETED = 3
+# Submitting it kept failing, but full-service may have taken it anyway.
+PAYOUT_STATE_UNCERTAIN = 4
+
+PAYOUT_STATES_UNFINISHED = (PAYOUT_STATE_QUEUED, PAYOUT_STATE_BUILT, PAYOUT_STATE_SUBMITTED, PAYOUT_STATE_UNCERTAIN)
+
+# A MobileCoin transaction has at most 16 outputs, and one of them is our change.
+MAX_OUTLAYS = 15
+
+
+def build_transaction(mcc, account_id: str, addresses_and_values: Sequence[Tuple[str, int]],
+                      input_txo_ids: Optional[Sequence[str]] = None) -> dict:
+    """
+    Build one transaction paying every (public address, amount in pmob) pair, spending `input_txo_ids` if
+    given and whatever full-service picks otherwise.
+
+    mobilecoin.Client.build_transaction only takes a single recipient, but full-service takes a list.
+    """
+    params = {
+        "account_id": account_id,
+        "addresses_and_values": [(address, str(value)) for address, value in addresses_and_values],
+    }
+    if input_txo_ids:
+        params["input_txo_ids"] = list(input_txo_ids)
+    r = mcc._req({"method": "build_transaction", "params": params})
+    return r['tx_proposal']
+
+
+def payout_inputs(job: PayoutJob) -> List[str]:
+    "The txos the transaction paying a job spends, if they were chosen from the pool."
+    input_txo_ids = job.batch.input_txo_ids if job.batch is not None else job.input_txo_ids
+    return json.loads(input_txo_ids) if input_txo_ids else []
+
+
+def unfinished_payout_inputs() -> List[str]:
+    "The txos spent by every payout that hasn't landed or failed yet, which nothing else may spend."
+    return [txo_id for job in PayoutJob.objects.filter(state__in=PAYOUT_STATES_UNFINISHED).select_related('batch')
+            for txo_id in payout_inputs(job)]
+
+
+# How full-service's transaction log statuses read as confirmation statuses.
+_TRANSACTION_LOG_STATUSES = {
+    "tx_status_built": TRANSACTION_PENDING,
+    "tx_status_pending": TRANSACTION_PENDING,
+    "tx_status_succeeded": TRANSACTION_SUCCESS,
+    "tx_status_failed": TRANSACTION_FAILURE,
+}
+
+
+def check_transaction_log(mcc, transaction_log_id: str) -> Tuple[str, dict]:
+    """
+    How a transaction we submitted is doing, as a ReceiptConfirmations check. Receiver receipts can only be
+    checked against our own addresses, so our own payouts are followed through their transaction log instead.
+    """
+    r = mcc._req({"method": "get_transaction_log", "params": {"transaction_log_id": transaction_log_id}})
+    transaction_log = r['transaction_log']
+    return _TRANSACTION_LOG_STATUSES.get(transaction_log['status'], transaction_log['status']), transaction_log
+
+
+class PayoutQueue:
+    """
+    Pays customers in the background, durably.
+
+    enqueue() records a PayoutJob and returns straight away. Worker threads then build the transaction, submit
+    it, and watch its transaction log with `confirmations`, whose check is check_transaction_log. Once it has
+    landed, send_receipt(job, receipt) is called with the customer's receiver receipt, and if it can't be paid,
+    notify_failed(job). The job is saved after every step.
+
+    A job is only ever paid once: its idempotency key is unique, and the transaction proposal is saved before
+    it is submitted. A job interrupted by a restart (see resume()) resubmits that same proposal, whose inputs
+    the ledger will only ever spend once, rather than building a new one.
+
+    With a `batch_window`, new jobs are gathered for up to that many seconds (or until there are `batch_size`)
+    and paid together by one transaction with an output each, recorded as a PayoutBatch. That costs one fee
+    and one set of full-service calls per batch instead of per customer. Every customer still gets their own
+    receiver receipt, since full-service makes one per output in the order the outputs were given.
+
+    With a `pool`, every transaction spends inputs reserved from it, so workers building transactions at the
+    same time don't fight over the same txos.
+
+    With a `ledger`, every job reserves its amount when it is queued, and enqueue() refuses jobs the wallet
+    can't cover. The reservation is committed once the payout lands and released if it fails.
+
+    A payout only fails once full-service says its transaction failed. One that can't be confirmed in time is
+    watched again, and one whose submission kept failing is marked PAYOUT_STATE_UNCERTAIN, since full-service
+    may have taken it before the error. Either way its txos and funds stay held. An uncertain payout is looked
+    at every `settle_interval` seconds: it has landed once the pool lists its inputs as spent, and has failed
+    if they are still unspent `uncertain_timeout` seconds after it was given up on.
+    """
+
+    def __init__(self, mcc, account_id: str, confirmations: ReceiptConfirmations,
+                 send_receipt: Callable[[PayoutJob, dict], None], notify_failed: Callable[[PayoutJob], None],
+                 workers: int = 2, max_attempts: int = 5, retry_delay: float = 1.0, batch_window: float = 0.0,
+                 batch_size: int = MAX_OUTLAYS, pool: Optional[TxoPool] = None,
+                 ledger: Optional[WalletLedger] = None, settle_interval: float = 30.0,
+                 uncertain_timeout: float = 600.0):
+        self._mcc = mcc
+        self._pool = pool
+        self._ledger = ledger
+        self.account_id = account_id
+        self._confirmations = confirmations
+        self._send_receipt = send_receipt
+        self._notify_failed = notify_failed
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.settle_interval = settle_interval
+        self.uncertain_timeout = uncertain_timeout
+        self.batch_window = batch_window
+        self.batch_size = min(batch_size, MAX_OUTLAYS)
+        # Tuples of job pks, each paid by a single transaction
+        self._queue = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"payout-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._workers:
+            thread.start()
+
+        self._incoming = None
+        self._collector = None
+        if batch_window > 0 and self.batch_size > 1:
+            self._incoming = queue.Queue()
+            self._collector = threading.Thread(target=self._collect, name="payout-batcher", daemon=True)
+            self._collector.start()
+
+    def enqueue(self, idempotency_key: str, customer: Customer, payments_address: str,
+                amount_pmob: int) -> Optional[PayoutJob]:
+        """
+        Queue a payout, unless one with the same idempotency key already exists, and return its job. Returns
+        None if the ledger says the wallet can't cover it.
+        """
+        # Only a new job holds funds: an existing one already did, and may have been paid or released since.
+        reserved = False
+        try:
+            with transaction.atomic():
+                job, created = PayoutJob.objects.get_or_create(
+                    idempotency_key=idempotency_key,
+                    defaults=dict(customer=customer, payments_address=payments_address, amount_pmob=amount_pmob),
+                )
+                if created and self._ledger is not None:
+                    if not self._ledger.reserve(idempotency_key, amount_pmob):
+                        transaction.set_rollback(True)
+                        print(f"Not enough MOB available for payout {idempotency_key}")
+                        return None
+                    reserved = True
+        except Exception:
+            if reserved:
+                self._ledger.release(idempotency_key)
+            raise
+
+        if created:
+            self._queue_new(job.pk)
+        else:
+            print(f"Payout {idempotency_key} was already queued")
+        return job
+
+    def resume(self):
+        "Pick up every job left unfinished by an earlier run."
+        batches = {}
+        for job in PayoutJob.objects.filter(state__in=PAYOUT_STATES_UNFINISHED).select_related('batch') \
+                .order_by('pk'):
+            if self._pool is not None:
+                self._pool.reserve_ids(payout_inputs(job))
+            if self._ledger is not None:
+                self._ledger.reserve(job.idempotency_key, job.amount_pmob, force=True)
+            if job.batch_id is not None:
+                batches.setdefault(job.batch_id, []).append(job.pk)
+            elif job.state == PAYOUT_STATE_QUEUED:
+                self._queue_new(job.pk)
+            else:
+                self._queue.put((job.pk,))
+        for pks in batches.values():
+            self._queue.put(tuple(pks))
+
+    def pending(self) -> int:
+        "How many jobs are waiting for a worker."
+        return self._queue.qsize() + (self._incoming.qsize() if self._incoming is not None else 0)
+
+    def close(self, wait: bool = True):
+        "Stop the workers once every job already queued has been submitted."
+        if self._collector is not None:
+            self._incoming.put(None)
+            self._collector.join()
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for thread in self._workers:
+                thread.join()
+
+    def _queue_new(self, pk: int):
+        if self._incoming is not None:
+            self._incoming.put(pk)
+        else:
+            self._queue.put((pk,))
+
+    def _collect(self):
+        "Gather new jobs into batches for the workers."
+        while True:
+            pk = self._incoming.get()
+            if pk is None:
+                return
+
+            pks = [pk]
+            deadline = time.monotonic() + self.batch_window
+            closing = False
+            while len(pks) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pk = self._incoming.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pk is None:
+                    closing = True
+                    break
+                pks.append(pk)
+
+            self._queue.put(tuple(pks))
+            if closing:
+                return
+
+    def _work(self):
+        while True:
+            pks = self._queue.get()
+            if pks is None:
+                return
+            try:
+                self._advance(pks)
+            except Exception as e:  # noqa - One bad payout shouldn't take the worker down.
+                print(e)
+            finally:
+                close_old_connections()
+
+    def _advance(self, pks: Tuple[int, ...]):
+        jobs = list(PayoutJob.objects.filter(pk__in=pks).select_related('batch').order_by('pk'))
+
+        queued = [job for job in jobs if job.state == PAYOUT_STATE_QUEUED]
+        if queued and not self._build(queued):
+            return
+
+        built = [job for job in jobs if job.state == PAYOUT_STATE_BUILT]
+        if built and not self._submit(built):
+            return
+
+        uncertain = [job for job in jobs if job.state == PAYOUT_STATE_UNCERTAIN]
+        if uncertain:
+            self._settle(uncertain)
+
+        # Jobs paid by the same transaction share its log, so it only needs watching once.
+        by_transaction_log = {}
+        for job in jobs:
+            if job.state != PAYOUT_STATE_SUBMITTED:
+                continue
+            if job.transaction_log_id is None:
+                self._fail(job, job.last_error or "Submitted without a transaction log to follow")
+                continue
+            by_transaction_log.setdefault(job.transaction_log_id, []).append(job.pk)
+        for transaction_log_id, job_pks in by_transaction_log.items():
+            self._confirmations.watch((transaction_log_id,), functools.partial(self._on_confirmed, job_pks))
+
+    def _build(self, jobs: List[PayoutJob]) -> bool:
+        "Build one transaction paying every job. Returns False if they have been dealt with some other way."
+        input_txo_ids = None
+        if self._pool is not None:
+            input_txo_ids = self._pool.reserve(sum(job.amount_pmob for job in jobs))
+            if input_txo_ids is None:
+                print("Not enough free txos in the pool, letting full-service choose the inputs")
+        try:
+            tx_proposal = build_transaction(self._mcc, self.account_id,
+                                            [(job.payments_address, job.amount_pmob) for job in jobs],
+                                            input_txo_ids)
+            receiver_receipts = self._mcc.create_receiver_receipts(tx_proposal)
+            # One receipt per output in the order they were asked for, not counting change.
+            if len(receiver_receipts) != len(jobs):
+                raise ValueError(f"Expected {len(jobs)} receiver receipts, got {len(receiver_receipts)}")
+        except Exception as e:  # noqa - Whatever went wrong, it has to be dealt with here.
+            if input_txo_ids:
+                self._pool.release(input_txo_ids)
+            if len(jobs) > 1:
+                # Don't let one bad address hold up everyone else in the batch.
+                print(f"Could not build a batch of {len(jobs)} payouts, paying them one by one: {e}")
+                for job in jobs:
+                    self._queue.put((job.pk,))
+            else:
+                self._fail(jobs[0], str(e))
+            return False
+
+        with transaction.atomic():
+            input_txo_ids = json.dumps(input_txo_ids) if input_txo_ids else None
+            batch = None
+            if len(jobs) > 1:
+                batch = PayoutBatch.objects.create(tx_proposal=json.dumps(tx_proposal), input_txo_ids=input_txo_ids)
+            for job, receiver_receipt in zip(jobs, receiver_receipts):
+                job.batch = batch
+                job.tx_proposal = None if batch is not None else json.dumps(tx_proposal)
+                job.input_txo_ids = None if batch is not None else input_txo_ids
+                job.receiver_receipt = json.dumps(receiver_receipt)
+                job.state = PAYOUT_STATE_BUILT
+                job.save()
+        return True
+
+    def _submit(self, jobs: List[PayoutJob]) -> bool:
+        "Submit the transaction paying built jobs. Returns False if they have been put back to retry later."
+        batch = jobs[0].batch
+        tx_proposal = batch.tx_proposal if batch is not None else jobs[0].tx_proposal
+        try:
+            transaction_log = self._mcc.submit_transaction(json.loads(tx_proposal), self.account_id)
+        except Exception as e:  # noqa - full-service errors are retried.
+            attempts = max(job.attempts for job in jobs) + 1
+            for job in jobs:
+                job.attempts = attempts
+                job.last_error = str(e)
+            if attempts >= self.max_attempts:
+                # The error may have come after full-service took the transaction, so its txos and funds stay
+                # held until _settle can tell whether it landed.
+                print(f"Giving up submitting {len(jobs)} payouts, which may have landed anyway: {e}")
+                for job in jobs:
+                    job.state = PAYOUT_STATE_UNCERTAIN
+            for job in jobs:
+                job.save()
+            delay = self.settle_interval if attempts >= self.max_attempts else self.retry_delay * 2 ** (attempts - 1)
+            self._later(jobs, delay)
+            return False
+
+        for job in jobs:
+            job.transaction_log_id = transaction_log['transaction_log_id']
+            job.state = PAYOUT_STATE_SUBMITTED
+            job.save()
+        return True
+
+    def _settle(self, jobs: List[PayoutJob]):
+        "Find out whether the transaction paying uncertain jobs landed, from the status of its inputs."
+        input_txo_ids = payout_inputs(jobs[0])
+        if self._pool is None or not input_txo_ids:
+            print(f"Can't tell whether payouts {[job.idempotency_key for job in jobs]} landed: full-service chose "
+                  f"their inputs. Their funds stay held until someone looks into it.")
+            return
+
+        self._pool.refresh()
+        statuses = set(self._pool.statuses(input_txo_ids).values())
+        if statuses == {TXO_STATUS_SPENT}:
+            self._complete(jobs)
+        elif statuses == {TXO_STATUS_UNSPENT} and \
+                (timezone.now() - max(job.updated for job in jobs)).total_seconds() >= self.uncertain_timeout:
+            for job in jobs:
+                self._fail(job, f"Never landed: {job.last_error}")
+        else:
+            self._later(jobs, self.settle_interval)
+
+    def _later(self, jobs: List[PayoutJob], delay: float):
+        "Put jobs back on the queue in `delay` seconds."
+        timer = threading.Timer(delay, self._queue.put, (tuple(job.pk for job in jobs),))
+        timer.daemon = True
+        timer.start()
+
+    def _complete(self, jobs: List[PayoutJob]):
+        for job in jobs:
+            job.state = PAYOUT_STATE_COMPLETED
+            job.save()
+            if self._ledger is not None:
+                self._ledger.commit(job.idempotency_key)
+            self._send_receipt(job, json.loads(job.receiver_receipt))
+
+    def _fail(self, job: PayoutJob, error: str):
+        job.state = PAYOUT_STATE_FAILED
+        job.last_error = error
+        job.save()
+        if self._pool is not None:
+            # Its transaction never landed, so whatever it meant to spend is free again.
+            self._pool.release(payout_inputs(job))
+        if self._ledger is not None:
+            self._ledger.release(job.idempotency_key)
+        print(f"Payout {job.idempotency_key} failed: {error}")
+        self._notify_failed(job)
+
+    def _on_confirmed(self, pks: List[int], transaction_status: str, transaction_log: Optional[dict]):
+        try:
+            jobs = list(PayoutJob.objects.filter(pk__in=pks, state=PAYOUT_STATE_SUBMITTED).order_by('pk'))
+            if not jobs:
+                return
+            if transaction_status == TRANSACTION_SUCCESS:
+                self._complete(jobs)
+            elif transaction_status == TRANSACTION_FAILURE:
+                for job in jobs:
+                    self._fail(job, transaction_status)
+            else:
+                # Timed out, or full-service couldn't say: it may land yet, so its txos and funds stay held.
+                print(f"Transaction {jobs[0].transaction_log_id} is still unconfirmed ({transaction_status}), "
+                      f"watching it again")
+                self._confirmations.watch((jobs[0].transaction_log_id,), functools.partial(self._on_confirmed, pks))
+        finally:
+            close_old_connections()
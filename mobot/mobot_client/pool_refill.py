@@ -0,0 +1,144 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import mobilecoin as mc
+from django.db import close_old_connections
+
+from mobot_client.confirmations import TRANSACTION_PENDING, TRANSACTION_SUCCESS
+from mobot_client.models import BonusCoin, Drop
+from mobot_client.payouts import MAX_OUTLAYS, build_transaction, check_transaction_log
+from mobot_client.txo_pool import TxoPool
+
+# Txo value -> (label, how many the pool should hold)
+Targets = Dict[int, Tuple[str, int]]
+
+
+class PoolRefiller:
+    """
+    Keeps a TxoPool stocked with txos sized for a drop's payouts, by paying bigger txos back to ourselves split
+    into those sizes.
+
+    It has to share its pool with the PayoutQueue, so that it never splits a txo a payout has reserved; that is
+    why the bot runs it itself, with start(). A size is refilled once fewer than `low_water` of its target are
+    left. Each split waits on its own transaction log for up to `confirm_timeout` seconds before the next one,
+    since the change is only spendable once it has landed.
+    """
+
+    def __init__(self, mcc, account_id: str, public_address: str, pool: TxoPool, fee_pmob: int,
+                 low_water: float = 0.5, expected_payment_pmob: int = 10 ** 10, count: Optional[int] = None,
+                 confirm_timeout: float = 60.0, poll_interval: float = 1.0, log: Callable[[str], None] = print):
+        self._mcc = mcc
+        self.account_id = account_id
+        self.public_address = public_address
+        self.pool = pool
+        self.fee_pmob = int(fee_pmob)
+        self.low_water = low_water
+        self.expected_payment_pmob = expected_payment_pmob
+        self.count = count
+        self.confirm_timeout = confirm_timeout
+        self.poll_interval = poll_interval
+        self._log = log
+        self._closed = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def targets(self, drop: Drop) -> Targets:
+        """
+        How many txos of each value the pool should hold for the drop. Each value covers one payout and its fee,
+        as TxoPool.reserve asks for: the initial coin, or a bonus coin plus the customer's payment and the fee we
+        cover when returning it. Each size is for the payouts the drop has left, or at most `count`.
+        """
+        payouts = [(f"initial {mc.pmob2mob(drop.initial_coin_amount_pmob).normalize()} MOB",
+                    drop.initial_coin_amount_pmob + self.fee_pmob,
+                    drop.initial_coin_limit - drop.initial_coins_claimed)]
+
+        for bonus_coin in BonusCoin.objects.filter(drop=drop):
+            payouts.append((f"bonus {mc.pmob2mob(bonus_coin.amount_pmob).normalize()} MOB",
+                            bonus_coin.amount_pmob + self.expected_payment_pmob + 2 * self.fee_pmob,
+                            bonus_coin.number_available - bonus_coin.number_claimed))
+
+        targets = {}
+        for label, value, remaining in payouts:
+            remaining = max(0, remaining if self.count is None else min(self.count, remaining))
+            if value in targets:
+                label = f"{targets[value][0]}, {label}"
+                remaining += targets[value][1]
+            targets[value] = (label, remaining)
+        return targets
+
+    def refill(self, targets: Targets) -> int:
+        "Split txos for every size that has run low, and return how many were split out and landed."
+        levels = self.pool.levels(targets)
+        outputs = []
+        for value, (label, target) in targets.items():
+            if levels[value] < target * self.low_water:
+                outputs.extend([value] * (target - levels[value]))
+        if not outputs:
+            return 0
+
+        self._log(f"Splitting {mc.pmob2mob(sum(outputs)).normalize()} MOB into {len(outputs)} txos")
+        for i in range(0, len(outputs), MAX_OUTLAYS):
+            chunk = outputs[i:i + MAX_OUTLAYS]
+            # Don't break up txos that are already the right size.
+            input_txo_ids = self.pool.reserve(sum(chunk), exclude_values=targets)
+            if input_txo_ids is None:
+                self._log(f"Not enough MOB left to split out {len(outputs) - i} more txos")
+                return i
+
+            try:
+                tx_proposal = build_transaction(self._mcc, self.account_id,
+                                                [(self.public_address, value) for value in chunk], input_txo_ids)
+                transaction_log = self._mcc.submit_transaction(tx_proposal, self.account_id)
+            except Exception:
+                self.pool.release(input_txo_ids)
+                raise
+
+            status = self.wait(transaction_log['transaction_log_id'])
+            if status != TRANSACTION_SUCCESS:
+                self._log(f"Split transaction {transaction_log['transaction_log_id']} did not land: {status}")
+                # One that is still pending may land yet, so its inputs stay reserved until a refresh sees them
+                # spent.
+                if status != TRANSACTION_PENDING:
+                    self.pool.release(input_txo_ids)
+                return i
+            self.pool.refresh()
+        return len(outputs)
+
+    def wait(self, transaction_log_id: str) -> str:
+        "Wait for a transaction we submitted to land or fail. Returns TRANSACTION_PENDING if it's still going."
+        deadline = time.monotonic() + self.confirm_timeout
+        while True:
+            try:
+                status, _transaction_log = check_transaction_log(self._mcc, transaction_log_id)
+            except Exception as e:  # noqa - Keep trying until the deadline.
+                print(f"Could not check transaction {transaction_log_id}: {e}")
+                status = TRANSACTION_PENDING
+            if status != TRANSACTION_PENDING or time.monotonic() >= deadline:
+                return status
+            if self._closed.wait(self.poll_interval):
+                return status
+
+    def start(self, get_drop: Callable[[], Optional[Drop]], interval: float):
+        "Refill for the drop get_drop() returns every `interval` seconds, from a background thread."
+        def run():
+            while not self._closed.wait(interval):
+                try:
+                    drop = get_drop()
+                    if drop is not None:
+                        self.pool.refresh()
+                        self.refill(self.targets(drop))
+                except Exception as e:  # noqa - Try again next time.
+                    print(f"Could not refill the txo pool: {e}")
+                finally:
+                    close_old_connections()
+
+        self._thread = threading.Thread(target=run, name="pool-refill", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        "Stop the thread from start(), leaving a split in flight to land on its own."
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,106 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import random
+from typing import Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F
+
+from mobot_client.models import BonusCoin, Drop, DropSession
+
+# Matches SESSION_STATE_READY_TO_RECEIVE_INITIAL in run_mobot_client: sessions past it have had their initial coin.
+SESSION_STATE_READY_TO_RECEIVE_INITIAL = 0
+
+
+def claim_initial_coin(drop: Drop) -> bool:
+    "Take one of the drop's initial coins, or return False if they have all been claimed."
+    return Drop.objects.filter(pk=drop.pk, initial_coins_claimed__lt=F('initial_coin_limit')) \
+        .update(initial_coins_claimed=F('initial_coins_claimed') + 1) == 1
+
+
+def has_initial_coins_left(drop: Drop) -> bool:
+    "Whether any of the drop's initial coins are unclaimed, read from the database rather than from `drop`."
+    return Drop.objects.filter(pk=drop.pk, initial_coins_claimed__lt=F('initial_coin_limit')).exists()
+
+
+def release_initial_coin(drop: Drop):
+    "Give back an initial coin that was claimed but won't be sent."
+    Drop.objects.filter(pk=drop.pk, initial_coins_claimed__gt=0) \
+        .update(initial_coins_claimed=F('initial_coins_claimed') - 1)
+
+
+def claim_bonus_coin(bonus_coin: BonusCoin) -> bool:
+    "Take one of a bonus coin's slots, or return False if they have all been claimed."
+    return BonusCoin.objects.filter(pk=bonus_coin.pk, number_claimed__lt=F('number_available')) \
+        .update(number_claimed=F('number_claimed') + 1) == 1
+
+
+def pick_bonus_coin(drop: Drop) -> Optional[BonusCoin]:
+    """
+    Pick one of the drop's bonus coins at random, weighted by how many of each are left, or None if there are
+    none left. This is a single query for the remaining count of each tier, so it costs the same however many
+    coins there are.
+    """
+    tiers = list(BonusCoin.objects.filter(drop=drop, number_claimed__lt=F('number_available'))
+                 .annotate(remaining=F('number_available') - F('number_claimed')).order_by('pk'))
+    total = sum(bonus_coin.remaining for bonus_coin in tiers)
+    if total <= 0:
+        return None
+
+    n = random.randrange(total)
+    for bonus_coin in tiers:
+        if n < bonus_coin.remaining:
+            return bonus_coin
+        n -= bonus_coin.remaining
+
+
+def claim_random_bonus_coin(drop: Drop) -> Optional[BonusCoin]:
+    "Pick a bonus coin with pick_bonus_coin and claim it, picking again if its last one was taken in the meantime."
+    while True:
+        bonus_coin = pick_bonus_coin(drop)
+        if bonus_coin is None or claim_bonus_coin(bonus_coin):
+            return bonus_coin
+
+
+def release_bonus_coin(bonus_coin: BonusCoin):
+    "Give back a bonus coin slot that was claimed but won't be sent."
+    BonusCoin.objects.filter(pk=bonus_coin.pk, number_claimed__gt=0) \
+        .update(number_claimed=F('number_claimed') - 1)
+
+
+def count_initial_coins_claimed(drop: Drop) -> int:
+    return DropSession.objects.filter(drop=drop, state__gt=SESSION_STATE_READY_TO_RECEIVE_INITIAL).count()
+
+
+def count_bonus_coins_claimed(bonus_coin: BonusCoin) -> int:
+    return DropSession.objects.filter(bonus_coin_claimed=bonus_coin).count()
+
+
+def reconcile_counters(drops: Optional[Iterable[Drop]] = None, fix: bool = True) -> List[Tuple[object, str, int, int]]:
+    """
+    Recount the claims on each drop and its bonus coins from their sessions, and return (object, counter,
+    stored, counted) for every counter that was off. With `fix`, the counters are set to what was counted.
+
+    Each drop is locked while it is recounted, and claims are made in the same transaction as the session
+    change they're for, so the counts never see a claim without its session or the other way around.
+    """
+    if drops is None:
+        drops = Drop.objects.all()
+
+    mismatches = []
+    for drop in drops:
+        with transaction.atomic():
+            drop = Drop.objects.select_for_update().get(pk=drop.pk)
+            counted = count_initial_coins_claimed(drop)
+            if counted != drop.initial_coins_claimed:
+                mismatches.append((drop, 'initial_coins_claimed', drop.initial_coins_claimed, counted))
+                if fix:
+                    Drop.objects.filter(pk=drop.pk).update(initial_coins_claimed=counted)
+
+            for bonus_coin in BonusCoin.objects.select_for_update().filter(drop=drop):
+                counted = count_bonus_coins_claimed(bonus_coin)
+                if counted != bonus_coin.number_claimed:
+                    mismatches.append((bonus_coin, 'number_claimed', bonus_coin.number_claimed, counted))
+                    if fix:
+                        BonusCoin.objects.filter(pk=bonus_coin.pk).update(number_claimed=counted)
+    return mismatches
@@ -0,0 +1,227 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mobot_client.cache_generation import CacheGeneration
+from mobot_client.models import Customer, Drop, DropSession
+
+# Match the session states in run_mobot_client: sessions in between are still open.
+SESSION_STATE_READY_TO_RECEIVE_INITIAL = 0
+SESSION_STATE_COMPLETED = 3
+
+# The open session hasn't been looked up yet.
+_UNKNOWN = object()
+
+
+class _Entry:
+    __slots__ = ("customer", "session", "loaded")
+
+    def __init__(self, customer: Customer, session=_UNKNOWN):
+        self.customer = customer
+        self.session = session
+        self.loaded = time.monotonic()
+
+
+def sessions_with_related():
+    "DropSessions along with their customer, drop, item and store, so reading any of those costs no query."
+    return DropSession.objects.select_related('customer', 'drop', 'drop__item', 'drop__store')
+
+
+def is_open(session: DropSession) -> bool:
+    return SESSION_STATE_READY_TO_RECEIVE_INITIAL <= session.state < SESSION_STATE_COMPLETED
+
+
+class SessionCache:
+    """
+    The customer behind each phone number and their open drop session, if they have one, for the `max_size`
+    most recently seen numbers.
+
+    Only one process can keep it: the one that handles every message for the bot's number and makes every
+    change to its sessions, which sets `owner`. There, saving a Customer or DropSession writes through to the
+    cache once the transaction commits, and the entry is dropped in the meantime so a rollback can't leave it
+    wrong. Anywhere else, such as the admin site, a save or delete bumps `generation` instead, and the owner
+    empties its cache the next time it sees the counter move.
+
+    That only reaches the owner through a cache the processes share, such as the DatabaseCache. With the dummy
+    cache, or a local-memory one in each process, changes made elsewhere are never seen, so an entry is also
+    loaded again once it is `max_age` seconds old. That bounds how stale it can be.
+    """
+
+    def __init__(self, max_size: int = 10000, generation: Optional[CacheGeneration] = None,
+                 max_age: float = 300.0):
+        self.max_size = max_size
+        self.generation = generation
+        self.max_age = max_age
+        self.owner = False
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # type: OrderedDict[str, _Entry]
+        # customer pk -> phone number, for the customers in _entries
+        self._phone_numbers = {}  # type: Dict[int, str]
+        self._hits = 0
+        self._misses = 0
+
+    def get_customer(self, phone_number: str) -> Customer:
+        "The customer with this number, created if they're new."
+        self._check_generation()
+        with self._lock:
+            entry = self._get(phone_number)
+            if entry is not None:
+                self._entries.move_to_end(phone_number)
+                self._hits += 1
+                return entry.customer
+            self._misses += 1
+
+        customer, _created = Customer.objects.get_or_create(phone_number=phone_number)
+        with self._lock:
+            if phone_number not in self._entries:
+                self._put(phone_number, _Entry(customer))
+        return customer
+
+    def get_open_session(self, customer: Customer) -> Optional[DropSession]:
+        "The customer's drop session that isn't completed or cancelled, if they have one."
+        self._check_generation()
+        with self._lock:
+            entry = self._get(customer.phone_number)
+            if entry is not None and entry.session is not _UNKNOWN:
+                self._entries.move_to_end(customer.phone_number)
+                self._hits += 1
+                return entry.session
+            self._misses += 1
+
+        session = sessions_with_related().filter(customer=customer, state__gte=SESSION_STATE_READY_TO_RECEIVE_INITIAL,
+                                                 state__lt=SESSION_STATE_COMPLETED).first()
+        with self._lock:
+            entry = self._entries.get(customer.phone_number)
+            if entry is None:
+                self._put(customer.phone_number, _Entry(customer, session))
+            elif entry.session is _UNKNOWN:
+                entry.session = session
+        return session
+
+    def customer_saved(self, customer: Customer):
+        with self._lock:
+            phone_number = self._phone_numbers.get(customer.pk)
+            if phone_number is not None:
+                self._remove(phone_number)
+
+        def write_through():
+            with self._lock:
+                if customer.phone_number not in self._entries:
+                    self._put(customer.phone_number, _Entry(customer))
+
+        transaction.on_commit(write_through)
+
+    def session_saved(self, session: DropSession):
+        with self._lock:
+            phone_number = self._phone_numbers.get(session.customer_id)
+            if phone_number is None:
+                return
+            entry = self._entries[phone_number]
+            previous, entry.session = entry.session, _UNKNOWN
+
+        def write_through():
+            with self._lock:
+                entry = self._entries.get(phone_number)
+                if entry is None or entry.session is not _UNKNOWN:
+                    return
+                if is_open(session):
+                    entry.session = session
+                elif previous is None or (previous is not _UNKNOWN and previous.pk == session.pk):
+                    # That was the open session, if they had one, and it's over now.
+                    entry.session = None
+
+        transaction.on_commit(write_through)
+
+    def forget(self, customer_id: int):
+        with self._lock:
+            phone_number = self._phone_numbers.get(customer_id)
+            if phone_number is not None:
+                self._remove(phone_number)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._phone_numbers.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+    def _check_generation(self):
+        if self.generation is not None and self.generation.changed():
+            self.clear()
+
+    def _get(self, phone_number: str) -> Optional[_Entry]:
+        "The entry for a number, unless it's too old to trust. Call with the lock held."
+        entry = self._entries.get(phone_number)
+        if entry is not None and time.monotonic() - entry.loaded > self.max_age:
+            self._remove(phone_number)
+            return None
+        return entry
+
+    def _put(self, phone_number: str, entry: _Entry):
+        self._entries[phone_number] = entry
+        self._phone_numbers[entry.customer.pk] = phone_number
+        while len(self._entries) > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._phone_numbers.pop(evicted.customer.pk, None)
+
+    def _remove(self, phone_number: str):
+        entry = self._entries.pop(phone_number, None)
+        if entry is not None:
+            self._phone_numbers.pop(entry.customer.pk, None)
+
+    def report(self, interval: float):
+        "Print the hit rate every `interval` seconds, from a background thread."
+        def run():
+            while True:
+                time.sleep(interval)
+                print("session cache: size={size} hits={hits} misses={misses}".format(**self.stats()))
+
+        threading.Thread(target=run, name="session-cache-report", daemon=True).start()
+
+
+sessions_generation = CacheGeneration('mobot_client:sessions:generation')
+session_cache = SessionCache(generation=sessions_generation)
+
+
+@receiver(post_save, sender=Customer)
+def _customer_saved(sender, instance, **kwargs):
+    if session_cache.owner:
+        session_cache.customer_saved(instance)
+    else:
+        sessions_generation.bump()
+
+
+@receiver(post_save, sender=DropSession)
+def _session_saved(sender, instance, **kwargs):
+    if session_cache.owner:
+        session_cache.session_saved(instance)
+    else:
+        sessions_generation.bump()
+
+
+@receiver(post_save, sender=Drop)
+@receiver(post_delete, sender=Drop)
+def _drop_changed(sender, **kwargs):
+    # Open sessions are cached with their drop.
+    if session_cache.owner:
+        session_cache.clear()
+    else:
+        sessions_generation.bump()
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=DropSession)
+def _deleted(sender, instance, **kwargs):
+    if session_cache.owner:
+        session_cache.forget(instance.pk if sender is Customer else instance.customer_id)
+    else:
+        sessions_generation.bump()
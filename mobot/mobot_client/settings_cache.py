@@ -0,0 +1,68 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+from typing import Callable, List, Optional, Sequence, Type
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mobot_client.cache_generation import CacheGeneration
+from mobot_client.models import ChatbotSettings, SingletonModel, Store
+
+
+class SingletonCache:
+    """
+    Keeps a SingletonModel row in memory, along with the rows in `select_related`, so reading it is free.
+
+    The row is loaded as SingletonModel.load() would, the first time it is asked for and again after
+    invalidate(). Saves in this process invalidate it through post_save. Saves in other processes bump
+    `generation`, which get() checks now and then. Listeners are called with the row each time it is reloaded.
+    """
+
+    def __init__(self, model: Type[SingletonModel], select_related: Sequence[str] = (),
+                 generation: Optional[CacheGeneration] = None):
+        self.model = model
+        self.select_related = tuple(select_related)
+        self.generation = generation
+        self._lock = threading.Lock()
+        self._obj = None  # type: Optional[SingletonModel]
+        self._listeners = []  # type: List[Callable[[SingletonModel], None]]
+
+    def get(self) -> SingletonModel:
+        with self._lock:
+            stale = self._obj is None
+        if self.generation is not None and self.generation.changed():
+            stale = True
+        if not stale:
+            return self._obj
+
+        obj, _created = self.model.objects.select_related(*self.select_related).get_or_create(pk=1)
+        with self._lock:
+            self._obj = obj
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(obj)
+            except Exception as e:
+                print(f"{self.model.__name__} listener failed: {e}")
+        return obj
+
+    def invalidate(self):
+        with self._lock:
+            self._obj = None
+
+    def add_listener(self, listener: Callable[[SingletonModel], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+
+settings_generation = CacheGeneration('mobot_client:settings:generation')
+chatbot_settings = SingletonCache(ChatbotSettings, select_related=('store',), generation=settings_generation)
+
+
+@receiver(post_save, sender=ChatbotSettings)
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def _settings_changed(sender, **kwargs):
+    chatbot_settings.invalidate()
+    settings_generation.bump()
@@ -0,0 +1,93 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mobot_client.confirmations import (TRANSACTION_CHECK_FAILED, TRANSACTION_PENDING, TRANSACTION_SUCCESS,
+                                        TRANSACTION_TIMED_OUT, ReceiptConfirmations)
+
+
+class ReceiptConfirmationsTests(unittest.TestCase):
+
+    def confirmations(self, check, **kwargs):
+        confirmations = ReceiptConfirmations(check, tick=0.01, interval=0.01, max_interval=0.02, **kwargs)
+        self.addCleanup(confirmations.close)
+        return confirmations
+
+    def wait_for(self, confirmations, *subject):
+        done = threading.Event()
+        results = []
+
+        def on_done(status, details):
+            results.append((status, details))
+            done.set()
+
+        confirmations.watch(subject, on_done)
+        self.assertTrue(done.wait(5), "on_done was never called")
+        return results[0]
+
+    def test_checks_again_until_the_transaction_lands(self):
+        statuses = [TRANSACTION_PENDING, TRANSACTION_PENDING, TRANSACTION_SUCCESS]
+        calls = []
+
+        def check(address, receipt):
+            calls.append((address, receipt))
+            return statuses[len(calls) - 1], {"calls": len(calls)}
+
+        confirmations = self.confirmations(check)
+
+        self.assertEqual(self.wait_for(confirmations, "our address", "receipt"), (TRANSACTION_SUCCESS, {"calls": 3}))
+        self.assertEqual(calls, [("our address", "receipt")] * 3)
+        self.assertEqual(confirmations.stats()["confirmed"], 1)
+
+    def test_a_failing_check_is_tried_again(self):
+        errors = [ConnectionError("full-service is down")] * 2
+
+        def check(receipt):
+            if errors:
+                raise errors.pop()
+            return TRANSACTION_SUCCESS, {}
+
+        confirmations = self.confirmations(check, timeout=60)
+
+        self.assertEqual(self.wait_for(confirmations, "receipt"), (TRANSACTION_SUCCESS, {}))
+        self.assertEqual(errors, [])
+
+    def test_a_check_still_failing_at_the_timeout_is_reported_as_a_failure(self):
+        calls = []
+
+        def check(receipt):
+            calls.append(receipt)
+            raise ValueError("Could not decode the amount")
+
+        confirmations = self.confirmations(check, timeout=0.1)
+
+        self.assertEqual(self.wait_for(confirmations, "receipt"), (TRANSACTION_CHECK_FAILED, None))
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(confirmations.stats()["failed"], 1)
+
+    def test_gives_up_after_the_timeout(self):
+        confirmations = self.confirmations(lambda receipt: (TRANSACTION_PENDING, None), timeout=0.1)
+
+        self.assertEqual(self.wait_for(confirmations, "receipt"), (TRANSACTION_TIMED_OUT, None))
+        self.assertEqual(confirmations.stats()["timed_out"], 1)
+
+    def test_closes_while_checks_are_still_being_made(self):
+        checking = threading.Event()
+
+        def check(receipt):
+            checking.set()
+            return TRANSACTION_PENDING, None
+
+        errors = []
+        with mock.patch.object(threading, "excepthook", lambda args: errors.append(args.exc_value)):
+            confirmations = ReceiptConfirmations(check, tick=0, interval=0, max_interval=0)
+            for n in range(100):
+                confirmations.watch((f"receipt {n}",), lambda status, details: None)
+            self.assertTrue(checking.wait(5))
+
+            confirmations.close()
+            time.sleep(0.1)
+        self.assertEqual(errors, [])
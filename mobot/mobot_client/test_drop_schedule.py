@@ -0,0 +1,78 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mobot_client.drop_schedule import DropSchedule, drop_schedule
+from mobot_client.models import Drop, Item, Store
+
+
+class DropScheduleTests(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(name="MOBot", phone_number="+447000000000", description="",
+                                          privacy_policy_url="https://example.com/privacy")
+        self.item = Item.objects.create(store=self.store, name="Hoodie")
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+    def make_drop(self, advertise_at, start_at, end_at) -> Drop:
+        return Drop.objects.create(store=self.store, item=self.item, pre_drop_description="",
+                                   number_restriction="+44", timezone="Europe/London",
+                                   advertisment_start_time=advertise_at, start_time=start_at, end_time=end_at)
+
+    def at(self, now):
+        "Make it `now`, as far as the schedule can tell."
+        patcher = mock.patch("mobot_client.drop_schedule.timezone")
+        patcher.start().now.return_value = now
+        self.addCleanup(patcher.stop)
+
+    def test_moves_on_at_each_boundary_without_asking_in_between(self):
+        drop = self.make_drop(self.start - timedelta(hours=1), self.start, self.start + timedelta(hours=1))
+        schedule = DropSchedule(max_age=None)
+        self.at(self.start - timedelta(hours=2))
+        self.assertEqual((schedule.advertising_drop(), schedule.active_drop()), (None, None))
+
+        for now, advertising, active in ((drop.advertisment_start_time, drop, None),
+                                         (drop.start_time, None, drop),
+                                         (drop.end_time + timedelta(microseconds=1), None, None)):
+            self.at(now)
+            with self.assertNumQueries(1):
+                self.assertEqual((schedule.advertising_drop(), schedule.active_drop()), (advertising, active), now)
+            if active is not None:
+                # Nothing else changes before the drop's end_time.
+                self.at(drop.end_time)
+                with self.assertNumQueries(0):
+                    self.assertEqual(schedule.active_drop(), drop)
+
+    def test_reloads_after_max_age(self):
+        drop = self.make_drop(self.start - timedelta(hours=1), self.start, self.start + timedelta(hours=1))
+        schedule = DropSchedule(max_age=60)
+        self.at(self.start)
+        self.assertEqual(schedule.active_drop(), drop)
+
+        # An edit in another process, which this one gets no signal for.
+        Drop.objects.filter(pk=drop.pk).update(start_time=self.start + timedelta(minutes=30))
+        with self.assertNumQueries(0):
+            self.assertEqual(schedule.active_drop(), drop)
+
+        schedule._loaded_at -= 61
+        self.assertIsNone(schedule.active_drop())
+        self.assertEqual(schedule.advertising_drop(), drop)
+
+    def test_saving_or_deleting_a_drop_reloads_the_schedule(self):
+        drop_schedule.invalidate()
+        now = timezone.now()
+        drop = self.make_drop(now - timedelta(hours=1), now + timedelta(hours=1), now + timedelta(hours=2))
+        self.assertEqual(drop_schedule.advertising_drop(), drop)
+
+        drop.start_time = now - timedelta(minutes=1)
+        drop.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(drop_schedule.active_drop(), drop)
+        self.assertIsNone(drop_schedule.advertising_drop())
+
+        drop.delete()
+        self.assertIsNone(drop_schedule.active_drop())
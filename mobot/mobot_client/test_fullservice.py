@@ -0,0 +1,84 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import http.client
+import json
+import unittest
+from unittest import mock
+
+from mobot_client.fullservice import PooledClient
+
+
+class FakeResponse:
+    will_close = False
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def read(self) -> bytes:
+        return self.body
+
+
+class FakeConnection:
+    "An HTTP connection to full-service. A stale one fails sending, or reading the reply, as the server hangs up."
+
+    def __init__(self, fail_sending=False, fail_reading=False):
+        self.fail_sending = fail_sending
+        self.fail_reading = fail_reading
+        self.sent = []
+
+    def request(self, method, path, body, headers):
+        if self.fail_sending:
+            raise BrokenPipeError("the server closed the connection")
+        self.sent.append(json.loads(body)["method"])
+
+    def getresponse(self):
+        if self.fail_reading:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        return FakeResponse(json.dumps({"result": {"ok": True}}).encode())
+
+    def close(self):
+        pass
+
+
+class PooledClientTests(unittest.TestCase):
+
+    def client(self, stale: FakeConnection) -> PooledClient:
+        "A client whose only idle connection is `stale`, and which connects afresh to self.fresh."
+        client = PooledClient(url="http://full-service:9090/wallet", pool_size=1)
+        client._idle.put(stale)
+        self.fresh = FakeConnection()
+        client._connect = mock.Mock(return_value=self.fresh)
+        return client
+
+    def test_a_request_the_stale_connection_lost_the_reply_to_is_sent_again(self):
+        stale = FakeConnection(fail_reading=True)
+        client = self.client(stale)
+
+        self.assertEqual(client._req({"method": "get_account"}), {"ok": True})
+        self.assertEqual((stale.sent, self.fresh.sent), (["get_account"], ["get_account"]))
+
+    def test_a_submission_that_may_have_been_read_is_not_sent_again(self):
+        for method in ("submit_transaction", "build_and_submit_transaction"):
+            stale = FakeConnection(fail_reading=True)
+            client = self.client(stale)
+
+            with self.assertRaises(ConnectionError):
+                client._req({"method": method})
+            self.assertEqual((stale.sent, self.fresh.sent), ([method], []))
+            self.assertEqual(client.stats()[method]["errors"], 1)
+
+    def test_a_submission_that_could_not_be_sent_is_sent_again(self):
+        stale = FakeConnection(fail_sending=True)
+        client = self.client(stale)
+
+        self.assertEqual(client._req({"method": "submit_transaction"}), {"ok": True})
+        self.assertEqual(self.fresh.sent, ["submit_transaction"])
+
+    def test_a_new_connection_is_not_retried(self):
+        client = PooledClient(url="http://full-service:9090/wallet", pool_size=1)
+        fresh = FakeConnection(fail_reading=True)
+        client._connect = mock.Mock(return_value=fresh)
+
+        with self.assertRaises(ConnectionError):
+            client._req({"method": "get_account"})
+        self.assertEqual(client._connect.call_count, 1)
@@ -0,0 +1,60 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import unittest
+
+from mobot_client.ledger import WalletLedger
+
+FEE_PMOB = 400
+
+
+class WalletLedgerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.balance = 10 ** 6
+        self.while_fetching = None
+        self.ledger = WalletLedger(self.fetch_balance, FEE_PMOB, reconcile_interval=0)
+
+    def fetch_balance(self) -> int:
+        balance = self.balance
+        if self.while_fetching is not None:
+            self.while_fetching()
+        return balance
+
+    def test_reserve_refuses_what_is_already_promised(self):
+        self.assertTrue(self.ledger.reserve("first", 6 * 10 ** 5))
+        self.assertFalse(self.ledger.reserve("second", 6 * 10 ** 5))
+        self.assertTrue(self.ledger.reserve("first", 6 * 10 ** 5))
+        self.assertEqual(self.ledger.available(), 4 * 10 ** 5 - FEE_PMOB)
+
+        self.ledger.release("first")
+        self.assertTrue(self.ledger.reserve("second", 6 * 10 ** 5))
+
+    def test_a_committed_payout_is_taken_off_the_balance_once(self):
+        self.ledger.reserve("payout", 1000)
+        self.ledger.commit("payout")
+        self.assertEqual(self.ledger.stats(), {"balance": 10 ** 6 - 1000 - FEE_PMOB, "reserved": 0,
+                                               "available": 10 ** 6 - 1000 - FEE_PMOB, "payouts": 0})
+
+        # full-service now has it off the balance too.
+        self.balance -= 1000 + FEE_PMOB
+        self.ledger.reconcile()
+        self.assertEqual(self.ledger.available(), 10 ** 6 - 1000 - FEE_PMOB)
+        self.ledger.reconcile()
+        self.assertEqual(self.ledger.available(), 10 ** 6 - 1000 - FEE_PMOB)
+
+    def test_a_payout_that_lands_while_fetching_is_taken_off_the_older_balance(self):
+        self.ledger.reserve("payout", 1000)
+        self.while_fetching = lambda: self.ledger.commit("payout")
+        self.ledger.reconcile()
+        self.assertEqual(self.ledger.available(), 10 ** 6 - 1000 - FEE_PMOB)
+
+        self.while_fetching = None
+        self.balance -= 1000 + FEE_PMOB
+        self.ledger.reconcile()
+        self.assertEqual(self.ledger.available(), 10 ** 6 - 1000 - FEE_PMOB)
+
+    def test_committing_a_released_payout_changes_nothing(self):
+        self.ledger.reserve("payout", 1000)
+        self.ledger.release("payout")
+        self.ledger.commit("payout")
+        self.assertEqual(self.ledger.available(), 10 ** 6)
@@ -0,0 +1,51 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+
+from mobot_client.message_log import MessageLog
+from mobot_client.models import Customer, Message, Store
+
+
+class MessageLogTests(TestCase):
+    "Flushes by hand: the writer thread is left waiting on a batch size and interval the tests never reach."
+
+    def setUp(self):
+        self.customer = Customer.objects.create(phone_number="+447111111111")
+        self.store = Store.objects.create(name="MOBot", phone_number="+447000000000", description="",
+                                          privacy_policy_url="https://example.com/privacy")
+        self.message_log = MessageLog(flush_size=1000, flush_interval=3600)
+        self.addCleanup(self.message_log.close)
+
+    def test_writes_the_batch(self):
+        self.message_log.log(self.customer, self.store, "hi", 0)
+        self.message_log.log(self.customer, self.store, "hello", 1)
+
+        self.assertTrue(self.message_log.flush())
+        self.assertEqual(list(Message.objects.order_by("pk").values_list("text", flat=True)), ["hi", "hello"])
+        self.assertEqual(self.message_log.stats()["written"], 2)
+
+    def test_a_message_the_database_rejects_is_dropped_and_the_rest_are_written(self):
+        self.message_log.log(self.customer, self.store, "hi", 0)
+        self.message_log.log(self.customer, self.store, None, 0)
+        self.message_log.log(self.customer, self.store, "hello", 1)
+
+        self.assertTrue(self.message_log.flush())
+        self.assertEqual(list(Message.objects.order_by("pk").values_list("text", flat=True)), ["hi", "hello"])
+        stats = self.message_log.stats()
+        self.assertEqual((stats["written"], stats["dropped"], stats["backlog"]), (2, 1, 0))
+
+    def test_everything_is_kept_while_the_database_is_down(self):
+        self.message_log.log(self.customer, self.store, "hi", 0)
+        self.message_log.log(self.customer, self.store, "hello", 1)
+
+        with mock.patch.object(Message, "save", side_effect=OperationalError("database is down")), \
+                mock.patch.object(Message.objects, "bulk_create", side_effect=OperationalError("database is down")):
+            self.assertFalse(self.message_log.flush())
+        stats = self.message_log.stats()
+        self.assertEqual((stats["written"], stats["dropped"], stats["backlog"]), (0, 0, 2))
+
+        self.assertTrue(self.message_log.flush())
+        self.assertEqual(Message.objects.count(), 2)
@@ -0,0 +1,217 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from mobot_client.confirmations import (TRANSACTION_CHECK_FAILED, TRANSACTION_FAILURE, TRANSACTION_PENDING,
+                                        TRANSACTION_SUCCESS, TRANSACTION_TIMED_OUT)
+from mobot_client.ledger import WalletLedger
+from mobot_client.models import Customer, PayoutJob
+from mobot_client.payouts import (PAYOUT_STATE_COMPLETED, PAYOUT_STATE_FAILED, PAYOUT_STATE_SUBMITTED,
+                                  PAYOUT_STATE_UNCERTAIN, PayoutQueue, check_transaction_log)
+from mobot_client.txo_pool import TxoPool
+
+ACCOUNT_ID = "account"
+FEE_PMOB = 400
+
+
+class FakeFullService:
+    "Just enough of full-service for PayoutQueue, paying every transaction in one go."
+
+    def __init__(self, txos=None):
+        self.txos = dict(txos or {"txo-1": 10 ** 6})
+        self.spent = set()
+        self.built = []
+        self.submitted = []
+        self.submit_errors = []
+
+    def _req(self, request_data):
+        assert request_data["method"] == "build_transaction", request_data
+        params = request_data["params"]
+        self.built.append(params)
+        return {"tx_proposal": {"outlays": params["addresses_and_values"], "inputs": params.get("input_txo_ids")}}
+
+    def create_receiver_receipts(self, tx_proposal):
+        return [{"public_key": f"receipt for {address}"} for address, value in tx_proposal["outlays"]]
+
+    def submit_transaction(self, tx_proposal, account_id):
+        if self.submit_errors:
+            raise self.submit_errors.pop(0)
+        self.submitted.append(tx_proposal)
+        return {"transaction_log_id": f"log-{len(self.submitted)}"}
+
+    def get_all_txos_for_account(self, account_id):
+        return {txo_id: {"value_pmob": str(value), "account_status_map": {account_id: {
+                    "txo_status": "txo_status_spent" if txo_id in self.spent else "txo_status_unspent"}}}
+                for txo_id, value in self.txos.items()}
+
+
+class PayoutQueueTests(TestCase):
+    """
+    Drives a PayoutQueue without worker threads: each test takes the queued work and advances it by hand, and
+    plays the part of the confirmations poller.
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(phone_number="+447111111111")
+        self.mcc = FakeFullService()
+        self.confirmations = mock.Mock()
+        self.send_receipt = mock.Mock()
+        self.notify_failed = mock.Mock()
+        self.ledger = WalletLedger(lambda: 10 ** 6, FEE_PMOB, reconcile_interval=None)
+        self.pool = TxoPool(self.mcc, ACCOUNT_ID, FEE_PMOB)
+        self.payouts = PayoutQueue(self.mcc, ACCOUNT_ID, self.confirmations, self.send_receipt, self.notify_failed,
+                                   workers=0, retry_delay=0, pool=self.pool, ledger=self.ledger, settle_interval=0)
+
+    def advance(self):
+        self.payouts._advance(self.payouts._queue.get(timeout=5))
+
+    def confirm(self, status, details=None):
+        (subject, on_done), _kwargs = self.confirmations.watch.call_args
+        on_done(status, details)
+        return subject
+
+    def test_follows_the_transaction_log_of_its_own_submission(self):
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+        self.advance()
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_SUBMITTED)
+        self.assertEqual(job.transaction_log_id, "log-1")
+        # The customer's address is never used to check the payout: full-service can't check receipts for it.
+        self.assertEqual(self.confirm(TRANSACTION_SUCCESS), ("log-1",))
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_COMPLETED)
+        self.send_receipt.assert_called_once_with(job, {"public_key": "receipt for customer address"})
+        self.notify_failed.assert_not_called()
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+        self.assertEqual(self.ledger.stats()["balance"], 10 ** 6 - 1000 - FEE_PMOB)
+
+    def test_queueing_a_key_again_holds_no_more_funds(self):
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+        self.advance()
+        self.confirm(TRANSACTION_SUCCESS)
+
+        self.assertEqual(self.payouts.enqueue("initial-1", self.customer, "customer address", 1000), job)
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+        self.assertTrue(self.payouts._queue.empty())
+
+    def test_a_payout_the_ledger_cannot_cover_is_not_queued(self):
+        self.assertIsNone(self.payouts.enqueue("initial-1", self.customer, "customer address", 10 ** 6))
+        self.assertFalse(PayoutJob.objects.exists())
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+
+    def test_a_failed_transaction_fails_the_payout(self):
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+        self.advance()
+        self.confirm(TRANSACTION_FAILURE)
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_FAILED)
+        self.notify_failed.assert_called_once_with(job)
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+        self.assertEqual(self.pool.levels([10 ** 6]), {10 ** 6: 1})
+
+    def test_an_unconfirmed_transaction_is_watched_again_with_its_funds_held(self):
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+        self.advance()
+
+        for status in (TRANSACTION_TIMED_OUT, TRANSACTION_CHECK_FAILED):
+            self.confirm(status)
+            job.refresh_from_db()
+            self.assertEqual(job.state, PAYOUT_STATE_SUBMITTED)
+            self.assertEqual(self.ledger.stats()["reserved"], 1000 + FEE_PMOB)
+            self.assertEqual(self.pool.levels([10 ** 6]), {10 ** 6: 0})
+        self.notify_failed.assert_not_called()
+        self.assertEqual(self.confirmations.watch.call_count, 3)
+
+        self.assertEqual(self.confirm(TRANSACTION_SUCCESS), ("log-1",))
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_COMPLETED)
+
+    def give_up_submitting(self) -> PayoutJob:
+        self.payouts.max_attempts = 2
+        self.mcc.submit_errors = [ConnectionError("full-service is down")] * 2
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+
+        self.advance()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (1, 1))
+
+        self.advance()
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_UNCERTAIN)
+        self.confirmations.watch.assert_not_called()
+        self.notify_failed.assert_not_called()
+        self.assertEqual(self.ledger.stats()["reserved"], 1000 + FEE_PMOB)
+        return job
+
+    def test_a_payout_given_up_on_has_landed_once_its_inputs_are_spent(self):
+        job = self.give_up_submitting()
+        self.advance()
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_UNCERTAIN)
+        self.assertEqual(self.pool.levels([10 ** 6]), {10 ** 6: 0})
+
+        self.mcc.spent.add("txo-1")
+        self.advance()
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_COMPLETED)
+        self.send_receipt.assert_called_once()
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+
+    def test_a_payout_given_up_on_fails_once_its_inputs_stay_unspent(self):
+        job = self.give_up_submitting()
+        self.payouts.uncertain_timeout = 0
+        self.advance()
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, PAYOUT_STATE_FAILED)
+        self.notify_failed.assert_called_once()
+        self.assertEqual(self.ledger.stats()["reserved"], 0)
+        self.assertEqual(self.pool.levels([10 ** 6]), {10 ** 6: 1})
+
+    def test_batch_is_watched_once_and_pays_everyone(self):
+        other = Customer.objects.create(phone_number="+447222222222")
+        jobs = [self.payouts.enqueue("bonus-1", self.customer, "address 1", 1000),
+                self.payouts.enqueue("bonus-2", other, "address 2", 2000)]
+        self.payouts._queue.get_nowait()
+        self.payouts._queue.get_nowait()
+        self.payouts._advance(tuple(job.pk for job in jobs))
+
+        self.assertEqual(len(self.mcc.built), 1)
+        self.confirmations.watch.assert_called_once()
+        self.confirm(TRANSACTION_SUCCESS)
+        self.assertEqual(PayoutJob.objects.filter(state=PAYOUT_STATE_COMPLETED).count(), 2)
+        self.assertEqual([call[0][1] for call in self.send_receipt.call_args_list],
+                         [{"public_key": "receipt for address 1"}, {"public_key": "receipt for address 2"}])
+
+    def test_resume_watches_submitted_jobs(self):
+        job = self.payouts.enqueue("initial-1", self.customer, "customer address", 1000)
+        self.advance()
+        self.confirmations.reset_mock()
+
+        restarted = PayoutQueue(self.mcc, ACCOUNT_ID, self.confirmations, self.send_receipt, self.notify_failed,
+                                workers=0)
+        restarted.resume()
+        restarted._advance(restarted._queue.get_nowait())
+
+        self.assertEqual(self.confirmations.watch.call_args[0][0], ("log-1",))
+        self.assertEqual(len(self.mcc.submitted), 1)
+        job.refresh_from_db()
+        self.assertEqual(json.loads(job.receiver_receipt), {"public_key": "receipt for customer address"})
+
+
+class CheckTransactionLogTests(TestCase):
+
+    def test_maps_transaction_log_statuses(self):
+        mcc = mock.Mock()
+        for status, expected in (("tx_status_pending", TRANSACTION_PENDING),
+                                 ("tx_status_succeeded", TRANSACTION_SUCCESS),
+                                 ("tx_status_failed", TRANSACTION_FAILURE)):
+            mcc._req.return_value = {"transaction_log": {"status": status}}
+            self.assertEqual(check_transaction_log(mcc, "log-1")[0], expected)
+        mcc._req.assert_called_with({"method": "get_transaction_log", "params": {"transaction_log_id": "log-1"}})
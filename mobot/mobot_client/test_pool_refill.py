@@ -0,0 +1,76 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import unittest
+
+from mobot_client.pool_refill import PoolRefiller
+from mobot_client.test_txo_pool import ACCOUNT_ID, FEE_PMOB, FakeFullService
+from mobot_client.txo_pool import TxoPool
+
+SIZE = 10 ** 6 + FEE_PMOB
+
+
+class SplittingFullService(FakeFullService):
+    "Splits txos as asked, landing each split once its transaction log has been checked `pending_checks` times."
+
+    def __init__(self, unspent, pending_checks=1, split_status="tx_status_succeeded"):
+        super().__init__(unspent)
+        self.pending_checks = pending_checks
+        self.split_status = split_status
+        self.built = []
+        self.checked = []
+
+    def _req(self, request_data):
+        method, params = request_data["method"], request_data["params"]
+        if method == "build_transaction":
+            self.built.append(params)
+            return {"tx_proposal": params}
+        assert method == "get_transaction_log", request_data
+        self.checked.append(params["transaction_log_id"])
+        if len(self.checked) <= self.pending_checks:
+            return {"transaction_log": {"status": "tx_status_pending"}}
+        if self.split_status == "tx_status_succeeded":
+            tx_proposal = self.built[-1]
+            for txo_id in tx_proposal["input_txo_ids"]:
+                self.spent[txo_id] = self.unspent.pop(txo_id)
+            for n, (_address, value) in enumerate(tx_proposal["addresses_and_values"]):
+                self.unspent[f"split-{len(self.built)}-{n}"] = int(value)
+        return {"transaction_log": {"status": self.split_status}}
+
+    def submit_transaction(self, tx_proposal, account_id):
+        return {"transaction_log_id": f"log-{len(self.built)}"}
+
+
+class PoolRefillerTests(unittest.TestCase):
+
+    def refiller(self, mcc) -> PoolRefiller:
+        self.pool = TxoPool(mcc, ACCOUNT_ID, FEE_PMOB)
+        self.pool.refresh()
+        return PoolRefiller(mcc, ACCOUNT_ID, "our address", self.pool, FEE_PMOB, poll_interval=0,
+                            log=lambda line: None)
+
+    def test_splits_only_free_txos_and_waits_on_its_own_transaction_log(self):
+        mcc = SplittingFullService({"big": 10 ** 8, "reserved by a payout": 10 ** 8, "sized": SIZE},
+                                   pending_checks=2)
+        refiller = self.refiller(mcc)
+        self.pool.reserve_ids(["reserved by a payout"])
+
+        self.assertEqual(refiller.refill({SIZE: ("initial 1 MOB", 4)}), 3)
+
+        self.assertEqual([params["input_txo_ids"] for params in mcc.built], [["big"]])
+        self.assertEqual(mcc.built[0]["addresses_and_values"], [("our address", str(SIZE))] * 3)
+        self.assertEqual(mcc.checked, ["log-1"] * 3)
+        self.assertEqual(self.pool.levels([SIZE]), {SIZE: 4})
+
+    def test_leaves_sizes_above_the_low_water_mark_alone(self):
+        mcc = SplittingFullService({"big": 10 ** 8, "a": SIZE, "b": SIZE})
+        self.assertEqual(self.refiller(mcc).refill({SIZE: ("initial 1 MOB", 4)}), 0)
+        self.assertEqual(mcc.built, [])
+
+    def test_stops_when_a_split_fails(self):
+        mcc = SplittingFullService({"big": 10 ** 9}, split_status="tx_status_failed")
+        refiller = self.refiller(mcc)
+
+        self.assertEqual(refiller.refill({SIZE: ("initial 1 MOB", 20)}), 0)
+        self.assertEqual(len(mcc.built), 1)
+        # Nothing was spent, so its inputs are free again.
+        self.assertIsNotNone(self.pool.reserve(10 ** 8))
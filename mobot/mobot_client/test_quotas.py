@@ -0,0 +1,93 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mobot_client import quotas
+from mobot_client.models import BonusCoin, Customer, Drop, DropSession, Item, Store
+from mobot_client.quotas import (claim_bonus_coin, claim_initial_coin, claim_random_bonus_coin, pick_bonus_coin,
+                                 reconcile_counters, release_bonus_coin, release_initial_coin)
+
+
+class QuotaTests(TestCase):
+
+    def setUp(self):
+        store = Store.objects.create(name="MOBot", phone_number="+447000000000", description="",
+                                     privacy_policy_url="https://example.com/privacy")
+        item = Item.objects.create(store=store, name="Hoodie")
+        now = timezone.now()
+        self.drop = Drop.objects.create(store=store, item=item, pre_drop_description="", number_restriction="+44",
+                                        timezone="Europe/London", advertisment_start_time=now, start_time=now,
+                                        end_time=now + timezone.timedelta(days=1), initial_coin_amount_pmob=10 ** 12,
+                                        initial_coin_limit=2)
+        self.bonus_coin = BonusCoin.objects.create(drop=self.drop, amount_pmob=2 * 10 ** 12, number_available=1)
+
+    def counters(self):
+        self.drop.refresh_from_db()
+        self.bonus_coin.refresh_from_db()
+        return self.drop.initial_coins_claimed, self.bonus_coin.number_claimed
+
+    def test_claims_stop_at_the_limit(self):
+        self.assertEqual([claim_initial_coin(self.drop) for _ in range(3)], [True, True, False])
+        self.assertEqual([claim_bonus_coin(self.bonus_coin) for _ in range(2)], [True, False])
+        self.assertEqual(self.counters(), (2, 1))
+
+    def test_release_gives_a_claim_back_and_never_goes_below_zero(self):
+        claim_initial_coin(self.drop)
+        claim_bonus_coin(self.bonus_coin)
+
+        for _ in range(2):
+            release_initial_coin(self.drop)
+            release_bonus_coin(self.bonus_coin)
+        self.assertEqual(self.counters(), (0, 0))
+        self.assertTrue(claim_bonus_coin(self.bonus_coin))
+
+    def test_reconcile_counters_fixes_a_counter_that_has_drifted(self):
+        customer = Customer.objects.create(phone_number="+447111111111")
+        DropSession.objects.create(customer=customer, drop=self.drop, state=2, bonus_coin_claimed=self.bonus_coin)
+        claim_initial_coin(self.drop)
+        claim_initial_coin(self.drop)
+
+        self.assertEqual(reconcile_counters(fix=False),
+                         [(self.drop, 'initial_coins_claimed', 2, 1), (self.bonus_coin, 'number_claimed', 0, 1)])
+        self.assertEqual(self.counters(), (2, 0))
+
+        reconcile_counters()
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertEqual(reconcile_counters(), [])
+
+    def test_an_exhausted_tier_is_never_picked(self):
+        exhausted = BonusCoin.objects.create(drop=self.drop, amount_pmob=10 ** 13, number_available=3,
+                                             number_claimed=3)
+        other = BonusCoin.objects.create(drop=self.drop, amount_pmob=10 ** 13, number_available=2)
+
+        picked = set()
+        for n in range(3):
+            with mock.patch.object(quotas.random, "randrange", return_value=n):
+                picked.add(pick_bonus_coin(self.drop))
+        self.assertEqual(picked, {self.bonus_coin, other})
+        self.assertNotIn(exhausted, picked)
+
+    def test_nothing_is_picked_once_every_tier_is_exhausted(self):
+        BonusCoin.objects.create(drop=self.drop, amount_pmob=10 ** 13, number_available=0)
+        self.assertEqual(claim_random_bonus_coin(self.drop), self.bonus_coin)
+
+        self.assertIsNone(pick_bonus_coin(self.drop))
+        self.assertIsNone(claim_random_bonus_coin(self.drop))
+
+    def test_a_claim_that_loses_the_race_picks_another_tier(self):
+        other = BonusCoin.objects.create(drop=self.drop, amount_pmob=10 ** 13, number_available=1)
+        claims = []
+
+        def claim_after_someone_else(bonus_coin):
+            if not claims:
+                claim_bonus_coin(bonus_coin)
+            claims.append(bonus_coin)
+            return claim_bonus_coin(bonus_coin)
+
+        with mock.patch.object(quotas, "claim_bonus_coin", claim_after_someone_else), \
+                mock.patch.object(quotas.random, "randrange", return_value=0):
+            self.assertEqual(claim_random_bonus_coin(self.drop), other)
+        self.assertEqual(claims, [self.bonus_coin, other])
@@ -0,0 +1,35 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from django.test import TestCase
+
+from mobot_client.models import Customer
+from mobot_client.session_cache import SessionCache
+
+CUSTOMER_NUMBER = "+447111111111"
+
+
+class SessionCacheTests(TestCase):
+    "A cache that isn't the owner and has no generation, as if changes made elsewhere never reached it."
+
+    def setUp(self):
+        self.cache = SessionCache(max_age=60)
+        self.customer = Customer.objects.create(phone_number=CUSTOMER_NUMBER, received_sticker_pack=False)
+
+    def test_serves_an_entry_until_it_is_too_old(self):
+        self.cache.get_customer(CUSTOMER_NUMBER)
+        Customer.objects.filter(pk=CUSTOMER_NUMBER).update(received_sticker_pack=True)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.cache.get_customer(CUSTOMER_NUMBER).received_sticker_pack)
+
+        self.cache._entries[CUSTOMER_NUMBER].loaded -= 61
+        self.assertTrue(self.cache.get_customer(CUSTOMER_NUMBER).received_sticker_pack)
+        self.assertEqual(self.cache.stats(), {"size": 1, "hits": 1, "misses": 2})
+
+    def test_an_old_entry_looks_up_the_open_session_again(self):
+        customer = self.cache.get_customer(CUSTOMER_NUMBER)
+        self.assertIsNone(self.cache.get_open_session(customer))
+        self.cache._entries[CUSTOMER_NUMBER].loaded -= 61
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.get_open_session(customer))
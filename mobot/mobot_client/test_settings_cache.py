@@ -0,0 +1,63 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from mobot_client.cache_generation import CacheGeneration
+from mobot_client.models import ChatbotSettings, Store
+from mobot_client.settings_cache import SingletonCache, chatbot_settings, settings_generation
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'mobot-settings-cache-tests'}}
+
+
+class SettingsCacheTests(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(name="MOBot", phone_number="+447000000000", description="",
+                                          privacy_policy_url="https://example.com/privacy")
+        ChatbotSettings.objects.create(pk=1, store=self.store, name="MOBot", avatar_filename="avatar.png")
+        chatbot_settings.invalidate()
+        self.addCleanup(chatbot_settings.invalidate)
+
+    def test_serves_the_row_until_it_is_saved(self):
+        self.assertEqual(chatbot_settings.get().name, "MOBot")
+        with self.assertNumQueries(0):
+            self.assertEqual(chatbot_settings.get().store.name, "MOBot")
+
+        settings = ChatbotSettings.load()
+        settings.name = "Drop bot"
+        settings.save()
+        self.assertEqual(chatbot_settings.get().name, "Drop bot")
+
+        self.store.name = "Hoodie shop"
+        self.store.save()
+        self.assertEqual(chatbot_settings.get().store.name, "Hoodie shop")
+
+    def test_listeners_hear_about_each_reload(self):
+        names = []
+        cache = SingletonCache(ChatbotSettings)
+        cache.add_listener(lambda settings: names.append(settings.name))
+        cache.get()
+        cache.get()
+        cache.invalidate()
+        cache.get()
+        self.assertEqual(names, ["MOBot", "MOBot"])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_a_save_in_another_process_clears_the_cache_here(self):
+        self.addCleanup(caches['default'].clear)
+        # Another process's cache, which only hears about saves made here through the generation.
+        elsewhere = SingletonCache(ChatbotSettings, select_related=('store',),
+                                   generation=CacheGeneration(settings_generation.key, check_interval=0))
+        self.assertEqual(elsewhere.get().name, "MOBot")
+
+        ChatbotSettings.objects.filter(pk=1).update(name="Drop bot")
+        with self.assertNumQueries(0):
+            self.assertEqual(elsewhere.get().name, "MOBot")
+
+        settings = ChatbotSettings.load()
+        settings.save()
+        self.assertEqual(elsewhere.get().name, "Drop bot")
+        with self.assertNumQueries(0):
+            elsewhere.get()
@@ -0,0 +1,90 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import unittest
+
+from mobot_client.txo_pool import TxoPool
+
+ACCOUNT_ID = "account"
+FEE_PMOB = 400
+
+
+class FakeFullService:
+
+    def __init__(self, unspent, spent=()):
+        self.unspent = dict(unspent)
+        self.spent = dict.fromkeys(spent, 1)
+
+    def get_all_txos_for_account(self, account_id):
+        txos = {}
+        for statuses, status in ((self.unspent, "txo_status_unspent"), (self.spent, "txo_status_spent")):
+            for txo_id, value in statuses.items():
+                txos[txo_id] = {"value_pmob": str(value),
+                                "account_status_map": {account_id: {"txo_status": status}}}
+        return txos
+
+
+class TxoPoolTests(unittest.TestCase):
+
+    def pool(self, unspent, **kwargs) -> TxoPool:
+        self.mcc = FakeFullService(unspent, **kwargs)
+        pool = TxoPool(self.mcc, ACCOUNT_ID, FEE_PMOB)
+        pool.refresh()
+        return pool
+
+    def test_picks_the_smallest_txo_that_covers_the_amount_and_fee(self):
+        pool = self.pool({"small": 1000, "exact": 1400, "big": 10 ** 6}, spent=["gone"])
+        self.assertEqual(pool.reserve(1000), ["exact"])
+        self.assertEqual(pool.reserve(1000), ["big"])
+        self.assertIsNone(pool.reserve(1000))
+
+    def test_adds_up_the_biggest_txos_when_none_covers_it_alone(self):
+        pool = self.pool({"a": 500, "b": 600, "c": 700})
+        self.assertEqual(sorted(pool.reserve(900)), ["b", "c"])
+        self.assertIsNone(pool.reserve(200))
+
+    def test_never_picks_txos_worth_an_excluded_value(self):
+        pool = self.pool({"sized": 1400, "big": 10 ** 6})
+        self.assertEqual(pool.reserve(1000, exclude_values=[1400]), ["big"])
+        self.assertEqual(pool.levels([1400, 10 ** 6]), {1400: 1, 10 ** 6: 0})
+
+    def test_released_and_restored_reservations(self):
+        pool = self.pool({"a": 1400, "b": 1400})
+        pool.reserve_ids(["a"])
+        self.assertEqual(pool.reserve(1000), ["b"])
+        pool.release(["b"])
+        self.assertEqual(pool.levels([1400]), {1400: 1})
+
+    def test_refresh_forgets_reservations_for_spent_txos(self):
+        pool = self.pool({"a": 1400, "b": 1400})
+        pool.reserve_ids(["a", "b"])
+        self.mcc.spent["a"] = self.mcc.unspent.pop("a")
+        self.mcc.unspent["change"] = 1400
+
+        pool.refresh()
+        self.assertEqual(pool.levels([1400]), {1400: 1})
+        self.assertEqual(pool.reserve(1000), ["change"])
+
+    def test_a_slow_refresh_does_not_undo_a_newer_one(self):
+        pool = self.pool({"a": 1400})
+        fetched, answered = threading.Event(), threading.Event()
+        fetch = self.mcc.get_all_txos_for_account
+
+        def slow_fetch(account_id):
+            txos = fetch(account_id)
+            self.mcc.get_all_txos_for_account = fetch
+            fetched.set()
+            self.assertTrue(answered.wait(5))
+            return txos
+
+        self.mcc.get_all_txos_for_account = slow_fetch
+        slow = threading.Thread(target=pool.refresh)
+        slow.start()
+        self.assertTrue(fetched.wait(5))
+        self.mcc.spent["a"] = self.mcc.unspent.pop("a")
+        pool.refresh()
+        answered.set()
+        slow.join()
+
+        self.assertEqual(pool.statuses(["a"]), {"a": "txo_status_spent"})
+        self.assertIsNone(pool.reserve(1000))
@@ -1,5 +1,273 @@
 # Copyright (c) 2021 MobileCoin. All rights reserved.
 
+import importlib
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from mobot_client.cache_generation import CacheGeneration
+from mobot_client.drop_schedule import drop_schedule
+from mobot_client.drop_stats import drop_stats
+from mobot_client.fullservice import PooledClient
+from mobot_client.models import (BonusCoin, ChatbotSettings, Customer, CustomerStorePreferences, Drop, DropSession,
+                                  Item, Store)
+from mobot_client.session_cache import session_cache
+from signald_client import Signal
+from signald_client.types import Message
+
+ACCOUNT_ID = "account"
+STORE_NUMBER = "+447000000000"
+CUSTOMER_NUMBER = "+447111111111"
+FEE_PMOB = 400000000
+
+# What run_mobot_client asks full-service for while it starts up.
+FULLSERVICE_RESPONSES = {
+    "get_all_accounts": {ACCOUNT_ID: {"main_address": "bot address"}},
+    "get_network_status": {"fee_pmob": str(FEE_PMOB)},
+    "get_balance_for_account": {"unspent_pmob": str(10 ** 15), "pending_pmob": "0"},
+}
+
+# The most queries handling one message may take, with the customer, their session, the drop schedule and the
+# settings already cached, as they are for everyone but a customer's first message. Savepoints count too.
+QUERY_BUDGETS = {
+    "first message from a new customer": 8,
+    "closed": 0,
+    "advertising drop": 0,
+    "start drop session": 3,
+    "ready to receive: yes": 10,
+    "ready to receive: help": 0,
+    "waiting for bonus: help": 0,
+    "allow contact: yes": 7,
+    "payment for bonus": 13,
+    "subscribe": 5,
+    "coins": 1,
+}
+
+
+class HandlerQueryBudgetTests(TestCase):
+    """
+    Runs the handlers in run_mobot_client against the test database, with full-service and signald replaced,
+    and fails if one of them takes more queries than its budget in QUERY_BUDGETS.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.patchers = [mock.patch.object(PooledClient, method, return_value=response)
+                        for method, response in FULLSERVICE_RESPONSES.items()]
+        cls.patchers += [
+            mock.patch.object(Signal, "_new_connection"),
+            mock.patch.object(Signal, "_send_command"),
+            # Settings, customers and sessions are only changed by the tests themselves.
+            mock.patch.object(CacheGeneration, "changed", return_value=False),
+        ]
+        for patcher in cls.patchers:
+            patcher.start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for patcher in cls.patchers:
+            patcher.stop()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name="MOBot", phone_number=STORE_NUMBER, description="",
+                                         privacy_policy_url="https://example.com/privacy")
+        ChatbotSettings(store=cls.store, name="MOBot", avatar_filename="").save()
+        cls.item = Item.objects.create(store=cls.store, name="MOB", description="free MOB")
+        # Imported here, since it reads the settings as soon as it's imported.
+        cls.bot = importlib.import_module("mobot_client.management.commands.run_mobot_client")
+
+    def setUp(self):
+        session_cache.clear()
+        drop_schedule.invalidate()
+        drop_stats.invalidate()
+        for target, attribute, value in (
+            (self.bot, "message_log", mock.MagicMock()),
+            (self.bot.payouts, "_queue_new", mock.MagicMock()),
+            (self.bot.signal.profiles, "get",
+             mock.MagicMock(return_value={"data": {"name": "Customer", "paymentsAddress": "customer address"}})),
+        ):
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @contextmanager
+    def assertWithinBudget(self, name):
+        budget = QUERY_BUDGETS[name]
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        self.assertLessEqual(
+            len(queries), budget,
+            f"'{name}' took {len(queries)} queries, over its budget of {budget}:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries))
+
+    def make_drop(self, advertise_in=timedelta(hours=-2), start_in=timedelta(hours=-1),
+                  end_in=timedelta(hours=1)) -> Drop:
+        now = timezone.now()
+        drop = Drop.objects.create(store=self.store, item=self.item, pre_drop_description="", number_restriction="+44",
+                                   timezone="Europe/London", advertisment_start_time=now + advertise_in,
+                                   start_time=now + start_in, end_time=now + end_in,
+                                   initial_coin_amount_pmob=10 ** 12, initial_coin_limit=10)
+        BonusCoin.objects.create(drop=drop, amount_pmob=2 * 10 ** 12, number_available=5)
+        BonusCoin.objects.create(drop=drop, amount_pmob=10 ** 13, number_available=1)
+        return drop
+
+    def make_session(self, drop: Drop, state: int) -> DropSession:
+        customer = Customer.objects.create(phone_number=CUSTOMER_NUMBER)
+        return DropSession.objects.create(customer=customer, drop=drop, state=state)
+
+    def warm_up(self, number=CUSTOMER_NUMBER):
+        "Load what the bot keeps cached between messages."
+        customer = session_cache.get_customer(number)
+        session_cache.get_open_session(customer)
+        drop_schedule.active_drop()
+        self.bot.chatbot_settings.get()
+
+    def send(self, text, number=CUSTOMER_NUMBER):
+        self.bot.chat_router(Message(username=STORE_NUMBER, source={"number": number}, text=text), None)
+
+    def test_open_session_loads_in_one_query(self):
+        drop = self.make_drop()
+        self.make_session(drop, self.bot.SESSION_STATE_READY_TO_RECEIVE_INITIAL)
+        customer = session_cache.get_customer(CUSTOMER_NUMBER)
+
+        with self.assertNumQueries(1):
+            drop_session = session_cache.get_open_session(customer)
+            self.assertEqual(drop_session.customer.phone_number, CUSTOMER_NUMBER)
+            self.assertEqual(drop_session.drop.item.description, "free MOB")
+            self.assertEqual(drop_session.drop.store.name, "MOBot")
+
+    def test_first_message_from_new_customer(self):
+        self.make_drop()
+        drop_schedule.active_drop()
+
+        with self.assertWithinBudget("first message from a new customer"):
+            self.send("hi")
+
+        self.assertEqual(DropSession.objects.filter(customer__phone_number=CUSTOMER_NUMBER).count(), 1)
+
+    def test_closed(self):
+        self.warm_up()
+
+        with self.assertWithinBudget("closed"):
+            self.send("hi")
+
+    def test_advertising_drop(self):
+        self.make_drop(advertise_in=timedelta(hours=-1), start_in=timedelta(hours=1), end_in=timedelta(hours=2))
+        self.warm_up()
+
+        with self.assertWithinBudget("advertising drop"):
+            self.send("hi")
+
+    def test_start_drop_session(self):
+        self.make_drop()
+        Customer.objects.create(phone_number=CUSTOMER_NUMBER)
+        self.warm_up()
+
+        with self.assertWithinBudget("start drop session"):
+            self.send("hi")
+
+        self.assertTrue(DropSession.objects.filter(state=self.bot.SESSION_STATE_READY_TO_RECEIVE_INITIAL).exists())
+
+    def test_ready_to_receive_yes(self):
+        drop_session = self.make_session(self.make_drop(), self.bot.SESSION_STATE_READY_TO_RECEIVE_INITIAL)
+        self.warm_up()
+
+        with self.assertWithinBudget("ready to receive: yes"):
+            self.send("yes")
+
+        drop_session.refresh_from_db()
+        self.assertEqual(drop_session.state, self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.assertEqual(Drop.objects.get(pk=drop_session.drop_id).initial_coins_claimed, 1)
+
+    def test_ready_to_receive_help(self):
+        self.make_session(self.make_drop(), self.bot.SESSION_STATE_READY_TO_RECEIVE_INITIAL)
+        self.warm_up()
+
+        with self.assertWithinBudget("ready to receive: help"):
+            self.send("help")
+
+    def test_waiting_for_bonus_help(self):
+        self.make_session(self.make_drop(), self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.warm_up()
+
+        with self.assertWithinBudget("waiting for bonus: help"):
+            self.send("help")
+
+    def test_allow_contact_yes(self):
+        drop_session = self.make_session(self.make_drop(), self.bot.SESSION_STATE_ALLOW_CONTACT_REQUESTED)
+        self.warm_up()
+
+        with self.assertWithinBudget("allow contact: yes"):
+            self.send("yes")
+
+        drop_session.refresh_from_db()
+        self.assertEqual(drop_session.state, self.bot.SESSION_STATE_COMPLETED)
+        self.assertTrue(CustomerStorePreferences.objects.get(customer=drop_session.customer).allows_contact)
+
+    def test_payment_for_bonus(self):
+        drop_session = self.make_session(self.make_drop(), self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.warm_up()
+        receipt = {"txo_public_key": "txo"}
+        receipt_status = {"txo": {"value_pmob": str(10 ** 10)}}
+
+        with self.assertWithinBudget("payment for bonus"):
+            self.bot.handle_confirmed_payment({"number": CUSTOMER_NUMBER}, receipt, "TransactionSuccess",
+                                              receipt_status)
+
+        drop_session.refresh_from_db()
+        self.assertIsNotNone(drop_session.bonus_coin_claimed)
+        self.assertEqual(drop_session.state, self.bot.SESSION_STATE_ALLOW_CONTACT_REQUESTED)
+
+    def test_refused_bonus_is_given_back(self):
+        drop_session = self.make_session(self.make_drop(), self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.warm_up()
+        receipt = {"txo_public_key": "txo"}
+        receipt_status = {"txo": {"value_pmob": str(10 ** 10)}}
+
+        with mock.patch.object(self.bot.payouts, "enqueue", return_value=None) as enqueue:
+            self.bot.handle_confirmed_payment({"number": CUSTOMER_NUMBER}, receipt, "TransactionSuccess",
+                                              receipt_status)
+
+        self.assertEqual([call[0][0] for call in enqueue.call_args_list], [f"bonus-{drop_session.pk}", "refund-txo"])
+        drop_session.refresh_from_db()
+        self.assertIsNone(drop_session.bonus_coin_claimed)
+        self.assertEqual(drop_session.state, self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.assertEqual(sum(BonusCoin.objects.values_list("number_claimed", flat=True)), 0)
+
+    def test_payment_that_did_not_land_is_answered_and_can_be_sent_again(self):
+        drop_session = self.make_session(self.make_drop(), self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.warm_up()
+
+        for status, reply in (("TransactionFailure", "didn't go through"),
+                              ("TransactionTimedOut", "couldn't confirm")):
+            self.bot.message_log.reset_mock()
+            self.bot.handle_confirmed_payment({"number": CUSTOMER_NUMBER}, {"txo_public_key": "txo"}, status, None)
+            self.assertIn(reply, self.bot.message_log.log.call_args[0][2])
+
+        drop_session.refresh_from_db()
+        self.assertEqual(drop_session.state, self.bot.SESSION_STATE_WAITING_FOR_BONUS_TRANSACTION)
+        self.assertIsNone(drop_session.bonus_coin_claimed)
+
+    def test_subscribe(self):
+        self.warm_up()
+
+        with self.assertWithinBudget("subscribe"):
+            self.bot.subscribe_handler(Message(username=STORE_NUMBER, source={"number": CUSTOMER_NUMBER},
+                                               text="subscribe"), None)
+
+        self.assertTrue(CustomerStorePreferences.objects.get(customer__phone_number=CUSTOMER_NUMBER).allows_contact)
+
+    def test_coins(self):
+        self.make_drop()
 
-# Create your tests here.
+        with self.assertWithinBudget("coins"):
+            self.bot.chat_router_coins(Message(username=STORE_NUMBER, source={"number": CUSTOMER_NUMBER},
+                                               text="coins"), None)
@@ -0,0 +1,115 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import itertools
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+# A MobileCoin transaction spends at most 16 inputs.
+MAX_INPUTS = 16
+
+TXO_STATUS_UNSPENT = "txo_status_unspent"
+TXO_STATUS_SPENT = "txo_status_spent"
+
+
+class TxoPool:
+    """
+    Hands out disjoint sets of the account's unspent txos, so that transactions built at the same time never
+    try to spend the same input.
+
+    reserve() picks inputs worth at least an amount plus the fee, preferring the smallest single txo that
+    covers it; that is what makes a wallet split by the prepare_wallet command into txos sized for each payout
+    go furthest. Reserved txos are left alone until release(), or until full-service stops listing them as
+    unspent because the transaction spending them went through.
+    """
+
+    def __init__(self, mcc, account_id: str, fee_pmob: int, refresh_interval: float = 5.0):
+        self._mcc = mcc
+        self.account_id = account_id
+        self.fee_pmob = int(fee_pmob)
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # txo id -> value in pmob, for every unspent txo
+        self._unspent = {}  # type: Dict[str, int]
+        # txo id -> full-service's txo status, for every txo of the account
+        self._statuses = {}  # type: Dict[str, Optional[str]]
+        self._reserved = set()
+        self._refreshed = 0.0
+        # Refreshes are numbered as they start, and one that started before the last applied is thrown away.
+        self._refreshes = itertools.count(1)
+        self._applied = 0
+
+    def refresh(self):
+        "Fetch the account's unspent txos from full-service."
+        with self._lock:
+            seq = next(self._refreshes)
+        txos = self._mcc.get_all_txos_for_account(self.account_id)
+        statuses = {
+            txo_id: txo["account_status_map"].get(self.account_id, {}).get("txo_status")
+            for txo_id, txo in txos.items()
+        }
+        unspent = {
+            txo_id: int(txo["value_pmob"]) for txo_id, txo in txos.items() if statuses[txo_id] == TXO_STATUS_UNSPENT
+        }
+        with self._lock:
+            if seq < self._applied:
+                # A slower refresh, overtaken by one that asked later and so knows better.
+                return
+            self._applied = seq
+            self._statuses = statuses
+            self._unspent = unspent
+            # Reservations for txos that are no longer unspent are done with, and aren't coming back.
+            self._reserved &= set(unspent)
+            self._refreshed = time.monotonic()
+
+    def reserve(self, amount_pmob: int, exclude_values: Iterable[int] = ()) -> Optional[List[str]]:
+        """
+        Reserve unspent txos worth at least amount_pmob plus the fee, and return their ids. Returns None if
+        the free txos don't add up to that. Txos worth exactly one of `exclude_values` are never picked.
+        """
+        if time.monotonic() - self._refreshed > self.refresh_interval:
+            self.refresh()
+
+        needed = amount_pmob + self.fee_pmob
+        exclude_values = set(exclude_values)
+        with self._lock:
+            free = sorted(
+                (value, txo_id) for txo_id, value in self._unspent.items()
+                if txo_id not in self._reserved and value not in exclude_values
+            )
+
+            chosen = next(([txo_id] for value, txo_id in free if value >= needed), None)
+            if chosen is None:
+                chosen, total = [], 0
+                for value, txo_id in reversed(free[-MAX_INPUTS:]):
+                    chosen.append(txo_id)
+                    total += value
+                    if total >= needed:
+                        break
+                else:
+                    return None
+
+            self._reserved.update(chosen)
+            return chosen
+
+    def reserve_ids(self, txo_ids: Iterable[str]):
+        "Mark txos as taken, e.g. by a transaction that was built before a restart."
+        with self._lock:
+            self._reserved.update(txo_ids)
+
+    def release(self, txo_ids: Iterable[str]):
+        "Give back txos that the transaction they were reserved for won't spend after all."
+        with self._lock:
+            self._reserved.difference_update(txo_ids)
+
+    def statuses(self, txo_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        "Each txo's status as of the last refresh, such as TXO_STATUS_SPENT, or None if it wasn't listed."
+        with self._lock:
+            return {txo_id: self._statuses.get(txo_id) for txo_id in txo_ids}
+
+    def levels(self, values: Iterable[int]) -> Dict[int, int]:
+        "How many free txos are worth exactly each of `values`."
+        with self._lock:
+            counts = Counter(value for txo_id, value in self._unspent.items() if txo_id not in self._reserved)
+        return {value: counts[value] for value in values}
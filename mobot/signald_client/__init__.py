@@ -4,3 +4,4 @@
 __version__ = "0.0.8"
 
 from .main import Signal
+from .async_main import AsyncSignal
@@ -0,0 +1,194 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import asyncio
+import functools
+import inspect
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from .connection import AsyncCommandConnection
+from .dispatch import sender_key
+from .jsonlib import dumps_line, loads, wanted_envelope
+from .main import Signal, parse_message
+from .types import Message, address_key
+
+# signald envelopes can be much larger than asyncio's default 64 KiB line limit.
+STREAM_LIMIT = 4 * 1024 * 1024
+
+
+class AsyncSignal(Signal):
+    """
+    An asyncio Signal client.
+
+    The command methods (send_message, send_receipt, get_profile, send_payment_receipt, set_profile,
+    send_attachment, ...) are the ones on Signal and take the same arguments, but here they return awaitables,
+    since every command goes through the coroutine _send_command. Handlers registered with chat_handler and
+    payment_handler can be coroutine functions; plain functions are run in the default executor so that they
+    don't stall the event loop. There is no blocking profile cache, send scheduler or receipt batcher; await
+    get_profile and send_receipt instead.
+    """
+
+    def __init__(self, username, socket_path="/var/run/signald/signald.sock", connections=1, reply_timeout=30.0,
+                 max_in_flight=500):
+        """
+        max_in_flight: How many messages run_chat handles at once before it stops reading new ones.
+        """
+        self._setup(username, socket_path, connections, reply_timeout)
+        self.max_in_flight = max_in_flight
+        self.profiles = None
+        self.scheduler = None
+        self.receipts = None
+        # While run_chat is running: its loop, and sender -> the task for that sender's latest message or call.
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._tails = {}  # type: Dict[str, asyncio.Future]
+
+    async def _open_streams(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        "Connect to the server and return a reader/writer pair."
+        if isinstance(self.socket_path, tuple):
+            return await asyncio.open_connection(*self.socket_path, limit=STREAM_LIMIT)
+        return await asyncio.open_unix_connection(self.socket_path, limit=STREAM_LIMIT)
+
+    def _new_connection(self) -> AsyncCommandConnection:
+        return AsyncCommandConnection(self._open_streams, self.reply_timeout)
+
+    async def _send_command(self, payload: dict, block: bool = False):
+        """
+        Send a command over one of the long-lived command connections.
+
+        If blocking, wait for signald's reply and return it. Otherwise return a Future for the reply.
+        """
+        payload["id"] = self._get_id()
+        future = await next(self._connections).send(payload)
+
+        if not block:
+            return future
+
+        return await asyncio.wait_for(future, self.reply_timeout)
+
+    async def receive_messages(self) -> AsyncIterator[Message]:
+        "Keep returning received messages."
+        reader, writer = await self._open_streams()
+        writer.write(dumps_line({"type": "subscribe", "username": self.username}))
+        await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionResetError("connection was reset")
+
+                if not wanted_envelope(line):
+                    continue
+
+                try:
+                    message = loads(line)
+                except ValueError:
+                    print("Invalid JSON")
+                    continue
+
+                if message.get("type") == "unreadable_message":
+                    await self.send_message(message["data"]["source"], "Could you repeat that?", block=False)
+
+                parsed = parse_message(message)
+                if parsed is not None:
+                    yield parsed
+        finally:
+            writer.close()
+
+    async def _call(self, func, *args):
+        "Await a coroutine handler, or run a plain one in the default executor."
+        if inspect.iscoroutinefunction(func):
+            return await func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _handle_message(self, message: Message, auto_send_receipts: bool):
+        if message.payment:
+            for func in self._payment_handlers:
+                await self._call(func, message.source, message.payment)
+            return
+
+        if not message.text:
+            return
+
+        for func, match in self._get_router().matches(message.text):
+            try:
+                reply = await self._call(func, message, match)
+            except Exception as e:  # noqa - We don't care why this failed.
+                print(e)
+                continue
+
+            if isinstance(reply, tuple):
+                stop, reply = reply
+            else:
+                stop = True
+
+            # In case a message came from a group chat
+            group_id = message.group_info.get("groupId")
+
+            # mark read and get that sweet filled checkbox
+            try:
+                if auto_send_receipts and not group_id:
+                    await self.send_receipt(recipient=message.source, timestamps=[message.timestamp])
+
+                if group_id:
+                    await self.send_group_message(recipient_group_id=group_id, text=reply)
+                else:
+                    await self.send_message(recipient=message.source, text=reply)
+            except Exception as e:
+                print(e)
+
+            if stop:
+                # We don't want to continue matching things.
+                break
+
+    def _forget(self, sender: str, task: asyncio.Future):
+        if self._tails.get(sender) is task:
+            del self._tails[sender]
+
+    def _chain(self, sender: str, step: Callable[[], Awaitable]) -> asyncio.Future:
+        "Run the coroutine step() in a task of its own, once the sender's previous message or call is done."
+        previous = self._tails.get(sender)
+
+        async def run():
+            try:
+                if previous is not None:
+                    await asyncio.wait([previous])
+                await step()
+            except Exception as e:  # noqa - One bad message shouldn't stop the loop.
+                print(e)
+
+        task = asyncio.ensure_future(run())
+        self._tails[sender] = task
+        task.add_done_callback(functools.partial(self._forget, sender))
+        return task
+
+    def run_in_order(self, source, func, *args):
+        """
+        Run func(*args) in turn with the messages from `source`: after everything already received from them,
+        and before anything they send next. It can be called from any thread, and func can be a coroutine
+        function. When run_chat isn't running, a plain func runs right away on the calling thread.
+        """
+        loop = self._loop
+        if loop is None:
+            if inspect.iscoroutinefunction(func):
+                raise RuntimeError("run_chat isn't running, so there is no loop to await func on")
+            func(*args)
+            return
+        loop.call_soon_threadsafe(self._chain, address_key(source), functools.partial(self._call, func, *args))
+
+    async def run_chat(self, auto_send_receipts=False):
+        """
+        Start the chat event loop.
+
+        Every message is handled in its own task, so many conversations can wait on signald and full-service at
+        once. Messages from the same sender are still handled one at a time, in the order they arrived.
+        """
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._loop = asyncio.get_running_loop()
+        try:
+            async for message in self.receive_messages():
+                print(message)
+                await in_flight.acquire()
+                task = self._chain(sender_key(message),
+                                   functools.partial(self._handle_message, message, auto_send_receipts))
+                task.add_done_callback(lambda task: in_flight.release())
+        finally:
+            self._loop = None
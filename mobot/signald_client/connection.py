@@ -0,0 +1,277 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import asyncio
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Iterator, List, Tuple
+
+from .jsonlib import dumps_line, loads
+
+
+class SignaldError(ValueError):
+    "signald answered a command with an error."
+
+    def __init__(self, reply: dict):
+        self.reply = reply
+        detail = (reply.get("data") or {}).get("message") if isinstance(reply.get("data"), dict) else None
+        super().__init__(f"unexpected error occurred: {detail}" if detail else "unexpected error occurred")
+
+
+def readlines(s: socket.socket, bufsize: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Read a socket, line by line.
+
+    Reads up to `bufsize` bytes per recv call and splits them on newlines. Only a trailing partial line is
+    carried over to the next read, so complete lines are sliced straight out of the chunk they arrived in.
+    """
+    partial = bytearray()
+    while True:
+        chunk = s.recv(bufsize)
+        if not chunk:
+            raise ConnectionResetError("connection was reset")
+
+        end = chunk.find(b"\n")
+        if end == -1:
+            partial += chunk
+            continue
+
+        if partial:
+            partial += chunk[:end]
+            yield bytes(partial)
+            partial.clear()
+        else:
+            yield chunk[:end]
+
+        start = end + 1
+        end = chunk.find(b"\n", start)
+        while end != -1:
+            yield chunk[start:end]
+            start = end + 1
+            end = chunk.find(b"\n", start)
+
+        partial += chunk[start:]
+
+
+class CommandConnection:
+    """
+    A long-lived signald connection that carries many commands at once.
+
+    Every command is written with its "id" and gets a Future. A reader thread matches each reply line back to
+    its Future by that id, so callers can pipeline commands without waiting for each other. The connection is
+    opened lazily and re-opened on the next send after signald drops it; commands that were in flight at that
+    point fail with ConnectionResetError. Replies that never arrive fail with TimeoutError after `reply_timeout`,
+    checked for by a second thread so that they fail on time even when nothing else is sent.
+    """
+
+    def __init__(self, connect: Callable[[], socket.socket], reply_timeout: float = 30.0):
+        self._connect = connect
+        self.reply_timeout = reply_timeout
+        self._lock = threading.RLock()
+        self._sock = None
+        # id -> (future, deadline). Deadlines share one timeout, so insertion order is deadline order.
+        self._pending = OrderedDict()
+
+    def send(self, payload: dict) -> Future:
+        "Write a command that already carries an id and return a Future for its reply."
+        future = Future()
+        line = dumps_line(payload)
+        failed = []
+        try:
+            with self._lock:
+                failed = self._expire_pending()
+                sock = self._sock or self._open()
+                self._pending[payload["id"]] = (future, time.monotonic() + self.reply_timeout)
+                try:
+                    sock.sendall(line)
+                except OSError as e:
+                    self._pending.pop(payload["id"], None)
+                    failed += self._drop(sock, e)
+                    raise
+        finally:
+            _fail(failed)
+        return future
+
+    def close(self):
+        failed = []
+        with self._lock:
+            if self._sock is not None:
+                failed = self._drop(self._sock, ConnectionResetError("connection was closed"))
+        _fail(failed)
+
+    def _open(self) -> socket.socket:
+        sock = self._connect()
+        self._sock = sock
+        threading.Thread(target=self._read_replies, args=(sock,), name="signald-replies", daemon=True).start()
+        threading.Thread(target=self._expire_overdue, args=(sock,), name="signald-expiry", daemon=True).start()
+        return sock
+
+    def _drop(self, sock: socket.socket, error: Exception) -> List[Tuple[Future, Exception]]:
+        """
+        Close `sock` and return (future, error) for everything still waiting on it, to fail with _fail(). Call
+        with the lock held.
+        """
+        failed = []
+        if self._sock is sock:
+            self._sock = None
+            pending, self._pending = self._pending, OrderedDict()
+            failed = [(future, error) for future, _deadline in pending.values()]
+        try:
+            sock.close()
+        except OSError:
+            pass
+        return failed
+
+    def _expire_pending(self) -> List[Tuple[Future, Exception]]:
+        "Take the replies that are overdue, as (future, error) to fail with _fail(). Call with the lock held."
+        now = time.monotonic()
+        expired = []
+        while self._pending:
+            msg_id, (future, deadline) = next(iter(self._pending.items()))
+            if deadline > now:
+                break
+            del self._pending[msg_id]
+            expired.append((future, TimeoutError(f"no reply from signald for {msg_id}")))
+        return expired
+
+    def _expire_overdue(self, sock: socket.socket):
+        "Fail replies as they become overdue, until `sock` is dropped."
+        while True:
+            with self._lock:
+                if self._sock is not sock:
+                    return
+                failed = self._expire_pending()
+                # The oldest reply is the next one due; a command sent from now on is due reply_timeout from now.
+                next_deadline = next(iter(self._pending.values()))[1] if self._pending else None
+            _fail(failed)
+            wait = self.reply_timeout if next_deadline is None else next_deadline - time.monotonic()
+            time.sleep(max(wait, 0.01))
+
+    def _read_replies(self, sock: socket.socket):
+        try:
+            for line in readlines(sock):
+                try:
+                    data = loads(line)
+                except ValueError:
+                    print("Invalid JSON")
+                    continue
+
+                # The version greeting and anything else that isn't a reply has no id.
+                msg_id = data.get("id")
+                if msg_id is None:
+                    continue
+
+                with self._lock:
+                    entry = self._pending.pop(msg_id, None)
+                if entry is None:
+                    continue
+
+                future = entry[0]
+                if data.get("type") == "unexpected_error":
+                    future.set_exception(SignaldError(data))
+                else:
+                    future.set_result(data)
+        except OSError as e:
+            with self._lock:
+                failed = self._drop(sock, e)
+            _fail(failed)
+
+
+def _fail(failed: List[Tuple[Future, Exception]]):
+    """
+    Fail futures taken off a connection. This runs their done callbacks, which may take locks of their own, so
+    it must be called after the connection's lock is released.
+    """
+    for future, error in failed:
+        future.set_exception(error)
+
+
+class AsyncCommandConnection:
+    """
+    The asyncio counterpart of CommandConnection.
+
+    `connect` is a coroutine function returning a (StreamReader, StreamWriter) pair. Replies resolve asyncio
+    Futures on the loop the connection was first used from.
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]],
+                 reply_timeout: float = 30.0):
+        self._connect = connect
+        self.reply_timeout = reply_timeout
+        self._lock = None
+        self._writer = None
+        # id -> (future, timeout handle)
+        self._pending = {}
+
+    async def send(self, payload: dict) -> asyncio.Future:
+        "Write a command that already carries an id and return a Future for its reply."
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        line = dumps_line(payload)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._writer is None:
+                reader, self._writer = await self._connect()
+                loop.create_task(self._read_replies(reader, self._writer))
+            writer = self._writer
+            msg_id = payload["id"]
+            self._pending[msg_id] = (future, loop.call_later(self.reply_timeout, self._expire, msg_id))
+            try:
+                writer.write(line)
+                await writer.drain()
+            except OSError as e:
+                self._pending.pop(msg_id)[1].cancel()
+                self._drop(writer, e)
+                raise
+        return future
+
+    def close(self):
+        if self._writer is not None:
+            self._drop(self._writer, ConnectionResetError("connection was closed"))
+
+    def _drop(self, writer: asyncio.StreamWriter, error: Exception):
+        if self._writer is writer:
+            self._writer = None
+            pending, self._pending = self._pending, {}
+            for future, handle in pending.values():
+                handle.cancel()
+                if not future.done():
+                    future.set_exception(error)
+        writer.close()
+
+    def _expire(self, msg_id: str):
+        future, _handle = self._pending.pop(msg_id, (None, None))
+        if future is not None and not future.done():
+            future.set_exception(TimeoutError(f"no reply from signald for {msg_id}"))
+
+    async def _read_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionResetError("connection was reset")
+
+                try:
+                    data = loads(line)
+                except ValueError:
+                    print("Invalid JSON")
+                    continue
+
+                # The version greeting and anything else that isn't a reply has no id.
+                future, handle = self._pending.pop(data.get("id"), (None, None))
+                if future is None:
+                    continue
+
+                handle.cancel()
+                if future.done():
+                    continue
+                if data.get("type") == "unexpected_error":
+                    future.set_exception(SignaldError(data))
+                else:
+                    future.set_result(data)
+        except (OSError, ValueError) as e:
+            self._drop(writer, e)
@@ -0,0 +1,181 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import functools
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Optional
+
+from .types import Message, address_key
+
+PAYMENT_LANE = "payment"
+CHAT_LANE = "chat"
+
+
+def sender_key(message: Message) -> str:
+    "The key messages are ordered by: the sender's number, or their uuid if the number is hidden."
+    return address_key(message.source)
+
+
+class _Lane:
+    "A bounded queue of messages of one kind, with the numbers needed to tune it."
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        # (seq, sender, enqueued_at, work), oldest first
+        self.items = deque()
+        self.submitted = 0
+        self.started = 0
+        self.handled = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def waited(self, now: float) -> float:
+        "How long the oldest queued message has been waiting."
+        return now - self.items[0][2] if self.items else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "depth": len(self.items),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "handled": self.handled,
+            "avg_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class Dispatcher:
+    """
+    Hands messages to worker threads, with payments ahead of chat.
+
+    Messages go into one of two bounded lanes: payments and chat. Payment workers only ever take payments, so a
+    flood of chat can't hold up a customer who has already paid. Chat workers take payments first too, unless
+    the oldest chat message has waited longer than `max_chat_wait` seconds, in which case they serve chat first
+    so it can't be starved either.
+
+    A sender's messages are handled strictly in the order they were submitted, across both lanes: a message is
+    only taken once every earlier message from the same sender is done. submit() blocks while the message's lane
+    is full, which pushes back on the receive loop.
+    """
+
+    def __init__(self, handle: Callable[[Message], None], chat_workers: int = 8, payment_workers: int = 2,
+                 queue_size: int = 100, max_chat_wait: float = 5.0, report_interval: Optional[float] = None):
+        self._handle = handle
+        self.max_chat_wait = max_chat_wait
+        self._cond = threading.Condition()
+        self._closed = False
+        self._lanes = {PAYMENT_LANE: _Lane(PAYMENT_LANE, queue_size), CHAT_LANE: _Lane(CHAT_LANE, queue_size)}
+        self._seq = itertools.count()
+        # sender -> seqs of their queued and running messages, oldest first
+        self._order = defaultdict(deque)
+        # senders a worker is handling right now
+        self._busy = set()
+
+        self._workers = [
+            threading.Thread(target=self._work, args=(lane,), name=f"dispatch-{lane}-{i}", daemon=True)
+            for lane, count in ((PAYMENT_LANE, payment_workers), (CHAT_LANE, chat_workers))
+            for i in range(count)
+        ]
+        for thread in self._workers:
+            thread.start()
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="dispatch-report", daemon=True).start()
+
+    def submit(self, message: Message):
+        "Queue a message on its lane, blocking while that lane is full."
+        lane = PAYMENT_LANE if message.payment else CHAT_LANE
+        self._enqueue(self._lanes[lane], sender_key(message), functools.partial(self._handle, message))
+
+    def submit_call(self, sender: str, func: Callable, *args, lane: str = PAYMENT_LANE):
+        """
+        Queue func(*args) to run as though it were a message from `sender`: after everything already queued from
+        them, and before anything they send next.
+        """
+        self._enqueue(self._lanes[lane], sender, functools.partial(func, *args))
+
+    def _enqueue(self, lane: _Lane, sender: str, work: Callable[[], None]):
+        with self._cond:
+            while len(lane.items) >= lane.maxsize:
+                self._cond.wait()
+            seq = next(self._seq)
+            lane.items.append((seq, sender, time.monotonic(), work))
+            self._order[sender].append(seq)
+            lane.submitted += 1
+            lane.max_depth = max(lane.max_depth, len(lane.items))
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        "Queue depth, throughput and time spent queued (in seconds) for each lane."
+        with self._cond:
+            return {name: lane.stats() for name, lane in self._lanes.items()}
+
+    def close(self, wait: bool = True):
+        "Stop the workers once they have handled everything already queued."
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._workers:
+                thread.join()
+
+    def _lanes_for(self, home: str, now: float):
+        "The lanes a worker should take from, in order of preference."
+        payments, chat = self._lanes[PAYMENT_LANE], self._lanes[CHAT_LANE]
+        if home == PAYMENT_LANE:
+            return (payments,)
+        if chat.waited(now) > self.max_chat_wait:
+            return (chat, payments)
+        return (payments, chat)
+
+    def _take(self, home: str):
+        "Pop the first message a worker may run now. Call with the lock held."
+        now = time.monotonic()
+        for lane in self._lanes_for(home, now):
+            for i, (seq, sender, enqueued_at, work) in enumerate(lane.items):
+                if sender in self._busy or self._order[sender][0] != seq:
+                    continue
+                del lane.items[i]
+                self._busy.add(sender)
+                wait = now - enqueued_at
+                lane.started += 1
+                lane.total_wait += wait
+                lane.max_wait = max(lane.max_wait, wait)
+                self._cond.notify_all()
+                return lane, sender, work
+        return None
+
+    def _work(self, home: str):
+        while True:
+            with self._cond:
+                taken = self._take(home)
+                while taken is None:
+                    if self._closed and not any(lane.items for lane in self._lanes.values()):
+                        return
+                    self._cond.wait()
+                    taken = self._take(home)
+
+            lane, sender, work = taken
+            try:
+                work()
+            except Exception as e:  # noqa - One bad message shouldn't take the worker down.
+                print(e)
+            finally:
+                with self._cond:
+                    self._busy.discard(sender)
+                    order = self._order[sender]
+                    order.popleft()
+                    if not order:
+                        del self._order[sender]
+                    lane.handled += 1
+                    self._cond.notify_all()
+
+    def _report(self, interval: float):
+        while not self._closed:
+            time.sleep(interval)
+            for name, stats in self.stats().items():
+                print("{} lane: depth={depth} max_depth={max_depth} submitted={submitted} handled={handled} "
+                      "avg_wait={avg_wait:.3f}s max_wait={max_wait:.3f}s".format(name, **stats))
@@ -0,0 +1,41 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+"""
+JSON for the signald sockets, using the fastest backend that is installed: orjson, then ujson, then the
+standard library. All of them parse bytes directly and raise a ValueError subclass on bad input.
+"""
+
+import json
+import re
+
+try:
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps_line(payload: dict) -> bytes:
+        return orjson.dumps(payload) + b"\n"
+
+except ImportError:
+    try:
+        import ujson
+
+        loads = ujson.loads
+
+        def dumps_line(payload: dict) -> bytes:
+            return ujson.dumps(payload, ensure_ascii=False).encode("utf8") + b"\n"
+
+    except ImportError:
+        loads = json.loads
+
+        def dumps_line(payload: dict) -> bytes:
+            return json.dumps(payload).encode("utf8") + b"\n"
+
+# Envelope types receive_messages acts on. Lines without one of these are skipped without being parsed; a line
+# that only mentions one in passing is still parsed and then dropped by parse_message.
+_WANTED_ENVELOPE = re.compile(rb'"type"\s*:\s*"(?:message|unreadable_message)"')
+
+
+def wanted_envelope(line: bytes) -> bool:
+    "Whether a raw subscription line could be an envelope receive_messages acts on."
+    return _WANTED_ENVELOPE.search(line) is not None
@@ -1,38 +1,98 @@
 # This code is copied from [pysignald](https://pypi.org/project/pysignald/) and modified to run locally with payments
 
 import os
-import json
+import itertools
 import random
 import re
 import socket
-from typing import Iterator, List  # noqa
-
-from .types import Attachment, Message
+from concurrent.futures import Future
+from typing import Iterator, List, Optional, Union  # noqa
+
+from .connection import CommandConnection, readlines
+from .dispatch import Dispatcher
+from .jsonlib import dumps_line, loads, wanted_envelope
+from .profiles import ProfileCache
+from .ratelimit import SendScheduler
+from .receipts import ReceiptBatcher
+from .routing import Route, Router, keyword_regex
+from .types import Attachment, Message, address_key
 
 # We'll need to know the compiled RE object later.
 RE_TYPE = type(re.compile(""))
 
-def readlines(s: socket.socket) -> Iterator[bytes]:
-    "Read a socket, line by line."
-    buf = []  # type: List[bytes]
-    while True:
-        char = s.recv(1)
-        if not char:
-            raise ConnectionResetError("connection was reset")
-
-        if char == b"\n":
-            yield b"".join(buf)
-            buf = []
-        else:
-            buf.append(char)
+# Commands that go through the send scheduler, when there is one.
+PACED_COMMANDS = ("send", "mark_read")
+
+
+def parse_message(envelope: dict) -> Optional[Message]:
+    "Build a Message out of a decoded signald envelope, or return None if it isn't one we handle."
+    if envelope.get("type") != "message" or (
+        not envelope["data"].get("isReceipt") and envelope["data"].get("dataMessage") is None
+    ):
+        # We need to do more digging to figure out what all of the other message types could
+        # be, and how to properly handle them when they occur
+        return None
+
+    message = envelope["data"]
+    data_message = message.get("dataMessage", {})
+
+    return Message(
+        username=message["username"],
+        source=message["source"],
+        text=data_message.get("body"),
+        source_device=message["sourceDevice"],
+        timestamp=data_message.get("timestamp"),
+        timestamp_iso=message["timestampISO"],
+        expiration_secs=data_message.get("expiresInSeconds"),
+        is_receipt=message.get("isReceipt"),
+        group_info=data_message.get("groupInfo", {}),
+        payment=data_message.get("payment", None)
+    )
 
 
 class Signal:
-    def __init__(self, username, socket_path="/var/run/signald/signald.sock"):
+    def __init__(self, username, socket_path="/var/run/signald/signald.sock", connections=1, reply_timeout=30.0,
+                 profile_ttl=300.0, profile_cache_size=10000, send_rate=None, send_burst=40.0,
+                 recipient_rate=1.0, recipient_burst=5.0, send_workers=4, send_report_interval=None,
+                 receipt_window=1.0, receipt_batch_size=20):
+        """
+        username:             The Signal number this bot runs as.
+        socket_path:          A UNIX socket path, or a (host, port) tuple for TCP.
+        connections:          How many long-lived command connections to spread commands across.
+        reply_timeout:        Seconds to wait for signald to answer a command.
+        profile_ttl:          Seconds a profile stays in `profiles`, the profile cache.
+        profile_cache_size:   How many profiles `profiles` holds before evicting the least recently used.
+        send_rate:            If set, messages and receipts go through `scheduler`, which sends at most this
+                              many per second overall and retries the ones Signal throttles.
+        send_burst:           How many messages the scheduler may send at once after a quiet spell.
+        recipient_rate:       Messages per second the scheduler sends to any one recipient.
+        recipient_burst:      How many messages one recipient may get at once after a quiet spell.
+        send_workers:         How many messages the scheduler has in flight at a time.
+        send_report_interval: If set, print the scheduler's queued/sent/dropped counts this often, in seconds.
+        receipt_window:       Seconds run_chat holds read receipts for a sender, so they go out as one mark_read.
+        receipt_batch_size:   How many receipts for one sender run_chat holds before sending them regardless.
+        """
+        self._setup(username, socket_path, connections, reply_timeout)
+        self.profiles = ProfileCache(lambda recipient: self.get_profile(recipient, block=False), profile_ttl,
+                                     profile_cache_size, timeout=reply_timeout)
+        self.scheduler = None
+        if send_rate:
+            self.scheduler = SendScheduler(lambda payload: self._send_command(payload, block=True, paced=False),
+                                           send_rate, send_burst, recipient_rate, recipient_burst, send_workers,
+                                           report_interval=send_report_interval)
+        self.receipts = ReceiptBatcher(lambda recipient, timestamps: self.send_receipt(recipient, timestamps, False),
+                                       receipt_window, receipt_batch_size)
+
+    def _setup(self, username, socket_path, connections, reply_timeout):
+        "What every client needs, whether it blocks or runs on asyncio: its connections and handlers."
         self.username = username
         self.socket_path = socket_path
+        self.reply_timeout = reply_timeout
+        self._connections = itertools.cycle([self._new_connection() for _ in range(max(connections, 1))])
         self._chat_handlers = []
+        self._router = None
         self._payment_handlers = []
+        self._dispatcher = None
         print("Connecting to signald at {}".format(socket_path))
 
     def _get_id(self):
@@ -50,30 +110,30 @@ class Signal:
         s.connect(self.socket_path)
         return s
 
-    def _send_command(self, payload: dict, block: bool = False):
-        s = self._get_socket()
-        msg_id = self._get_id()
-        payload["id"] = msg_id
-        s.recv(1024)  # Flush the buffer.
-        s.send(json.dumps(payload).encode("utf8") + b"\n")
-
-        if not block:
-            return
+    def _new_connection(self) -> CommandConnection:
+        return CommandConnection(self._get_socket, self.reply_timeout)
 
-        response = s.recv(4 * 1024)
-        for line in response.split(b"\n"):
-            if msg_id.encode("utf8") not in line:
-                continue
-
-            data = json.loads(line)
+    def _send_command(self, payload: dict, block: bool = False, paced: bool = True) -> Union[dict, Future]:
+        """
+        Send a command over one of the long-lived command connections.
 
-            if data.get("id") != msg_id:
-                continue
+        If blocking, wait for signald's reply and return it. Otherwise return a Future for the reply, which
+        callers can attach callbacks to or ignore. Messages and receipts wait their turn in `scheduler` first, if
+        there is one, unless `paced` is False.
+        """
+        if paced and self.scheduler is not None and payload["type"] in PACED_COMMANDS:
+            future = self.scheduler.submit(payload)
+            # The scheduler gives every attempt its own reply_timeout, so wait out the retries too.
+            timeout = None
+        else:
+            payload["id"] = self._get_id()
+            future = next(self._connections).send(payload)
+            timeout = self.reply_timeout
 
-            if data["type"] == "unexpected_error":
-                raise ValueError("unexpected error occurred")
+        if not block:
+            return future
 
-        return response
+        return future.result(timeout=timeout)
 
     def register(self, voice=False):
         """
@@ -82,7 +142,7 @@ class Signal:
         voice: Whether to receive a voice call or an SMS for verification.
         """
         payload = {"type": "register", "username": self.username, "voice": voice}
-        self._send_command(payload)
+        return self._send_command(payload)
 
     def verify(self, code: str):
         """
@@ -91,53 +151,38 @@ class Signal:
         code: The code Signal sent you.
         """
         payload = {"type": "verify", "username": self.username, "code": code}
-        self._send_command(payload)
+        return self._send_command(payload)
 
     def receive_messages(self) -> Iterator[Message]:
         "Keep returning received messages."
         s = self._get_socket()
-        s.send(json.dumps({"type": "subscribe", "username": self.username}).encode("utf8") + b"\n")
+        s.send(dumps_line({"type": "subscribe", "username": self.username}))
         for line in readlines(s):
+            if not wanted_envelope(line):
+                continue
+
             try:
-                message = json.loads(line.decode())
-            except json.JSONDecodeError:
+                message = loads(line)
+            except ValueError:
                 print("Invalid JSON")
+                continue
 
             if message.get("type") == "unreadable_message":
                 self.get_profile(message["data"]["source"])
                 self.send_message(message["data"]["source"], "Could you repeat that?")
 
-            if message.get("type") != "message" or (
-                not message["data"].get("isReceipt") and message["data"].get("dataMessage") is None
-            ):
-                # We need to do more digging to figure out what all of the other message types could
-                # be, and how to properly handle them when they occur
-                continue
+            parsed = parse_message(message)
+            if parsed is not None:
+                yield parsed
 
-            message = message["data"]
-            data_message = message.get("dataMessage", {})
-
-            yield Message(
-                username=message["username"],
-                source=message["source"],
-                text=data_message.get("body"),
-                source_device=message["sourceDevice"],
-                timestamp=data_message.get("timestamp"),
-                timestamp_iso=message["timestampISO"],
-                expiration_secs=data_message.get("expiresInSeconds"),
-                is_receipt=message.get("isReceipt"),
-                group_info=data_message.get("groupInfo", {}),
-                payment=data_message.get("payment", None)
-            )
-
-    def send_attachment(self, recipient, attachmentFilename, message, block: bool = True) -> None:
+    def send_attachment(self, recipient, attachmentFilename, message, block: bool = True):
         """
         Send a message.
 
         recipient: The recipient's phone number, in E.123 format.
         attachmentFilename: The attachment's filename. Does not include directory path.
-        block:     Whether to block while sending. If you choose not to block, you won't get an exception if there
-                   are any errors.
+        block:     Whether to block while sending. If you choose not to block, you get a Future for signald's reply
+                   instead, and any error is set on it rather than raised.
         """
         payload = {
             "type": "send",
@@ -148,22 +193,22 @@ class Signal:
             # When it gets mounted as a volume on Docker, the directory becomes signald/.
             "attachments":[{'filename': '/signald/' + attachmentFilename}]
         }
-        self._send_command(payload, block)
+        return self._send_command(payload, block)
 
-    def send_message(self, recipient, text: str, block: bool = True) -> None:
+    def send_message(self, recipient, text: str, block: bool = True):
         """
         Send a message.
 
         recipient: The recipient's phone number, in E.123 format.
         text:      The text of the message to send.
-        block:     Whether to block while sending. If you choose not to block, you won't get an exception if there
-                   are any errors.
+        block:     Whether to block while sending. If you choose not to block, you get a Future for signald's reply
+                   instead, and any error is set on it rather than raised.
         """
         payload = {"type": "send", "username": self.username, "recipientAddress": recipient, "messageBody": text}
-        self._send_command(payload, block)
+        return self._send_command(payload, block)
 
 
-    def send_receipt(self, recipient, timestamps, block: bool = True) -> None:
+    def send_receipt(self, recipient, timestamps, block: bool = True):
         if not isinstance(timestamps, list):
             timestamps = [timestamps]
 
@@ -173,17 +218,17 @@ class Signal:
             "recipientAddress": recipient,
             "timestamps": timestamps
         }
-        self._send_command(payload, block)
+        return self._send_command(payload, block)
 
 
-    def send_group_message(self, recipient_group_id: str, text: str, block: bool = False) -> None:
+    def send_group_message(self, recipient_group_id: str, text: str, block: bool = False):
         """
         Send a group message.
 
         recipient_group_id: The base64 encoded group ID to send to.
         text:               The text of the message to send.
-        block:              Whether to block while sending. If you choose not to block, you won't get an exception if
-                            there are any errors.
+        block:              Whether to block while sending. If you choose not to block, you get a Future for signald's
+                            reply instead, and any error is set on it rather than raised.
         """
         payload = {
             "type": "send",
@@ -191,10 +236,10 @@ class Signal:
             "recipientGroupId": recipient_group_id,
             "messageBody": text,
         }
-        self._send_command(payload, block)
+        return self._send_command(payload, block)
 
 
-    def send_payment_receipt(self, recipient_address: str, receiver_receipt: dict, message: str, block: bool = True) -> None:
+    def send_payment_receipt(self, recipient_address: str, receiver_receipt: dict, message: str, block: bool = True):
         """
         Sends a payment receipt. Make sure to only call this method once we've verified that the transaction landed.
 
@@ -220,7 +265,7 @@ class Signal:
         }
         print("---------receipt payload-----------")
         print(payload)
-        print(self._send_command(payload, block))
+        return self._send_command(payload, block)
 
     """
         avatar_filename: The filename for the avatar image you wish to set. It
@@ -239,7 +284,7 @@ class Signal:
         if avatar_filename:
             payload.update(avatarFile=f"/signald/{avatar_filename}")
 
-        self._send_command(payload, block)
+        return self._send_command(payload, block)
 
 
     def get_profile(self, recipient, block: bool = True):
@@ -248,11 +293,7 @@ class Signal:
             "username": self.username,
             "recipientAddress": recipient,
         }
-        response = self._send_command(payload, block)
-        as_string = response.decode('utf8')
-        data = json.loads(as_string)
-
-        return data
+        return self._send_command(payload, block)
 
 
     def chat_handler(self, regex, order=100):
@@ -263,64 +304,125 @@ class Signal:
             regex = re.compile(regex, re.I)
 
         def decorator(func):
-            self._chat_handlers.append((order, regex, func))
-            # Use only the first value to sort so that declaration order doesn't change.
-            self._chat_handlers.sort(key=lambda x: x[0])
+            # Rank by order, then declaration, so that declaration order doesn't change.
+            self._chat_handlers.append(Route((order, len(self._chat_handlers)), regex, func))
+            self._router = None
+            return func
+
+        return decorator
+
+    def chat_command(self, word, order=100):
+        """
+        A decorator that registers a chat handler function for a command word. It only matches messages that
+        are exactly that word, ignoring case and surrounding whitespace, so "subscribe" won't catch "unsubscribe".
+        """
+        def decorator(func):
+            self._chat_handlers.append(Route((order, len(self._chat_handlers)), keyword_regex(word), func, word))
+            self._router = None
             return func
 
         return decorator
 
+    def _get_router(self) -> Router:
+        "The routing table for the registered chat handlers, compiled the first time it's needed."
+        if self._router is None:
+            self._router = Router(self._chat_handlers)
+        return self._router
+
     def payment_handler(self, func):
         self._payment_handlers.append(func)
         return func
 
-    def run_chat(self, auto_send_receipts=False):
-        """
-        Start the chat event loop.
-        """
-        for message in self.receive_messages():
-            print(message)
+    def _handle_message(self, message: Message, auto_send_receipts: bool):
+        if message.payment:
+            for func in self._payment_handlers:
+                func(message.source, message.payment)
+            return
 
-            if message.payment:
-                for func in self._payment_handlers:
-                    func(message.source, message.payment)
-                continue
+        if not message.text:
+            return
 
-            if not message.text:
+        for func, match in self._get_router().matches(message.text):
+            try:
+                reply = func(message, match)
+            except Exception as e:  # noqa - We don't care why this failed.
+                print(e)
                 continue
 
-            for _, regex, func in self._chat_handlers:
-                match = re.search(regex, message.text)
-                if not match:
-                    continue
+            if isinstance(reply, tuple):
+                stop, reply = reply
+            else:
+                stop = True
+
+
+            # In case a message came from a group chat
+            group_id = message.group_info.get("groupId")
 
-                try:
-                    reply = func(message, match)
-                except Exception as e:  # noqa - We don't care why this failed.
-                    print(e)
-                    continue
+            # mark read and get that sweet filled checkbox
+            try:
+                if auto_send_receipts and not group_id:
+                    self.receipts.add(message.source, message.timestamp)
 
-                if isinstance(reply, tuple):
-                    stop, reply = reply
+                if group_id:
+                    self.send_group_message(recipient_group_id=group_id, text=reply)
                 else:
-                    stop = True
+                    self.send_message(recipient=message.source, text=reply)
+            except Exception as e:
+                print(e)
 
+            if stop:
+                # We don't want to continue matching things.
+                break
 
-                # In case a message came from a group chat
-                group_id = message.group_info.get("groupId")
+    def run_in_order(self, source, func, *args):
+        """
+        Run func(*args) as though it were a payment message from `source`: after everything already queued from
+        them, and before anything they send next. Use it to resume a customer's conversation from another thread.
+        When run_chat isn't dispatching to workers, func runs right away on the calling thread.
+        """
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            func(*args)
+        else:
+            dispatcher.submit_call(address_key(source), func, *args)
 
-                # mark read and get that sweet filled checkbox
-                try:
-                    if auto_send_receipts and not group_id:
-                        self.send_receipt(recipient=message.source, timestamps=[message.timestamp])
+    def run_chat(self, auto_send_receipts=False, chat_workers=0, payment_workers=2, queue_size=100,
+                 max_chat_wait=5.0, report_interval=None, prefetch_profiles=False):
+        """
+        Start the chat event loop.
 
-                    if group_id:
-                        self.send_group_message(recipient_group_id=group_id, text=reply)
-                    else:
-                        self.send_message(recipient=message.source, text=reply)
-                except Exception as e:
-                    print(e)
+        chat_workers:      How many threads handle chat messages. With 0, every message is handled on the
+                           receive loop, one at a time, and the other arguments are ignored.
+        payment_workers:   How many threads are reserved for payment messages. Chat threads also take payments
+                           first, so payments never wait behind a flood of chat.
+        queue_size:        How many messages each lane holds before the receive loop waits for it to catch up.
+        max_chat_wait:     Seconds a chat message may wait before chat threads serve chat ahead of payments.
+        report_interval:   If set, print each lane's queue depth and wait times this often, in seconds.
+        prefetch_profiles: Whether to start fetching a sender's profile into `profiles` as soon as their message
+                           arrives, so it is ready by the time a handler looks it up.
+
+        Messages from one sender are always handled in the order they arrived. Read receipts go out through
+        `receipts`, batched per sender, and anything still batched is sent when the loop stops.
+        """
+        if not chat_workers:
+            try:
+                for message in self.receive_messages():
+                    print(message)
+                    self._handle_message(message, auto_send_receipts)
+            finally:
+                self.receipts.close()
+            return
 
-                if stop:
-                    # We don't want to continue matching things.
-                    break
+        dispatcher = Dispatcher(lambda m: self._handle_message(m, auto_send_receipts), chat_workers,
+                                payment_workers, queue_size, max_chat_wait, report_interval)
+        self._dispatcher = dispatcher
+        try:
+            for message in self.receive_messages():
+                print(message)
+                if prefetch_profiles:
+                    self.profiles.prefetch(message.source)
+                dispatcher.submit(message)
+        finally:
+            dispatcher.close()
+            self._dispatcher = None
+            self.receipts.close()
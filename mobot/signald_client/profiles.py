@@ -0,0 +1,98 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable
+
+from .types import address_key
+
+
+class ProfileCache:
+    """
+    A TTL cache of signald get_profile replies, evicting the least recently used once it holds `maxsize`.
+
+    `fetch` sends a non-blocking get_profile and returns a Future for the reply. Lookups for a recipient that is
+    already being fetched wait on that fetch instead of sending another. Replies without profile data are kept
+    for `negative_ttl` only, so a customer who turns on payments isn't told they are off for long.
+    """
+
+    def __init__(self, fetch: Callable[[object], Future], ttl: float = 300.0, maxsize: int = 10000,
+                 negative_ttl: float = 10.0, timeout: float = 30.0):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        # Never held while calling fetch or completing a Future: both may take other locks, such as a
+        # connection's, whose holders may in turn be waiting to store a reply here.
+        self._lock = threading.Lock()
+        # key -> (expires_at, reply), least recently used first
+        self._profiles = OrderedDict()
+        # key -> Future for a fetch in flight
+        self._fetching = {}
+
+    def get(self, recipient) -> dict:
+        "Return the recipient's profile, fetching it from signald if it isn't cached."
+        key = address_key(recipient)
+        with self._lock:
+            entry = self._profiles.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._profiles.move_to_end(key)
+                return entry[1]
+            future = self._fetching.get(key)
+            start = future is None
+            if start:
+                future = self._fetching[key] = Future()
+        if start:
+            self._start(key, recipient, future)
+        return future.result(timeout=self.timeout)
+
+    def prefetch(self, recipient):
+        "Start fetching the recipient's profile in the background, unless it is cached or already on its way."
+        key = address_key(recipient)
+        with self._lock:
+            entry = self._profiles.get(key)
+            start = (entry is None or entry[0] <= time.monotonic()) and key not in self._fetching
+            if start:
+                future = self._fetching[key] = Future()
+        if start:
+            self._start(key, recipient, future)
+
+    def invalidate(self, recipient=None):
+        "Forget the recipient's profile, or every profile if no recipient is given."
+        with self._lock:
+            if recipient is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(address_key(recipient), None)
+
+    def _start(self, key: str, recipient, future: Future):
+        "Fetch the recipient's profile into `future`, which is already in _fetching. Call without the lock held."
+        try:
+            fetched = self._fetch(recipient)
+        except Exception as e:
+            # Whoever waits on `future` gets the error instead.
+            fetched = Future()
+            fetched.set_exception(e)
+        fetched.add_done_callback(lambda f: self._store(key, future, f))
+
+    def _store(self, key: str, future: Future, fetched: Future):
+        with self._lock:
+            if self._fetching.get(key) is future:
+                del self._fetching[key]
+            if not fetched.cancelled() and fetched.exception() is None:
+                reply = fetched.result()
+                ttl = self.ttl if reply.get("data") else self.negative_ttl
+                self._profiles[key] = (time.monotonic() + ttl, reply)
+                self._profiles.move_to_end(key)
+                while len(self._profiles) > self.maxsize:
+                    self._profiles.popitem(last=False)
+
+        if fetched.cancelled():
+            future.cancel()
+        elif fetched.exception() is not None:
+            future.set_exception(fetched.exception())
+        else:
+            future.set_result(fetched.result())
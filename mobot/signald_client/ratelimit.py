@@ -0,0 +1,246 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from .connection import SignaldError
+
+# Text signald puts in the error when the Signal service pushes back.
+_THROTTLED = ("RateLimitException", "Rate limit exceeded", "413", "429")
+
+
+def is_throttled(error: Exception) -> bool:
+    """
+    Whether a failed command was turned away by the Signal service pushing back, and so is worth retrying
+    later. A command that timed out or lost its connection may still have been delivered, so it isn't.
+    """
+    return isinstance(error, SignaldError) and any(marker in str(error) for marker in _THROTTLED)
+
+
+def recipient_key(payload: dict) -> str:
+    "Who a command is going to, for per-recipient pacing and ordering."
+    recipient = payload.get("recipientGroupId") or payload.get("recipientAddress")
+    if isinstance(recipient, dict):
+        return recipient.get("number") or recipient.get("uuid")
+    return recipient
+
+
+class TokenBucket:
+    "Allows `rate` events per second on average, and bursts of up to `burst` at once."
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        "Seconds until a token is available."
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def full_at(self, now: float) -> float:
+        "When the bucket will be full again, if no more tokens are taken."
+        self._refill(now)
+        return now + max(0.0, self.burst - self._tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self._tokens -= 1
+
+
+class _Outgoing:
+    __slots__ = ("payload", "future", "attempts")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.future = Future()
+        self.attempts = 0
+
+
+class SendScheduler:
+    """
+    Paces outgoing commands to what signald and the Signal service will take.
+
+    Every command waits for a token from a global bucket and from its recipient's bucket. A recipient's commands
+    go out one at a time and in order, while different recipients are sent in parallel on `workers` threads. A
+    command that fails because it was throttled is retried after a jittered exponential backoff, holding back
+    the rest of that recipient's queue so their messages can't arrive out of order. It is dropped after
+    `max_retries` retries, or straight away if `max_queue` commands are already waiting. Any other failure,
+    such as a timeout, is final, since the command may have been delivered anyway.
+    """
+
+    def __init__(self, send: Callable[[dict], dict], rate: float = 20.0, burst: float = 40.0,
+                 recipient_rate: float = 1.0, recipient_burst: float = 5.0, workers: int = 4,
+                 max_queue: int = 10000, max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0,
+                 report_interval: Optional[float] = None):
+        self._send = send
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._global = TokenBucket(rate, burst)
+        self._buckets = {}  # type: Dict[str, TokenBucket]
+        # (full_at, recipient) for recipients whose queue emptied. A full bucket is no different from a new one,
+        # so theirs is forgotten once it has refilled, rather than kept for everyone ever messaged.
+        self._idle = []
+        # recipient -> their waiting commands, oldest first
+        self._queues = {}  # type: Dict[str, deque]
+        # (ready_at, seq, recipient) for every recipient with commands waiting and none in flight
+        self._ready = []
+        self._seq = itertools.count()
+        self._closed = False
+
+        self.queued = 0
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"send-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._workers:
+            thread.start()
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), name="send-report", daemon=True).start()
+
+    def submit(self, payload: dict) -> Future:
+        "Queue a command and return a Future for signald's reply."
+        outgoing = _Outgoing(payload)
+        recipient = recipient_key(payload)
+        with self._cond:
+            if self.queued >= self.max_queue:
+                self.dropped += 1
+                outgoing.future.set_exception(OverflowError("send queue is full"))
+                return outgoing.future
+
+            self.queued += 1
+            queue = self._queues.get(recipient)
+            if queue is None:
+                queue = self._queues[recipient] = deque()
+                self._schedule(recipient, time.monotonic())
+            queue.append(outgoing)
+            self._cond.notify()
+        return outgoing.future
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"queued": self.queued, "sent": self.sent, "retried": self.retried, "dropped": self.dropped}
+
+    def close(self, wait: bool = True):
+        "Stop the workers once everything already queued has been sent or dropped."
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._workers:
+                thread.join()
+
+    def _schedule(self, recipient: str, not_before: float):
+        """
+        Make a recipient's next command ready once their bucket allows it, and no sooner than `not_before`. Call
+        with the lock held.
+        """
+        # Buckets are only ever refilled up to the present: one refilled up to a retry's not_before would count
+        # the tokens it gains by then as available now.
+        now = time.monotonic()
+        self._forget_idle(now)
+        bucket = self._buckets.get(recipient)
+        if bucket is None:
+            bucket = self._buckets[recipient] = TokenBucket(self.recipient_rate, self.recipient_burst)
+        heapq.heappush(self._ready, (max(not_before, now + bucket.delay(now)), next(self._seq), recipient))
+
+    def _next(self):
+        "Wait for a recipient whose next command may go out now, and take a token for it. Call with the lock held."
+        while True:
+            if not self._ready:
+                if self._closed:
+                    return None
+                self._cond.wait()
+                continue
+
+            now = time.monotonic()
+            self._forget_idle(now)
+            ready_at, _seq, recipient = self._ready[0]
+            wait = max(ready_at - now, self._global.delay(now))
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+
+            heapq.heappop(self._ready)
+            self._global.take(now)
+            self._buckets[recipient].take(now)
+            return recipient, self._queues[recipient][0]
+
+    def _forget_idle(self, now: float):
+        "Drop the buckets of recipients with nothing queued once they have refilled. Call with the lock held."
+        while self._idle and self._idle[0][0] <= now:
+            _full_at, recipient = heapq.heappop(self._idle)
+            bucket = self._buckets.get(recipient)
+            # They may have sent more since this entry, and gone idle again with a later one.
+            if recipient not in self._queues and bucket is not None and bucket.full_at(now) <= now:
+                del self._buckets[recipient]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                taken = self._next()
+            if taken is None:
+                return
+
+            recipient, outgoing = taken
+            outgoing.attempts += 1
+            try:
+                reply = self._send(dict(outgoing.payload))
+            except Exception as e:  # noqa - Whatever went wrong belongs to the caller's Future.
+                error = e
+            else:
+                error = None
+
+            with self._cond:
+                now = time.monotonic()
+                if error is not None and is_throttled(error) and outgoing.attempts <= self.max_retries:
+                    self.retried += 1
+                    delay = min(self.max_backoff, self.backoff * 2 ** (outgoing.attempts - 1))
+                    self._schedule(recipient, now + delay * random.uniform(0.5, 1.5))
+                    self._cond.notify()
+                    continue
+
+                queue = self._queues[recipient]
+                queue.popleft()
+                self.queued -= 1
+                if queue:
+                    self._schedule(recipient, now)
+                else:
+                    del self._queues[recipient]
+                    heapq.heappush(self._idle, (self._buckets[recipient].full_at(now), recipient))
+                self._cond.notify()
+
+            if error is None:
+                with self._cond:
+                    self.sent += 1
+                outgoing.future.set_result(reply)
+            else:
+                with self._cond:
+                    self.dropped += 1
+                print(f"Dropping {outgoing.payload.get('type')} to {recipient}: {error}")
+                outgoing.future.set_exception(error)
+
+    def _report(self, interval: float):
+        while not self._closed:
+            time.sleep(interval)
+            print("send queue: queued={queued} sent={sent} retried={retried} dropped={dropped}".format(**self.stats()))
@@ -0,0 +1,89 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import threading
+import time
+from typing import Callable, Dict, List
+
+from .types import address_key
+
+
+class _Pending:
+    __slots__ = ("recipient", "timestamps", "deadline")
+
+    def __init__(self, recipient, deadline: float, timestamps: List[int] = None):
+        self.recipient = recipient
+        self.timestamps = timestamps or []
+        self.deadline = deadline
+
+
+class ReceiptBatcher:
+    """
+    Coalesces read receipts into one mark_read per recipient.
+
+    Timestamps are buffered per recipient and sent together `window` seconds after the first one arrived, or as
+    soon as `max_batch` of them are waiting. close() sends whatever is still buffered.
+    """
+
+    def __init__(self, send: Callable[[object, List[int]], object], window: float = 1.0, max_batch: int = 20):
+        self._send = send
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        # recipient key -> receipts waiting for them
+        self._pending = {}  # type: Dict[str, _Pending]
+        self._thread = None
+        self._closed = False
+
+    def add(self, recipient, timestamp: int):
+        "Buffer a receipt for a message `recipient` sent at `timestamp`."
+        key = address_key(recipient)
+        with self._cond:
+            if self._closed:
+                # Too late to batch it with anything, so send it on its own, once the lock is released.
+                pending, full = _Pending(recipient, 0.0, [timestamp]), True
+            else:
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = _Pending(recipient, time.monotonic() + self.window)
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name="receipts", daemon=True)
+                        self._thread.start()
+                    self._cond.notify()
+                pending.timestamps.append(timestamp)
+                full = len(pending.timestamps) >= self.max_batch
+                if full:
+                    del self._pending[key]
+
+        if full:
+            self._flush(pending)
+
+    def close(self):
+        "Send every buffered receipt now and stop the background thread."
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _flush(self, pending: _Pending):
+        try:
+            self._send(pending.recipient, pending.timestamps)
+        except Exception as e:  # noqa - A lost receipt only costs a checkmark.
+            print(e)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [key for key, pending in self._pending.items() if self._closed or pending.deadline <= now]
+                batches = [self._pending.pop(key) for key in due]
+                if not batches:
+                    if self._closed:
+                        return
+                    next_deadline = min((p.deadline for p in self._pending.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                    continue
+
+            for pending in batches:
+                self._flush(pending)
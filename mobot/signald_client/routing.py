@@ -0,0 +1,125 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Flags that can be scoped to one alternative of the combined pattern with (?flags:...).
+_SCOPED_FLAGS = ((re.I, "i"), (re.M, "m"), (re.S, "s"), (re.X, "x"))
+# Group references can't survive being renumbered inside the combined pattern.
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class Route:
+    "One registered chat handler."
+
+    __slots__ = ("rank", "regex", "func", "keyword")
+
+    def __init__(self, rank: Tuple[int, int], regex, func: Callable, keyword: Optional[str] = None):
+        self.rank = rank
+        self.regex = regex
+        self.func = func
+        self.keyword = keyword
+
+
+def keyword_regex(word: str):
+    "The regex a command word stands for: the whole message is the word, ignoring case and surrounding space."
+    return re.compile(r"\A\s*" + re.escape(word) + r"\s*\Z", re.I)
+
+
+def _scoped(regex) -> Optional[str]:
+    "Rewrite a compiled regex so it keeps its flags inside a larger pattern, or None if it can't be."
+    flags = regex.flags & ~re.U
+    letters = ""
+    for flag, letter in _SCOPED_FLAGS:
+        if flags & flag:
+            letters += letter
+            flags &= ~flag
+    if flags or _GROUP_REFERENCE.search(regex.pattern):
+        return None
+    return f"(?{letters}:{regex.pattern})" if letters else f"(?:{regex.pattern})"
+
+
+class Router:
+    """
+    A routing table for chat handlers, compiled once from the registered routes.
+
+    Command words are looked up in a dict by the whole message text. Every other pattern goes into one combined
+    regex, anchored at the start of the message, with one alternative per handler in priority order:
+
+        \\A(?:(?=[\\s\\S]*?(?:pattern0))(?P<_0>)|(?=[\\s\\S]*?(?:pattern1))(?P<_1>)|...)
+
+    The first alternative whose lookahead finds its pattern anywhere in the message wins, so a single search
+    reports the highest-priority pattern handler that matches, just as trying each handler in turn would.
+    Patterns that can't share a regex (unscopable flags, group references) are searched one by one.
+    """
+
+    def __init__(self, routes: List[Route]):
+        self._routes = sorted(routes, key=lambda route: route.rank)
+        self._keywords = {}  # type: Dict[str, List[int]]
+        self._separate = []  # type: List[int]
+        alternatives = []
+        # combined regex group name -> index into self._routes
+        self._groups = {}  # type: Dict[str, int]
+
+        for i, route in enumerate(self._routes):
+            if route.keyword is not None:
+                self._keywords.setdefault(route.keyword.lower(), []).append(i)
+                continue
+
+            scoped = _scoped(route.regex)
+            if scoped is None:
+                self._separate.append(i)
+                continue
+
+            name = f"_{i}"
+            self._groups[name] = i
+            alternatives.append(f"(?=[\\s\\S]*?{scoped})(?P<{name}>)")
+
+        self._combined = None
+        if alternatives:
+            try:
+                self._combined = re.compile(r"\A(?:" + "|".join(alternatives) + ")")
+            except re.error:
+                # e.g. two patterns that use the same group name
+                self._separate = sorted(self._separate + list(self._groups.values()))
+                self._groups = {}
+
+    def _first(self, text: str) -> Optional[int]:
+        "The index of the highest-priority route matching `text`, if any."
+        candidates = []
+
+        indexes = self._keywords.get(text.strip().lower())
+        if indexes:
+            candidates.append(indexes[0])
+
+        if self._combined is not None:
+            hit = self._combined.match(text)
+            if hit is not None:
+                candidates.append(self._groups[hit.lastgroup])
+
+        for i in self._separate:
+            if candidates and i > min(candidates):
+                break
+            if self._routes[i].regex.search(text):
+                candidates.append(i)
+                break
+
+        return min(candidates) if candidates else None
+
+    def matches(self, text: str) -> Iterator[Tuple[Callable, "re.Match"]]:
+        """
+        Yield (handler, match) for every route that matches `text`, highest priority first.
+
+        Finding the first one costs a dict lookup and one regex search. Handlers that ask to keep matching are
+        rare, so the routes after the first are simply tried in order.
+        """
+        first = self._first(text)
+        if first is None:
+            return
+
+        yield self._routes[first].func, self._routes[first].regex.search(text)
+
+        for route in self._routes[first + 1:]:
+            match = route.regex.search(text)
+            if match:
+                yield route.func, match
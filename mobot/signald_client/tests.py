@@ -0,0 +1,626 @@
+# Copyright (c) 2021 MobileCoin. All rights reserved.
+
+import asyncio
+import importlib
+import importlib.util
+import json
+import re
+import socket
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from .async_main import AsyncSignal
+from .connection import CommandConnection, SignaldError
+from . import jsonlib
+from .dispatch import Dispatcher
+from .main import parse_message
+from .profiles import ProfileCache
+from .ratelimit import SendScheduler
+from .receipts import ReceiptBatcher
+from .routing import Route, Router, keyword_regex
+from .types import Message
+
+
+class FakeSignald:
+    "The far end of a socket pair, standing in for signald."
+
+    def __init__(self):
+        self.sock = None
+        self.connections = 0
+
+    def connect(self) -> socket.socket:
+        ours, self.sock = socket.socketpair()
+        self.connections += 1
+        return ours
+
+    def read(self) -> dict:
+        line = bytearray()
+        while not line.endswith(b"\n"):
+            line += self.sock.recv(1)
+        return json.loads(line)
+
+    def reply(self, **reply):
+        self.sock.sendall(json.dumps(reply).encode() + b"\n")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+def held_elsewhere(lock) -> bool:
+    "Whether another thread holds `lock`. Asked from a new thread, so an RLock held by this one counts."
+    acquired = []
+
+    def try_lock():
+        if lock.acquire(timeout=0.5):
+            acquired.append(True)
+            lock.release()
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return not acquired
+
+
+class CommandConnectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.signald = FakeSignald()
+        self.addCleanup(self.signald.close)
+
+    def connection(self, **kwargs) -> CommandConnection:
+        connection = CommandConnection(self.signald.connect, **kwargs)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_replies_are_matched_to_commands_by_id(self):
+        connection = self.connection()
+        first = connection.send({"id": "1", "type": "get_profile"})
+        second = connection.send({"id": "2", "type": "get_profile"})
+        self.assertEqual([self.signald.read()["id"], self.signald.read()["id"]], ["1", "2"])
+
+        self.signald.reply(type="version")
+        self.signald.reply(id="2", type="profile", data={"name": "second"})
+        self.signald.reply(id="1", type="unexpected_error", data={"message": "no such user"})
+
+        self.assertEqual(second.result(timeout=5)["data"], {"name": "second"})
+        with self.assertRaises(SignaldError):
+            first.result(timeout=5)
+
+    def test_commands_from_many_threads_share_one_connection(self):
+        connection = self.connection()
+        futures = {}
+
+        def send(n):
+            futures[n] = connection.send({"id": str(n), "type": "get_profile"})
+
+        threads = [threading.Thread(target=send, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ids = [self.signald.read()["id"] for _ in range(20)]
+        for msg_id in reversed(ids):
+            self.signald.reply(id=msg_id, type="profile", data={"n": msg_id})
+
+        self.assertEqual({n: future.result(timeout=5)["data"]["n"] for n, future in futures.items()},
+                         {n: str(n) for n in range(20)})
+        self.assertEqual(self.signald.connections, 1)
+
+    def test_commands_in_flight_fail_when_signald_hangs_up_and_the_next_send_reconnects(self):
+        connection = self.connection()
+        pending = connection.send({"id": "1", "type": "get_profile"})
+        self.signald.sock.close()
+
+        with self.assertRaises(ConnectionResetError):
+            pending.result(timeout=5)
+        connection.send({"id": "2", "type": "get_profile"})
+        self.assertEqual(self.signald.connections, 2)
+        self.assertEqual(self.signald.read()["id"], "2")
+
+    def test_overdue_replies_are_failed_after_the_lock_is_released(self):
+        connection = self.connection(reply_timeout=0)
+        overdue = connection.send({"id": "1", "type": "get_profile"})
+        locked = []
+        # Whichever thread finds it overdue, this send's or the expiry thread, mustn't be holding the lock.
+        overdue.add_done_callback(lambda f: locked.append(connection._lock._is_owned()))
+
+        connection.send({"id": "2", "type": "get_profile"})
+
+        with self.assertRaises(TimeoutError):
+            overdue.result(timeout=2)
+        self.assertEqual(locked, [False])
+
+    def test_overdue_replies_fail_without_another_send(self):
+        connection = self.connection(reply_timeout=0.05)
+        overdue = connection.send({"id": "1", "type": "get_profile"})
+
+        error = overdue.exception(timeout=2)
+        self.assertIsInstance(error, TimeoutError)
+        self.assertEqual(str(error), "no reply from signald for 1")
+
+
+class JsonTests(unittest.TestCase):
+
+    ENVELOPES = (
+        b'{"type":"message","data":{"source":{"number":"+447111111111"}}}',
+        b'{"data":{"source":{"number":"+447111111111"}},"type":"message"}',
+        b'{"data": {"type": "sticker"}, "type" : "unreadable_message"}',
+        b'{ "type"\t:\t"unreadable_message", "data": {} }',
+    )
+    OTHER_LINES = (
+        b'{"type":"version","data":{"name":"signald","version":"0.13.1"}}',
+        b'{"type":"listen_started","data":"+447000000000"}',
+        b'{"type":"subscribed"}',
+        b'{"type":"messages","data":{}}',
+        b'{"type":"message_receipt","data":{}}',
+        b'{"data":{"body":"message"},"kind":"message"}',
+    )
+
+    def backends(self):
+        "Yield the name of each JSON backend that is installed, with jsonlib loaded from it."
+        self.addCleanup(importlib.reload, jsonlib)
+        for name, blocked in (("orjson", ()), ("ujson", ("orjson",)), ("json", ("orjson", "ujson"))):
+            if name != "json" and importlib.util.find_spec(name) is None:
+                continue
+            with mock.patch.dict(sys.modules, dict.fromkeys(blocked)):
+                importlib.reload(jsonlib)
+                self.assertEqual(jsonlib.loads.__module__.split(".")[0], name)
+            yield name
+
+    def test_the_prefilter_passes_the_envelopes_we_act_on(self):
+        for line in self.ENVELOPES:
+            self.assertTrue(jsonlib.wanted_envelope(line), line)
+
+    def test_the_prefilter_skips_every_other_type(self):
+        for line in self.OTHER_LINES:
+            self.assertFalse(jsonlib.wanted_envelope(line), line)
+
+    def test_a_message_that_passes_the_prefilter_is_parsed(self):
+        line = jsonlib.dumps_line(envelope("+447111111111", "hi"))
+        self.assertTrue(jsonlib.wanted_envelope(line))
+
+        message = parse_message(jsonlib.loads(line))
+        self.assertEqual((message.source, message.text, message.payment), ({"number": "+447111111111"}, "hi", None))
+        self.assertFalse(hasattr(message, "__dict__"))
+
+    def test_every_backend_reads_and_writes_lines_the_same(self):
+        payload = {"type": "send", "recipientAddress": {"number": "+447111111111"},
+                   "messageBody": "caf\u00e9\n\U0001f600"}
+        tried = []
+        for name in self.backends():
+            tried.append(name)
+            line = jsonlib.dumps_line(payload)
+            self.assertEqual(line.count(b"\n"), 1, name)
+            self.assertTrue(line.endswith(b"\n"), name)
+            self.assertEqual(jsonlib.loads(line), payload, name)
+            self.assertEqual(json.loads(line), payload, name)
+            with self.assertRaises(ValueError):
+                jsonlib.loads(b'{"type": "message"')
+
+            for line in self.ENVELOPES:
+                self.assertEqual(jsonlib.loads(line), json.loads(line), name)
+            self.assertTrue(jsonlib.wanted_envelope(jsonlib.dumps_line({"data": {}, "type": "message"})), name)
+        self.assertIn("json", tried)
+
+
+class ProfileCacheTests(unittest.TestCase):
+
+    def test_fetches_once_and_serves_from_cache(self):
+        fetched = []
+
+        def fetch(recipient):
+            fetched.append(recipient)
+            future = Future()
+            future.set_result({"data": {"name": recipient}})
+            return future
+
+        cache = ProfileCache(fetch)
+        cache.prefetch("+447111111111")
+        self.assertEqual(cache.get("+447111111111"), {"data": {"name": "+447111111111"}})
+        self.assertEqual(fetched, ["+447111111111"])
+
+    def test_fetches_without_the_lock_held(self):
+        locked = []
+
+        def fetch(recipient):
+            locked.append(held_elsewhere(cache._lock))
+            future = Future()
+            future.set_result({"data": {}})
+            return future
+
+        cache = ProfileCache(fetch)
+        cache.get("+447111111111")
+        self.assertEqual(locked, [False])
+
+    def test_a_failing_fetch_reaches_the_caller_and_is_not_cached(self):
+        def fetch(recipient):
+            raise ConnectionRefusedError("signald is down")
+
+        cache = ProfileCache(fetch)
+        with self.assertRaises(ConnectionRefusedError):
+            cache.get("+447111111111")
+        self.assertEqual(cache._fetching, {})
+
+
+class RouterTests(unittest.TestCase):
+    "Router has to find the same handlers, with the same matches, as trying every route in order would."
+
+    TEXTS = ("help", "  HELP ", "help me", "Hello there", "bookkeeper", "START", "restart", "no\npay now",
+             "pay", "5 mob", "stop help", "Stop", "", "x", "\u00e9\u00e9", "mob 5")
+
+    @staticmethod
+    def routes(*specs) -> list:
+        "A route per (name, regex or command word, order), registered in the order given as Signal would."
+        routes = []
+        for name, pattern, order in specs:
+            rank = (order, len(routes))
+            if isinstance(pattern, str):
+                routes.append(Route(rank, keyword_regex(pattern), name, pattern))
+            else:
+                routes.append(Route(rank, pattern, name))
+        return routes
+
+    def assert_matches_linear_scan(self, routes):
+        router = Router(routes)
+        for text in self.TEXTS:
+            expected = [(route.func, match.span(), match.groups())
+                        for route in sorted(routes, key=lambda route: route.rank)
+                        for match in [route.regex.search(text)] if match]
+            self.assertEqual([(func, match.span(), match.groups()) for func, match in router.matches(text)],
+                             expected, text)
+
+    def test_command_words_and_patterns(self):
+        self.assert_matches_linear_scan(self.routes(
+            ("help word", "help", 100),
+            ("help pattern", re.compile(r"\bhelp\b"), 50),
+            ("stop word", "stop", 100),
+            ("stop pattern", re.compile("stop"), 200),
+            ("anything", re.compile("."), 300),
+        ))
+
+    def test_inline_flags(self):
+        self.assert_matches_linear_scan(self.routes(
+            ("inline ignorecase", re.compile("(?i)start"), 100),
+            ("inline multiline", re.compile("(?m)^pay"), 100),
+            ("case sensitive", re.compile("Stop|hello"), 100),
+        ))
+
+    def test_flags(self):
+        self.assert_matches_linear_scan(self.routes(
+            ("ignorecase", re.compile("hello", re.I), 100),
+            ("multiline", re.compile("^pay", re.M), 100),
+            ("dotall verbose", re.compile(r"no . pay", re.S | re.X), 100),
+            ("ascii", re.compile(r"\w\w", re.A), 100),
+            ("unicode", re.compile(r"\w\w"), 150),
+        ))
+
+    def test_groups_and_group_references(self):
+        self.assert_matches_linear_scan(self.routes(
+            ("double letter", re.compile(r"(\w)\1"), 100),
+            ("named", re.compile(r"(?P<amount>\d+) mob"), 100),
+            ("named reference", re.compile(r"(?P<letter>e)(?P=letter)"), 50),
+            ("unnamed", re.compile(r"(m)o(b)"), 150),
+        ))
+
+    def test_patterns_sharing_a_group_name(self):
+        self.assert_matches_linear_scan(self.routes(
+            ("amount first", re.compile(r"mob (?P<amount>\d+)"), 100),
+            ("amount last", re.compile(r"(?P<amount>\d+) mob"), 100),
+            ("help word", "help", 100),
+        ))
+
+
+class ReceiptBatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.locked = []
+
+    def send(self, recipient, timestamps):
+        self.locked.append(held_elsewhere(self.batcher._cond))
+        self.sent.append((recipient["number"], timestamps))
+
+    def receipts(self, **kwargs) -> ReceiptBatcher:
+        self.batcher = ReceiptBatcher(self.send, **kwargs)
+        self.addCleanup(self.batcher.close)
+        return self.batcher
+
+    def test_sends_each_recipients_receipts_together_after_the_window(self):
+        receipts = self.receipts(window=0.05)
+        receipts.add({"number": "+447111111111"}, 1)
+        receipts.add({"number": "+447111111111"}, 2)
+        receipts.add({"number": "+447222222222"}, 3)
+        self.assertEqual(self.sent, [])
+
+        time.sleep(0.2)
+        self.assertEqual(sorted(self.sent), [("+447111111111", [1, 2]), ("+447222222222", [3])])
+        self.assertEqual(self.locked, [False, False])
+
+    def test_sends_a_full_batch_straight_away(self):
+        receipts = self.receipts(window=3600, max_batch=3)
+        for timestamp in (1, 2, 3, 4):
+            receipts.add({"number": "+447111111111"}, timestamp)
+        self.assertEqual(self.sent, [("+447111111111", [1, 2, 3])])
+        self.assertEqual(self.locked, [False])
+
+    def test_close_sends_what_is_buffered_and_later_receipts_go_alone(self):
+        receipts = self.receipts(window=3600)
+        receipts.add({"number": "+447111111111"}, 1)
+        receipts.close()
+        self.assertEqual(self.sent, [("+447111111111", [1])])
+
+        receipts.add({"number": "+447111111111"}, 2)
+        self.assertEqual(self.sent, [("+447111111111", [1]), ("+447111111111", [2])])
+        self.assertEqual(self.locked, [False, False])
+
+
+class SendSchedulerTests(unittest.TestCase):
+
+    def scheduler(self, send, **kwargs) -> SendScheduler:
+        kwargs = dict(dict(rate=1000, burst=1000, recipient_rate=1000, recipient_burst=5, backoff=0.001), **kwargs)
+        scheduler = SendScheduler(send, **kwargs)
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    @staticmethod
+    def message(number, text="hi") -> dict:
+        return {"type": "send", "recipientAddress": {"number": number}, "messageBody": text}
+
+    def test_throttled_sends_are_retried_in_order(self):
+        sent = []
+        throttle = [SignaldError({"data": {"message": "RateLimitException"}})]
+
+        def send(payload):
+            if throttle:
+                raise throttle.pop()
+            sent.append(payload["messageBody"])
+            return {"id": payload["messageBody"]}
+
+        scheduler = self.scheduler(send)
+        futures = [scheduler.submit(self.message("+447111111111", text)) for text in ("one", "two")]
+
+        self.assertEqual([future.result(timeout=5)["id"] for future in futures], ["one", "two"])
+        self.assertEqual(sent, ["one", "two"])
+        self.assertEqual(scheduler.stats()["retried"], 1)
+
+    def test_a_send_that_timed_out_is_not_sent_again(self):
+        calls = []
+
+        def send(payload):
+            calls.append(payload)
+            raise TimeoutError("no reply from signald")
+
+        scheduler = self.scheduler(send)
+        with self.assertRaises(TimeoutError):
+            scheduler.submit(self.message("+447111111111")).result(timeout=5)
+        self.assertEqual(len(calls), 1)
+
+    def test_scheduling_a_retry_for_later_leaves_the_bucket_as_it_is_now(self):
+        scheduler = self.scheduler(lambda payload: {}, recipient_rate=1, recipient_burst=5)
+        with scheduler._cond:
+            not_before = time.monotonic() + 10
+            scheduler._schedule("+447111111111", not_before)
+            self.assertEqual(scheduler._ready[0][0], not_before)
+            # Nothing is queued for them, so don't leave a worker waiting to send it.
+            scheduler._ready.clear()
+
+        bucket = scheduler._buckets["+447111111111"]
+        for _ in range(4):
+            bucket.take(time.monotonic())
+        self.assertEqual(bucket.delay(time.monotonic()), 0.0)
+
+    def test_forgets_recipients_once_their_bucket_has_refilled(self):
+        scheduler = self.scheduler(lambda payload: {})
+        for n in range(50):
+            scheduler.submit(self.message(f"+4471{n:09}")).result(timeout=5)
+        time.sleep(0.05)
+
+        scheduler.submit(self.message("+447000000000")).result(timeout=5)
+        with scheduler._cond:
+            self.assertLessEqual(set(scheduler._buckets), {"+447000000000"})
+
+
+class DispatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.handled = []
+        self.gate = threading.Event()
+
+    def handle(self, message: Message):
+        if message.text == "gate":
+            self.assertTrue(self.gate.wait(5))
+        else:
+            self.handled.append(message.text)
+
+    def dispatcher(self, **kwargs) -> Dispatcher:
+        dispatcher = Dispatcher(self.handle, **kwargs)
+        self.addCleanup(dispatcher.close)
+        # Cleanups run last first, so a test that fails with the gate shut doesn't hang closing.
+        self.addCleanup(self.gate.set)
+        return dispatcher
+
+    @staticmethod
+    def message(number, text, payment=None) -> Message:
+        return Message(username="+447000000000", source={"number": number}, text=text, payment=payment or {})
+
+    def run_behind_gate(self, dispatcher, *messages):
+        "Hold the only worker on a gate message while `messages` are queued, then let it go and wait for them."
+        dispatcher.submit(self.message("+447999999999", "gate"))
+        for message in messages:
+            dispatcher.submit(message)
+        self.gate.set()
+        dispatcher.close()
+
+    def test_each_senders_messages_are_handled_in_order_across_workers(self):
+        dispatcher = self.dispatcher(chat_workers=4, payment_workers=1)
+        for n in range(50):
+            for number in ("+447111111111", "+447222222222", "+447333333333"):
+                dispatcher.submit(self.message(number, f"{number} {n}", payment={"n": n} if n % 5 == 0 else None))
+        dispatcher.close()
+
+        for number in ("+447111111111", "+447222222222", "+447333333333"):
+            self.assertEqual([text for text in self.handled if text.startswith(number)],
+                             [f"{number} {n}" for n in range(50)])
+
+    def test_payments_are_served_ahead_of_chat(self):
+        dispatcher = self.dispatcher(chat_workers=1, payment_workers=0)
+        self.run_behind_gate(dispatcher, self.message("+447111111111", "chat"),
+                             self.message("+447222222222", "payment", payment={"receipt": "receipt"}))
+        self.assertEqual(self.handled, ["payment", "chat"])
+
+    def test_chat_that_has_waited_too_long_goes_first(self):
+        dispatcher = self.dispatcher(chat_workers=1, payment_workers=0, max_chat_wait=0)
+        self.run_behind_gate(dispatcher, self.message("+447111111111", "chat"),
+                             self.message("+447222222222", "payment", payment={"receipt": "receipt"}))
+        self.assertEqual(self.handled, ["chat", "payment"])
+
+    def test_a_call_runs_between_the_senders_messages_around_it(self):
+        dispatcher = self.dispatcher(chat_workers=2, payment_workers=2)
+        dispatcher.submit(self.message("+447111111111", "first"))
+        dispatcher.submit_call("+447111111111", self.handled.append, "call")
+        dispatcher.submit(self.message("+447111111111", "second"))
+        dispatcher.close()
+        self.assertEqual(self.handled, ["first", "call", "second"])
+
+
+def envelope(number: str, text: str) -> dict:
+    "A message from `number` as signald delivers it."
+    return {"type": "message", "data": {"username": "+447000000000", "source": {"number": number}, "sourceDevice": 1,
+                                        "timestampISO": "2021-05-01T12:00:00.000Z",
+                                        "dataMessage": {"body": text, "timestamp": 1}}}
+
+
+class AsyncSignalTests(unittest.TestCase):
+    """
+    Runs run_chat against an asyncio socket pair standing in for signald. The first stream the client opens is
+    its subscription, which the test writes envelopes to; every command it sends afterwards gets a reply.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.handled = []
+
+    def signal(self, **kwargs) -> AsyncSignal:
+        subscription, self.subscription = socket.socketpair()
+        self.addCleanup(subscription.close)
+        streams = [subscription]
+
+        async def open_streams():
+            if streams:
+                return await asyncio.open_connection(sock=streams.pop())
+            ours, theirs = socket.socketpair()
+            self.loop.create_task(self.answer(theirs))
+            return await asyncio.open_connection(sock=ours)
+
+        # Command connections are made with the client, so patch the class rather than the instance.
+        patcher = mock.patch.object(AsyncSignal, "_open_streams", lambda signal: open_streams())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return AsyncSignal("+447000000000", **kwargs)
+
+    async def answer(self, sock: socket.socket):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(json.dumps({"id": json.loads(line)["id"], "type": "send_results"}).encode() + b"\n")
+        finally:
+            writer.close()
+
+    async def deliver(self, *envelopes):
+        for env in envelopes:
+            self.subscription.sendall(json.dumps(env).encode() + b"\n")
+        # Give run_chat a chance to read them.
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+
+    def run_chat(self, signal: AsyncSignal, test):
+        "Run run_chat alongside the coroutine test(), then hang up and return once every handler has finished."
+        async def run():
+            chat = self.loop.create_task(signal.run_chat())
+            try:
+                await asyncio.wait_for(test(), 5)
+            finally:
+                self.subscription.close()
+                with self.assertRaises(ConnectionResetError):
+                    await asyncio.wait_for(chat, 5)
+                if signal._tails:
+                    await asyncio.wait_for(asyncio.wait(list(signal._tails.values())), 5)
+                next(signal._connections).close()
+
+        self.loop.run_until_complete(run())
+        # What's left is the fake signald's side of the command connection and the reader for its replies.
+        leftover = asyncio.all_tasks(self.loop)
+        for task in leftover:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*leftover, return_exceptions=True))
+        # Let the closed transports finish closing.
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_each_senders_messages_are_handled_in_order(self):
+        signal = self.signal()
+        first_done = asyncio.Event()
+
+        @signal.chat_handler(".")
+        async def handle(message, match):
+            if message.text == "first":
+                await asyncio.sleep(0.05)
+                first_done.set()
+            self.handled.append((message.text, first_done.is_set()))
+            return None
+
+        async def test():
+            await self.deliver(envelope("+447111111111", "first"), envelope("+447111111111", "second"),
+                               envelope("+447222222222", "other"))
+            await first_done.wait()
+
+        self.run_chat(signal, test)
+        self.assertEqual(self.handled, [("other", False), ("first", True), ("second", True)])
+
+    def test_stops_reading_with_max_in_flight_messages_being_handled(self):
+        signal = self.signal(max_in_flight=2)
+        gate = asyncio.Event()
+
+        @signal.chat_handler(".")
+        async def handle(message, match):
+            self.handled.append(message.text)
+            await gate.wait()
+
+        async def test():
+            await self.deliver(*[envelope(f"+44711111111{n}", str(n)) for n in range(5)])
+            self.assertEqual(self.handled, ["0", "1"])
+            gate.set()
+            await self.deliver()
+            self.assertEqual(self.handled, ["0", "1", "2", "3", "4"])
+
+        self.run_chat(signal, test)
+
+    def test_a_call_runs_between_the_senders_messages_around_it(self):
+        signal = self.signal()
+        gate = asyncio.Event()
+
+        @signal.chat_handler(".")
+        async def handle(message, match):
+            if message.text == "first":
+                await gate.wait()
+            self.handled.append(message.text)
+
+        async def test():
+            await self.deliver(envelope("+447111111111", "first"))
+            # From another thread, as the payout queue does.
+            await self.loop.run_in_executor(None, signal.run_in_order, {"number": "+447111111111"},
+                                            self.handled.append, "call")
+            await self.deliver(envelope("+447111111111", "second"))
+            gate.set()
+            await self.deliver()
+
+        self.run_chat(signal, test)
+        self.assertEqual(self.handled, ["first", "call", "second"])
@@ -3,7 +3,7 @@
 import attr
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Attachment:
     content_type = attr.ib(type=str)
     id = attr.ib(type=str)
@@ -11,7 +11,7 @@ class Attachment:
     stored_filename = attr.ib(type=str)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Message:
     username = attr.ib(type=str)
     source = attr.ib(type=str)
@@ -21,7 +21,14 @@ class Message:
     timestamp_iso = attr.ib(type=str, default=None)
     expiration_secs = attr.ib(type=int, default=0)
     is_receipt = attr.ib(type=bool, default=False)
-    attachments = attr.ib(type=list, default=[])
+    attachments = attr.ib(type=list, factory=list)
     quote = attr.ib(type=str, default=None)
-    group_info = attr.ib(type=dict, default={})
-    payment = attr.ib(type=dict, default={})
+    group_info = attr.ib(type=dict, factory=dict)
+    payment = attr.ib(type=dict, factory=dict)
+
+
+def address_key(address) -> str:
+    "A hashable key for a Signal address: its number, or its uuid if the number is hidden."
+    if isinstance(address, dict):
+        return address.get("number") or address.get("uuid")
+    return address